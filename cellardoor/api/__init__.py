@@ -15,6 +15,9 @@ class API(object):
 		self.Interface = type('Interface', (Interface,), {'api':self})
 		self.interfaces = {}
 		self.interfaces_by_entity = {}
+		# Set by the integrations when a view needs the items of lists 
+		# prepared, so they aren't copied into `PreparedItem`s otherwise
+		self.prepare_list_items = False
 		
 		
 	def add_interface(self, interface):
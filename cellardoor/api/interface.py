@@ -5,7 +5,10 @@ import inspect
 from ..model import ListOf, Link, InverseLink
 from .. import errors
 from .methods import *
-from ..authorization import AuthorizationExpression
+from ..authorization import AuthorizationExpression, item_filter
+from ..storage import PRIMARY
+from ..storage.search import AFTER
+from ..storage.loader import Loader
 
 __all__ = [
 	'Interface'
@@ -49,7 +52,9 @@ class InterfaceType(type):
 		cls.singular_name = singular_name
 		cls.plural_name = plural_name
 		cls.rules = RuleSet(members.get('method_authorization'))
+		cls.read_preferences = get_read_preferences(members.get('read_preference'))
 		cls.storage = storage
+		cls.root_entity_name = entity.hierarchy[0].__name__ if entity.hierarchy else entity.__name__
 		
 		hidden_fields = set(entity.hidden_fields.copy())
 		for c in entity.children:
@@ -63,13 +68,32 @@ class InterfaceType(type):
 		    enabled_sort=members.get('enabled_sort', ()),
 		    default_sort=members.get('default_sort', ()),
 		    default_limit=members.get('default_limit', 0),
-		    max_limit=members.get('max_limit', 100)
+		    max_limit=members.get('max_limit', 100),
+		    export_authorization=members.get('export_authorization')
 		)
 		
 		cls.api.add_interface(cls)
 		
 		
 		
+class PreparedItem(dict):
+	"""
+	An item that's ready to be sent. It's a plain dict, apart from knowing 
+	which entity's collection it came from, so that views can tell items 
+	apart when they cache their serialized forms, and serializers can 
+	encode them knowing their fields. It's `personal` if it was read for an 
+	identity, whose rules and hooks may have changed it.
+	
+	Single items are always prepared. The items of lists only are if 
+	`API.prepare_list_items` is set.
+	"""
+	
+	entity = None
+	entity_name = None
+	personal = False
+	
+	
+	
 class Interface(object):
 	
 	__metaclass__ = InterfaceType
@@ -82,6 +106,12 @@ class Interface(object):
 	# and the value is an authorization rule.
 	method_authorization = None
 	
+	# A dict of storage read preferences, e.g., `cellardoor.storage.SECONDARY`. The key is a 
+	# `cellardoor.method` or a tuple of methods, like `method_authorization`. `cellardoor.method.COUNT`
+	# can be used to route counts separately from lists. Reads that happen after a write in 
+	# the same call always use `cellardoor.storage.PRIMARY`.
+	read_preference = None
+	
 	# A `cellardoor.authorization.AuthenticationExpression` that must be met for hidden fields to be shown.
 	hidden_field_authorization = None
 	
@@ -98,6 +128,10 @@ class Interface(object):
 	default_limit = 0
 	max_limit = 100
 	
+	# A `cellardoor.authorization.AuthenticationExpression` that must be met for a list 
+	# to go past `max_limit`, e.g., for clients that export whole collections.
+	export_authorization = None
+	
 	# HOOKS
 	
 	def before_get(self, identity, id):
@@ -116,7 +150,9 @@ class Interface(object):
 		pass
 		
 	
-	def before_update(self, identity, id, fields):
+	# Atomic updates that don't need to read the item first 
+	# are given an item with only an `_id`.
+	def before_update(self, identity, item, fields):
 	    pass
 	    
 	    
@@ -144,6 +180,8 @@ class Interface(object):
 		for method in ALL:
 			if method not in self.rules.enabled_methods:
 				setattr(self, method, self.disabled_method_error)
+		if LIST not in self.rules.enabled_methods:
+			self.stream = self.disabled_method_error
 			
 			
 	def set_storage(self, storage):
@@ -159,7 +197,7 @@ class Interface(object):
 		
 		self.before_get(options.context.get('identity'), id)
 		
-		item = self.storage.get_by_id(self.entity, id)
+		item = options.loader.load(self.entity, id, **self.read_options(GET, options))
 		if item is None:
 			raise errors.NotFoundError("No %s with id '%s' was found" % (self.singular_name, id))
 		
@@ -171,6 +209,25 @@ class Interface(object):
 		return self.post(GET, options, item)
 		
 			
+	def embedded_links(self, item, **kwargs):
+		"""Get the names of the links a `get` with the same arguments would embed in an item"""
+		options = self.options_factory.create(kwargs)
+		if not options.allow_embedding:
+			return set()
+		_, embed = options.get_embed_for_type(self.entity, item.get('_type', self.entity.__name__))
+		return set(embed)
+		
+		
+	def embed(self, item, **kwargs):
+		"""
+		Embed links in an item that was got with `allow_embedding=False`, as a 
+		`get` with the same arguments would have, without reading it again.
+		"""
+		options = self.options_factory.create(kwargs)
+		self.add_embedded_links(item, options)
+		return item
+		
+		
 	def list(self, **kwargs):
 		options = self.options_factory.create(kwargs, list=True)
 		
@@ -179,10 +236,16 @@ class Interface(object):
 		
 		self.before_list(options.context.get('identity'), options.filter)
 		
+		storage_options = self.read_options(COUNT if options.count else LIST, options)
+		fields = self.list_fields(options)
+		if fields is not None:
+			storage_options['fields'] = fields
+		
 		result = self.storage.get(self.entity, 
 							filter=options.filter, sort=options.sort, 
 							offset=options.offset, limit=options.limit,
-							count=options.count)
+							count=options.count,
+							**storage_options)
 		
 		self.after_list(options.context.get('identity'), result)
 		
@@ -195,6 +258,59 @@ class Interface(object):
 		return self.post(LIST, options, result)
 		
 		
+	def stream(self, batch_size=100, **kwargs):
+		"""
+		List items like `list`, but return an iterator that reads them from 
+		storage as they're needed, so a whole collection can be sent without 
+		holding it in memory. Items are post-processed `batch_size` at a time.
+		
+		Rules that apply to the whole list are enforced right away. Item rules 
+		are enforced a batch at a time, so an item that breaks them stops the 
+		iteration after the batches before it have been given.
+		"""
+		options = self.options_factory.create(kwargs, list=True)
+		
+		if not options.bypass_authorization:
+			self.rules.enforce_non_item_rules(LIST, options.context)
+		
+		self.before_list(options.context.get('identity'), options.filter)
+		
+		storage_options = self.read_options(LIST, options)
+		fields = self.list_fields(options)
+		if fields is not None:
+			storage_options['fields'] = fields
+		
+		items = self.storage.iterate(self.entity, 
+							filter=options.filter, sort=options.sort, 
+							offset=options.offset, limit=options.limit,
+							**storage_options)
+		return self._stream_batches(items, batch_size, options)
+		
+		
+	def _stream_batches(self, items, batch_size, options):
+		batch = []
+		for item in items:
+			batch.append(item)
+			if len(batch) < batch_size:
+				continue
+			for prepared in self._post_batch(batch, options):
+				yield prepared
+			batch = []
+		for prepared in self._post_batch(batch, options):
+			yield prepared
+			
+			
+	def _post_batch(self, batch, options):
+		if not batch:
+			return []
+		self.after_list(options.context.get('identity'), batch)
+		if not options.bypass_authorization:
+			self.rules.enforce_item_rules(LIST, batch, options.context)
+		# Don't keep the links loaded for earlier batches
+		options.loader.clear()
+		return self.post(LIST, options, batch)
+		
+		
 	def create(self, fields, **kwargs):
 		options = self.options_factory.create(kwargs)
 		
@@ -205,6 +321,8 @@ class Interface(object):
 		
 		item = self.entity.validator.validate(fields)
 		item['_id'] = self.storage.create(self.entity, item)
+		options['read_preference'] = PRIMARY
+		options.loader.clear()
 		
 		if not options.bypass_authorization:
 			self.rules.enforce_item_rules(CREATE, item, options.context)
@@ -216,26 +334,114 @@ class Interface(object):
 		return item
 		
 		
+	def create_many(self, items, chunk_size=100, **kwargs):
+		"""
+		Create items from an iterable, such as a streamed request body, taking 
+		`chunk_size` at a time. A chunk is only written once all of its items 
+		are valid, so at most one chunk is held in memory. Returns how many 
+		items were created, rather than their ids, so that doesn't grow with 
+		the number of items either. Each item is passed to `after_create` as 
+		`create` would pass it.
+		
+		If an item is invalid, `CompoundValidationError` is raised with its 
+		errors under its index. Chunks before the invalid item stay created.
+		"""
+		options = self.options_factory.create(kwargs)
+		
+		if not options.bypass_authorization:
+			self.rules.enforce_non_item_rules(CREATE, options.context)
+		
+		identity = options.context.get('identity')
+		options['read_preference'] = PRIMARY
+		created = 0
+		chunk = []
+		for fields in items:
+			index = created + len(chunk)
+			self.before_create(identity, fields)
+			try:
+				chunk.append(self.entity.validator.validate(fields))
+			except errors.CompoundValidationError, e:
+				raise errors.CompoundValidationError({index: e.errors})
+			except errors.ValidationError, e:
+				raise errors.CompoundValidationError({index: e.message})
+			if len(chunk) >= chunk_size:
+				created += self._create_chunk(chunk, options)
+				chunk = []
+		if chunk:
+			created += self._create_chunk(chunk, options)
+		return created
+		
+		
+	def _create_chunk(self, items, options):
+		identity = options.context.get('identity')
+		for item in items:
+			item['_id'] = self.storage.create(self.entity, item)
+			if not options.bypass_authorization:
+				self.rules.enforce_item_rules(CREATE, item, options.context)
+			self.after_create(identity, self.post(CREATE, options, item))
+		# Don't keep the links loaded for earlier chunks
+		options.loader.clear()
+		return len(items)
+		
+		
 	def update(self, id, fields, _replace=False, _method=UPDATE, **kwargs):
 		options = self.options_factory.create(kwargs)
 		
 		if not options.bypass_authorization:
 			self.rules.enforce_non_item_rules(_method, options.context)
 		
-		item = self.storage.get_by_id(self.entity, id)
-		if item is None:
-			raise errors.NotFoundError("No %s with id '%s' was found" % (self.singular_name, id))
+		if options.version is not None and not self.entity.versioned:
+			raise errors.NotVersionedError("%s is not versioned" % self.entity.__name__)
+		
+		if not isinstance(fields, dict):
+			raise errors.CompoundValidationError({'fields': self.entity.validator.NOT_A_DICT})
+		
+		operations = dict((k,v) for k,v in fields.items() if k.startswith('$'))
+		if operations:
+			if _replace:
+				raise errors.CompoundValidationError(dict((k, 'Operators can only be used in partial updates.') for k in operations))
+			fields = dict((k,v) for k,v in fields.items() if not k.startswith('$'))
 		
-		if not options.bypass_authorization and UPDATE in self.rules.item_rules:
-			self.rules.enforce_item_rules(_method, item, options.context)
+		# Atomic updates don't need to read the item first if the 
+		# authorization rules can be checked by the storage instead
+		guard = None
+		if operations:
+			if options.bypass_authorization:
+				guard = {}
+			else:
+				guard = self.rules.item_rules_filter(_method, options.context, self.entity.fields)
+		
+		if guard is None:
+			item = options.loader.load(self.entity, id)
+			if item is None:
+				raise errors.NotFoundError("No %s with id '%s' was found" % (self.singular_name, id))
+			
+			if not options.bypass_authorization and UPDATE in self.rules.item_rules:
+				self.rules.enforce_item_rules(_method, item, options.context)
+			
+			if options.version is not None and item.get('_version') != options.version:
+				raise errors.VersionConflictError(item)
+		else:
+			item = {'_id':id}
 		
 		self.before_update(options.context.get('identity'), item, fields)
 		
 		new_fields = self.entity.validator.validate(fields, enforce_required=_replace)
 		fields = new_fields
-		item = self.storage.update(self.entity, id, fields, replace=_replace)
+		update_options = {}
+		if operations:
+			update_options['operations'] = self.entity.validator.validate_operations(operations, fields)
+		if guard:
+			update_options['filter'] = guard
+		if options.version is not None:
+			update_options['version'] = options.version
+		item = self.storage.update(self.entity, id, fields, replace=_replace, **update_options)
 		if item is None:
+			if guard and options.loader.load(self.entity, id) is not None:
+				raise errors.NotAuthorizedError()
 			raise errors.NotFoundError("No %s with id '%s' was found" % (self.singular_name, id))
+		options['read_preference'] = PRIMARY
+		options.loader.clear()
 		
 		item = self.post(_method, options, item)
 		
@@ -254,7 +460,7 @@ class Interface(object):
 		if not options.bypass_authorization:
 			self.rules.enforce_non_item_rules(DELETE, options.context)
 		
-		item = self.storage.get_by_id(self.entity, id)
+		item = options.loader.load(self.entity, id)
 		if item is None:
 			raise errors.NotFoundError("No %s with id '%s' was found" % (self.singular_name, id))
 		
@@ -267,6 +473,7 @@ class Interface(object):
 			self.inverse_delete(id)
 		
 		self.storage.delete(self.entity, id)
+		options.loader.clear()
 		self.post(DELETE, options)
 		
 		self.after_delete(options.context.get('identity'), item)
@@ -277,18 +484,17 @@ class Interface(object):
 		if cascade:
 			for link in cascade:
 				link_interface = self.api.get_interface_for_entity(link.entity)
-				items = link_interface.list(filter={link.field:id}, fields=[])
+				items = link_interface.list(filter={link.field:id}, fields=[], read_preference=PRIMARY)
 				for item in items:
 					link_interface.delete(item['_id'])
 		nullify = self.entity.inverse_links.get(Link.NULLIFY)
 		if nullify:
 			for link in nullify:
 				link_interface = self.api.get_interface_for_entity(link.entity)
-				items = link_interface.list(filter={link.field:id}, fields=[link.field])
+				items = link_interface.list(filter={link.field:id}, fields=[], read_preference=PRIMARY)
 				if link.multiple:
 					for item in items:
-						new_ids = filter(lambda x: x != id, item[link.field])
-						link_interface.update(item['_id'], {link.field:new_ids})
+						link_interface.update(item['_id'], {'$pull':{link.field:id}})
 				else:
 					for item in items:
 						link_interface.update(item['_id'], {link.field:None})
@@ -300,7 +506,7 @@ class Interface(object):
 		if not options.bypass_authorization:
 			self.rules.enforce_non_item_rules(GET, options.context)
 		
-		item = self.storage.get_by_id(self.entity, id)
+		item = options.loader.load(self.entity, id, **self.read_options(GET, options))
 		if item is None:
 			raise errors.NotFoundError("No %s with id '%s' was found" % (self.singular_name, id))
 		
@@ -312,7 +518,7 @@ class Interface(object):
 			raise errors.NotFoundError("The %s interface has no link '%s' defined" % (self.plural_name, link_name))
 		link_field = getattr(self.entity, link_name)
 		
-		return target_interface.resolve_link(item, link_name, link_field, kwargs)
+		return target_interface.resolve_link(item, link_name, link_field, dict(kwargs, loader=options.loader))
 		
 		
 	def resolve_link(self, source_item, link_name, link_field, options):
@@ -337,7 +543,8 @@ class Interface(object):
 			result = self.storage.get(self.entity, 
 							filter=options.filter, sort=options.sort, 
 							offset=options.offset, limit=options.limit,
-							count=options.count)
+							count=options.count,
+							**self.read_options(COUNT if options.count else LIST, options))
 			if options.count:
 				return result
 			self.rules.enforce_item_rules(LIST, result, options.context)
@@ -346,7 +553,8 @@ class Interface(object):
 			try:
 				if not options.bypass_authorization:
 					self.rules.enforce_non_item_rules(GET, options.context)
-				item = next(iter(self.storage.get(self.entity, filter=options.filter, limit=1)))
+				item = next(iter(self.storage.get(self.entity, filter=options.filter, limit=1, 
+									**self.read_options(GET, options))))
 				if not options.bypass_authorization:
 					self.rules.enforce_item_rules(GET, item, options.context)
 				return self.post(GET, options, item)
@@ -366,7 +574,8 @@ class Interface(object):
 			result = self.storage.get_by_ids(self.entity, link_value,
 								filter=options.filter, sort=options.sort, 
 								offset=options.offset, limit=options.limit,
-								count=options.count)
+								count=options.count,
+								**self.read_options(COUNT if options.count else LIST, options))
 			if options.count:
 				return result
 			if not options.bypass_authorization:
@@ -385,7 +594,7 @@ class Interface(object):
 			return self.post(LIST, options, result)
 		else:
 			self.rules.enforce_non_item_rules(GET, options.context)
-			item = self.storage.get_by_id(self.entity, link_value)
+			item = options.loader.load(self.entity, link_value, **self.read_options(GET, options))
 			self.rules.enforce_item_rules(GET, item, options.context)
 			return self.post(GET, options, item)
 			
@@ -407,10 +616,16 @@ class Interface(object):
 		return self.api.get_interface_for_entity(linked_entity)
 		
 		
-	def prepare_item(self, item, options):
+	def prepare_item(self, item, options, wrap=True):
 		self.remove_hidden_fields(item, options)
 		self.add_embedded_links(item, options)
-		return item
+		if not wrap:
+			return item
+		prepared = PreparedItem(item)
+		prepared.entity = self.entity
+		prepared.entity_name = self.root_entity_name
+		prepared.personal = bool(options.context.get('identity'))
+		return prepared
 		
 		
 	def remove_hidden_fields(self, item, options):
@@ -440,7 +655,9 @@ class Interface(object):
 			link_options = {
 				'context': options.context,
 				'allow_embedding': False,
-				'show_hidden': options.show_hidden
+				'show_hidden': options.show_hidden,
+				'read_preference': options.read_preference,
+				'loader': options.loader
 			}
 			
 			embedded_fields = link_field.field.embedded_fields if isinstance(link_field, ListOf) else link_field.embedded_fields
@@ -455,15 +672,60 @@ class Interface(object):
 		return item
 		
 		
+	def prime_links(self, items, options, link_names, entity=None):
+		"""
+		Queue the targets of single links so they are fetched together, 
+		rather than one at a time as each item is processed.
+		"""
+		entity = entity if entity else self.entity
+		for link_name in link_names:
+			link_field = getattr(entity, link_name, None)
+			if isinstance(link_field, Link):
+				options.loader.prime(link_field.entity, [item.get(link_name) for item in items])
+		
+		
+	def list_fields(self, options):
+		"""
+		Get the fields a list needs from the storage when only some were asked 
+		for, along with anything needed to embed links. Returns `None` if every 
+		field is needed, including when item rules have to check whole items.
+		"""
+		if options.fields is None or options.count:
+			return None
+		if self.rules.item_rules.get(LIST) and not options.bypass_authorization:
+			return None
+		fields = set(options.fields)
+		fields.update(('_type', '_version'))
+		for entity in [self.entity] + self.entity.children:
+			fields.update(entity.links)
+		return sorted(fields)
+		
+		
+	def read_options(self, method, options):
+		"""Get the keyword arguments that route a storage read for a method"""
+		read_preference = options.read_preference or self.read_preferences.get(method)
+		if read_preference:
+			return {'read_preference': read_preference}
+		return {}
+		
+		
 	def post(self, method, options, result=None):
 		if result is None:
 			return
 			
 		if method == LIST:
+			if options.allow_embedding:
+				items_by_type = {}
+				for item in result:
+					items_by_type.setdefault(item.get('_type', self.entity.__name__), []).append(item)
+				for type, items in items_by_type.items():
+					entity, embed = options.get_embed_for_type(self.entity, type)
+					self.prime_links(items, options, embed, entity)
 			new_results = []
+			wrap = self.api.prepare_list_items
 			for item in result:
 				new_results.append(
-					self.prepare_item(item, options)
+					self.prepare_item(item, options, wrap)
 				)
 			options.context['item'] = result
 			return new_results
@@ -476,6 +738,17 @@ class Interface(object):
 		raise errors.DisabledMethodError, "This method is not enabled."
 		
 		
+def get_read_preferences(read_preference):
+	read_preferences = {}
+	if read_preference:
+		for k,v in read_preference.items():
+			if not isinstance(k, tuple):
+				k = (k,)
+			for method in k:
+				read_preferences[method] = v
+	return read_preferences
+	
+	
 class RuleSet(object):
 	
 	def __init__(self, method_authorization):
@@ -516,6 +789,32 @@ class RuleSet(object):
 			self.enforce_rules(rules, None, context)
 		
 		
+	def item_rules_filter(self, method, context, fields):
+		"""
+		Combine the item rules for a method into a storage filter that only
+		matches items that pass them. Returns `None` if they can't be translated.
+		"""
+		rules = self.item_rules.get(method)
+		if not rules:
+			return {}
+		context = context if context else {}
+		no_identity = 'identity' not in context
+		filters = []
+		for rule in rules:
+			if no_identity and isinstance(rule, AuthorizationExpression) and rule.uses('identity'):
+				raise errors.NotAuthenticatedError()
+			filter = item_filter(rule, context, fields)
+			if filter is None:
+				return None
+			if filter is False:
+				raise errors.NotAuthorizedError()
+			if filter is not True:
+				filters.append(filter)
+		if len(filters) > 1:
+			return {'$and':filters}
+		return filters[0] if filters else {}
+		
+		
 	def enforce_rules(self, rules, item, context):
 		context = context if context else {}
 		context['item'] = item
@@ -538,7 +837,8 @@ class OptionsFactory(object):
 					   enabled_sort=(), 
 					   default_sort=(), 
 					   default_limit=0, 
-					   max_limit=0):
+					   max_limit=0,
+					   export_authorization=None):
 		self.storage = storage
 		self.hidden_fields = set(hidden_fields)
 		self.hidden_field_authorization = hidden_field_authorization
@@ -549,6 +849,7 @@ class OptionsFactory(object):
 		self.default_sort = default_sort
 		self.default_limit = default_limit
 		self.max_limit = max_limit
+		self.export_authorization = export_authorization
 		
 		self.enabled_filters.update(('_id', '_type'))
 		self.enabled_filters_no_hidden.update(('_id', '_type'))
@@ -574,6 +875,11 @@ class OptionsFactory(object):
 		new_options['show_hidden'] = options.get('show_hidden', False)
 		new_options['context'] = options.get('context', {})
 		new_options['bypass_authorization'] = options.get('bypass_authorization', False)
+		new_options['read_preference'] = options.get('read_preference', None)
+		new_options['version'] = options.get('version', None)
+		new_options['loader'] = options.get('loader', None)
+		if new_options['loader'] is None or new_options['loader'].storage is not self.storage:
+			new_options['loader'] = Loader(self.storage)
 		
 		if new_options['bypass_authorization']:
 			new_options['can_show_hidden'] = True
@@ -585,23 +891,31 @@ class OptionsFactory(object):
 			
 	def can_show_hidden(self, context):
 		if self.hidden_field_authorization:
-			if isinstance(self.hidden_field_authorization, AuthorizationExpression) and \
-				 self.hidden_field_authorization.uses('identity') and 'identity' not in context:
-				return False
-			elif not self.hidden_field_authorization(context):
-				return False
+			return self.is_authorized(self.hidden_field_authorization, context)
 		return True
 		
 		
+	def can_export(self, context):
+		if self.export_authorization:
+			return self.is_authorized(self.export_authorization, context)
+		return False
+		
+		
+	def is_authorized(self, rule, context):
+		if isinstance(rule, AuthorizationExpression) and rule.uses('identity') and 'identity' not in context:
+			return False
+		return bool(rule(context))
+		
+		
 	def process_list(self, options):
 		new_options = self.process(options)
 		new_options['filter'] = options.get('filter', None)
 		new_options['sort'] = options.get('sort', None)
-		new_options['sort'] = options['sort'] if options.get('sort') else self.default_sort
+		new_options['sort'] = options['sort'] if options.get('sort') else self.get_default_sort(new_options['filter'])
 		new_options['offset'] = options.get('offset', 0)
 		new_options['limit'] = options.get('limit', 0)
 		new_options['limit'] = new_options['limit'] if new_options['limit'] else self.default_limit
-		if not new_options['bypass_authorization']:
+		if not new_options['bypass_authorization'] and not self.can_export(new_options['context']):
 			new_options['limit'] = min(new_options['limit'], self.max_limit)
 		new_options['count'] = options.get('count', False)
 		
@@ -611,6 +925,14 @@ class OptionsFactory(object):
 		return new_options
 		
 		
+	def get_default_sort(self, filter):
+		# Results after a text search cursor are always in score order
+		text = filter.get('$text') if isinstance(filter, dict) else None
+		if isinstance(text, dict) and AFTER in text:
+			return ()
+		return self.default_sort
+		
+		
 	def check_filter(self, options):
 		if not options['filter'] or options['bypass_authorization']:
 			return
@@ -650,6 +972,10 @@ class BaseOptions(object):
 		return self._options[key]
 		
 		
+	def __setitem__(self, key, value):
+		self._options[key] = value
+		
+		
 	def __getattr__(self, key):
 		return self.__getitem__(key)
 		
@@ -6,6 +6,7 @@ __all__ = (
 	'REPLACE',
 	'DELETE',
 	'ALL',
+	'COUNT',
 	'get_http_methods'
 )
 
@@ -19,6 +20,10 @@ DELETE = 'delete'
 
 ALL = (LIST, GET, CREATE, UPDATE, REPLACE, DELETE)
 
+# Not a method of its own, counting is done by listing. This is only
+# used to route counts separately when setting read preferences.
+COUNT = 'count'
+
 _http_methods = {
 	LIST: ('get',),
 	GET: ('get',),
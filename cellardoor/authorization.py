@@ -1,4 +1,5 @@
 from functools import partial
+from .model import ListOf
 
 
 class AuthorizationExpression(object):
@@ -328,4 +329,100 @@ class LinkProxy(ObjectProxyValue, ItemProxy):
 		
 	def __repr__(self):
 		return 'LinkProxy(%s, %s)' % (self._proxy._entity.__name__, self._name)
-		
\ No newline at end of file
+		
+		
+		
+		
+def item_filter(rule, context, fields):
+	"""
+	Translate a rule about an item into a storage filter that only matches
+	items that pass it, so the rule can be enforced by the storage as part 
+	of a write instead of by reading the item first. `fields` are the item 
+	entity's fields.
+	
+	Returns `True` if the rule passes for any item, `False` if it can't pass 
+	and `None` if it can't be translated.
+	"""
+	if not isinstance(rule, AuthorizationExpression):
+		return None
+		
+	if not rule.uses('item'):
+		return bool(rule(context))
+	
+	if isinstance(rule, AndExpression):
+		a = item_filter(rule.a, context, fields)
+		b = item_filter(rule.b, context, fields)
+		if a is False or b is False:
+			return False
+		if a is None or b is None:
+			return None
+		if a is True:
+			return b
+		if b is True:
+			return a
+		return {'$and':[a, b]}
+		
+	if isinstance(rule, OrExpression):
+		a = item_filter(rule.a, context, fields)
+		b = item_filter(rule.b, context, fields)
+		if a is True or b is True:
+			return True
+		if a is None or b is None:
+			return None
+		if a is False:
+			return b
+		if b is False:
+			return a
+		return {'$or':[a, b]}
+		
+	if isinstance(rule, ObjectProxyValueComparison):
+		key = _item_key(rule._proxy, fields)
+		operator = _filter_operators.get(type(rule))
+		if key is None or operator is None:
+			return None
+		if isinstance(rule.other, AuthorizationExpression):
+			if rule.other.uses('item') or not isinstance(rule.other, ObjectProxyValue):
+				return None
+			value = rule.other.get_value(context)
+		else:
+			value = rule.other
+		if operator == '$in':
+			if not isinstance(value, (list, tuple, set)):
+				return None
+			return {key:{'$in':list(value)}}
+		if isinstance(value, (list, tuple, set, dict)):
+			return None
+		if operator == '$eq':
+			return {key:value}
+		return {key:{operator:value}}
+		
+	if isinstance(rule, ObjectProxyValue):
+		key = _item_key(rule, fields)
+		if key is None:
+			return None
+		return {key:{'$exists':True}}
+		
+	return None
+	
+	
+def _item_key(proxy, fields):
+	"""Get the field a value proxy refers to, if it's a plain field of the item itself"""
+	if not isinstance(proxy, ObjectProxyValue) or isinstance(proxy._proxy, ObjectProxyValue):
+		return None
+	if not isinstance(proxy._proxy, ObjectProxy) or proxy._proxy._name != 'item':
+		return None
+	field = fields.get(proxy._key)
+	if field is None or isinstance(field, ListOf):
+		return None
+	return proxy._key
+	
+	
+_filter_operators = {
+	EqualsComparison: '$eq',
+	NotEqualsComparison: '$ne',
+	LessThanComparison: '$lt',
+	GreaterThanComparison: '$gt',
+	LessThanEqualComparison: '$lte',
+	GreaterThanEqualComparison: '$gte',
+	ContainsComparison: '$in'
+}
@@ -0,0 +1,163 @@
+import time
+import threading
+from collections import OrderedDict
+
+__all__ = [
+	'Cache',
+	'CacheError',
+	'LRUCache',
+	'freeze'
+]
+
+
+class CacheError(Exception):
+	pass
+
+
+
+class Cache(object):
+	"""
+	The interface shared by cache backends. Values are arbitrary and a
+	value of `None` can't be told apart from a miss, so don't store it.
+	Counters are kept apart from the cached values and are never evicted,
+	which makes them safe to use as generation numbers for invalidation.
+	"""
+
+	# These are the methods you need to implement
+	# to create a new cache backend.
+
+	def get(self, key, default=None):
+		raise NotImplementedError
+
+
+	def set(self, key, value, ttl=None):
+		raise NotImplementedError
+
+
+	def delete(self, key):
+		raise NotImplementedError
+
+
+	def clear(self):
+		raise NotImplementedError
+
+
+	def incr(self, key):
+		raise NotImplementedError
+
+
+	def counter(self, key):
+		raise NotImplementedError
+
+
+	def stats(self):
+		raise NotImplementedError
+
+
+
+class LRUCache(Cache):
+	"""
+	A bounded, thread safe cache that evicts the least recently used
+	entries once `max_size` is reached. Entries can also be given a
+	time to live, in seconds, after which they are treated as missing::
+
+		cache = LRUCache(max_size=2, ttl=60)
+		cache.set('a', 1)
+		cache.set('b', 2)
+		cache.get('a') # 1
+		cache.set('c', 3) # evicts 'b'
+		cache.get('b') # None
+	"""
+
+	def __init__(self, max_size=1000, ttl=None, clock=time.time):
+		self.max_size = max_size
+		self.ttl = ttl
+		self.clock = clock
+		self.entries = OrderedDict()
+		self.counters = {}
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+
+	def get(self, key, default=None):
+		with self.lock:
+			try:
+				expires, value = self.entries.pop(key)
+			except KeyError:
+				self.misses += 1
+				return default
+			if expires is not None and expires <= self.clock():
+				self.evictions += 1
+				self.misses += 1
+				return default
+			self.entries[key] = (expires, value)
+			self.hits += 1
+			return value
+
+
+	def set(self, key, value, ttl=None):
+		ttl = ttl if ttl is not None else self.ttl
+		expires = self.clock() + ttl if ttl is not None else None
+		with self.lock:
+			self.entries.pop(key, None)
+			self.entries[key] = (expires, value)
+			while len(self.entries) > self.max_size:
+				self.entries.popitem(last=False)
+				self.evictions += 1
+
+
+	def delete(self, key):
+		with self.lock:
+			self.entries.pop(key, None)
+
+
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+			self.counters.clear()
+
+
+	def incr(self, key):
+		with self.lock:
+			value = self.counters.get(key, 0) + 1
+			self.counters[key] = value
+			return value
+
+
+	def counter(self, key):
+		return self.counters.get(key, 0)
+
+
+	def stats(self):
+		return {
+			'size': len(self.entries),
+			'hits': self.hits,
+			'misses': self.misses,
+			'evictions': self.evictions
+		}
+
+
+	def __len__(self):
+		return len(self.entries)
+
+
+
+def freeze(value):
+	"""
+	Turn a structure of dicts, lists and sets into an equivalent hashable
+	value so it can be used as part of a cache key. Dicts are ordered by
+	key so equal structures always produce equal keys.
+	"""
+	if isinstance(value, dict):
+		return ('__dict__',) + tuple(sorted((k, freeze(v)) for k,v in value.items()))
+	if isinstance(value, (list, tuple)):
+		return tuple(freeze(v) for v in value)
+	if isinstance(value, (set, frozenset)):
+		return ('__set__',) + tuple(sorted(freeze(v) for v in value))
+	try:
+		hash(value)
+	except TypeError:
+		return repr(value)
+	return value
@@ -0,0 +1,273 @@
+"""
+A cache daemon that lets every worker process on a host share one cache.
+
+Run it next to your WSGI server::
+
+	python -m cellardoor.cache.daemon --max-size 100000 --ttl 60
+
+and point each worker at it::
+
+	cache = SocketCache()
+	storage = CachingStorage(MongoDBStorage('hamblog'), cache=cache)
+
+By default the socket is `cellardoor-cache.sock` in `$XDG_RUNTIME_DIR`, or
+in a `cellardoor-<uid>` directory under the temp directory that only its
+owner can enter. The socket itself is only accessible to the user running
+the daemon, since anyone who can connect can change what's cached. Pass
+`mode` (or `--mode`) to share it with a group instead.
+
+Values are stored msgpack-encoded, so the daemon holds a single copy of
+each document no matter how many workers use it. Deletes and counter
+increments happen in the daemon, so an invalidation made by one worker
+is seen by all of them on their next lookup.
+"""
+import os
+import stat
+import errno
+import socket
+import struct
+import logging
+import argparse
+import tempfile
+import threading
+import SocketServer
+import msgpack
+from . import Cache, CacheError, LRUCache
+from ..serializers.msgpack_serializer import ext_default, ext_hook
+
+__all__ = [
+	'CacheServer',
+	'SocketCache',
+	'default_socket_path'
+]
+
+header = struct.Struct('!I')
+
+
+def default_socket_path():
+	runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+	if not runtime_dir:
+		runtime_dir = os.path.join(tempfile.gettempdir(), 'cellardoor-%d' % os.getuid())
+	return os.path.join(runtime_dir, 'cellardoor-cache.sock')
+
+
+def make_private_dir(path):
+	try:
+		os.mkdir(path, 0700)
+	except OSError, e:
+		if e.errno != errno.EEXIST:
+			raise
+	info = os.lstat(path)
+	if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 077:
+		raise Exception, "%s is not a directory that only the current user can access" % path
+
+
+def pack_value(value):
+	return msgpack.packb(value, default=ext_default, use_bin_type=True)
+
+
+def unpack_value(data):
+	return msgpack.unpackb(data, ext_hook=ext_hook, raw=False)
+
+
+def write_message(sock, message):
+	data = msgpack.packb(message, use_bin_type=True)
+	sock.sendall(header.pack(len(data)) + data)
+
+
+def read_message(sock):
+	size, = header.unpack(read_exactly(sock, header.size))
+	return msgpack.unpackb(read_exactly(sock, size), raw=False)
+
+
+def read_exactly(sock, size):
+	chunks = []
+	while size > 0:
+		chunk = sock.recv(size)
+		if not chunk:
+			raise EOFError
+		chunks.append(chunk)
+		size -= len(chunk)
+	return ''.join(chunks)
+
+
+
+class CacheRequestHandler(SocketServer.BaseRequestHandler):
+
+	def handle(self):
+		while True:
+			try:
+				message = read_message(self.request)
+			except (EOFError, socket.error):
+				return
+			try:
+				response = [True, self.server.dispatch(message[0], message[1:])]
+			except Exception, e:
+				response = [False, str(e)]
+			write_message(self.request, response)
+
+
+
+class CacheServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+	"""
+	Serves an `LRUCache` over a Unix socket. Keys and values arrive already
+	encoded and are stored as opaque bytes.
+	
+	The socket is created with permissions `mode`. A socket left behind at
+	`path` by an earlier server is replaced, but anything else there is not.
+	"""
+
+	daemon_threads = True
+	operations = ('get', 'set', 'delete', 'clear', 'incr', 'counter', 'stats')
+
+	def __init__(self, path=None, max_size=100000, ttl=None, mode=0600):
+		if path is None:
+			path = default_socket_path()
+			make_private_dir(os.path.dirname(path))
+		if os.path.lexists(path):
+			if not stat.S_ISSOCK(os.lstat(path).st_mode):
+				raise Exception, "%s exists and is not a socket" % path
+			os.unlink(path)
+		self.mode = mode
+		self.cache = LRUCache(max_size=max_size, ttl=ttl)
+		SocketServer.UnixStreamServer.__init__(self, path, CacheRequestHandler)
+
+
+	def server_bind(self):
+		# Don't let anyone else connect in between creating the socket and
+		# setting its mode
+		umask = os.umask(0177)
+		try:
+			SocketServer.UnixStreamServer.server_bind(self)
+		finally:
+			os.umask(umask)
+		os.chmod(self.server_address, self.mode)
+
+
+	def dispatch(self, operation, args):
+		if operation not in self.operations:
+			raise ValueError, "Unknown operation '%s'" % operation
+		return getattr(self.cache, operation)(*args)
+
+
+	def server_close(self):
+		SocketServer.UnixStreamServer.server_close(self)
+		if os.path.exists(self.server_address):
+			os.unlink(self.server_address)
+
+
+
+class SocketCache(Cache):
+	"""
+	A cache backend that talks to a `CacheServer`. Each thread keeps its own
+	connection. A failed request is retried once on a new connection before
+	a `cellardoor.cache.CacheError` is raised.
+	"""
+
+	def __init__(self, path=None, timeout=1.0):
+		self.path = path if path is not None else default_socket_path()
+		self.timeout = timeout
+		self.local = threading.local()
+
+
+	def get(self, key, default=None):
+		data = self.call('get', self.encode_key(key))
+		if data is None:
+			return default
+		return unpack_value(data)
+
+
+	def set(self, key, value, ttl=None):
+		try:
+			data = pack_value(value)
+		except (TypeError, ValueError), e:
+			raise CacheError("Could not encode value: %s" % e)
+		self.call('set', self.encode_key(key), data, ttl)
+
+
+	def delete(self, key):
+		self.call('delete', self.encode_key(key))
+
+
+	def clear(self):
+		self.call('clear')
+
+
+	def incr(self, key):
+		return self.call('incr', self.encode_key(key))
+
+
+	def counter(self, key):
+		return self.call('counter', self.encode_key(key))
+
+
+	def stats(self):
+		return self.call('stats')
+
+
+	def encode_key(self, key):
+		try:
+			return pack_value(key)
+		except (TypeError, ValueError):
+			return pack_value(repr(key))
+
+
+	def call(self, operation, *args):
+		for attempt in range(2):
+			try:
+				sock = self.connection()
+				write_message(sock, [operation] + list(args))
+				ok, result = read_message(sock)
+				break
+			except (EOFError, socket.error), e:
+				self.disconnect()
+				if attempt:
+					raise CacheError("Could not reach the cache at %s: %s" % (self.path, e))
+		if not ok:
+			raise CacheError(result)
+		return result
+
+
+	def connection(self):
+		sock = getattr(self.local, 'sock', None)
+		if sock is None:
+			sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			sock.settimeout(self.timeout)
+			try:
+				sock.connect(self.path)
+			except socket.error:
+				sock.close()
+				raise
+			self.local.sock = sock
+		return sock
+
+
+	def disconnect(self):
+		sock = getattr(self.local, 'sock', None)
+		self.local.sock = None
+		if sock is not None:
+			sock.close()
+
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Run a cache shared by cellardoor worker processes.')
+	parser.add_argument('--socket', default=None, help='Path of the Unix socket to listen on')
+	parser.add_argument('--mode', type=lambda x: int(x, 8), default=0600, help='Permissions of the socket, in octal')
+	parser.add_argument('--max-size', type=int, default=100000, help='Maximum number of cached entries')
+	parser.add_argument('--ttl', type=float, default=None, help='Default time to live of entries, in seconds')
+	args = parser.parse_args(argv)
+
+	logging.basicConfig(level=logging.INFO)
+	server = CacheServer(args.socket, max_size=args.max_size, ttl=args.ttl, mode=args.mode)
+	logging.getLogger(__name__).info('Listening on %s', server.server_address)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+
+
+if __name__ == '__main__':
+	main()
@@ -539,8 +539,14 @@ class ListOf(Field):
         if self.required and len(values) == 0:
             raise ValidationError(self.EMPTY_LIST)
         
-        for v in values:
-            self.field.validate(v)
+        # Fields that can check many values at once more cheaply
+        # than one at a time, like links, provide `validate_many`
+        validate_many = getattr(self.field, 'validate_many', None)
+        if validate_many:
+            validate_many(values)
+        else:
+            for v in values:
+                self.field.validate(v)
         
         return values
         
@@ -572,6 +578,15 @@ class Compound(Field):
         v.validate({'foo':'ice cream'}) # -> {'foo':'ice cream', 'bar': 8}
     """
     NOT_A_DICT = "Not a dict"
+    UNKNOWN_OPERATOR = "Unknown operator."
+    UNKNOWN_FIELD = "Unknown field."
+    CONFLICTING_OPERATORS = "Can only be changed by one operator at a time."
+    MISSING_VALUE = "Expected a value."
+    NOT_A_NUMBER = "Only numbers can be incremented."
+    NOT_A_LIST = "Only lists can be pushed to or pulled from."
+    CANT_UNSET = "This field is required and can't be unset."
+    
+    OPERATORS = ('$inc', '$push', '$pull', '$addToSet', '$unset')
     
     def __init__(self, required=False, default=None, hidden=False, unique=False, label=None, description=None, **kwargs):
         super(Compound, self).__init__(required, default, hidden, unique, label, description)
@@ -617,5 +632,82 @@ class Compound(Field):
             raise CompoundValidationError(errors)
         
         return validated
+        
+        
+    def validate_operations(self, operations, fields=()):
+        """
+        Validates a dict of atomic update operations of the form
+        `operator => {key: value}`::
+        
+            v = Compound(views=Integer(), tags=ListOf(Text()), note=Text())
+            v.validate_operations({'$inc': {'views': 1}, '$addToSet': {'tags': 'new'}}) # ok
+            v.validate_operations({'$push': {'views': 1}}) # nope, not a list
+            
+        The operators are `$inc` for numbers, `$push`, `$addToSet` and `$pull` 
+        for lists and `$unset` for fields that aren't required. A key can only 
+        be changed by one operator, and not by any if it's one of the `fields` 
+        set by the same update.
+        """
+        if not isinstance(operations, dict):
+            raise ValidationError(self.NOT_A_DICT)
+        
+        validated = {}
+        errors = {}
+        seen = set(fields)
+        
+        for operator, values in operations.items():
+            if operator not in self.OPERATORS:
+                errors[operator] = self.UNKNOWN_OPERATOR
+                continue
+            if not isinstance(values, dict):
+                errors[operator] = self.NOT_A_DICT
+                continue
+            
+            validated[operator] = {}
+            for k,v in values.items():
+                if k in seen:
+                    errors[k] = self.CONFLICTING_OPERATORS
+                    continue
+                seen.add(k)
+                
+                field = self.fields.get(k)
+                if field is None:
+                    errors[k] = self.UNKNOWN_FIELD
+                    continue
+                
+                try:
+                    validated[operator][k] = self._validate_operation(operator, field, v)
+                except ValidationError, e:
+                    errors[k] = e.message
+        
+        if errors:
+            raise CompoundValidationError(errors)
+        
+        return validated
+        
+        
+    def _validate_operation(self, operator, field, value):
+        if operator == '$unset':
+            if field.required:
+                raise ValidationError(self.CANT_UNSET)
+            return True
+        
+        if value is None:
+            raise ValidationError(self.MISSING_VALUE)
+        
+        if operator == '$inc':
+            if not isinstance(field, Range):
+                raise ValidationError(self.NOT_A_NUMBER)
+            # The amount is a number of the same kind as the
+            # field, but isn't held to the field's limits
+            amount_field = Integer() if isinstance(field, Integer) else Float()
+            return amount_field.validate(value)
+        
+        if not isinstance(field, ListOf):
+            raise ValidationError(self.NOT_A_LIST)
+        if operator == '$pull':
+            # Anything can be removed, even values that are no longer valid
+            return value
+        return field.field.validate(value)
 
                 
\ No newline at end of file
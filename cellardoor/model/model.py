@@ -1,5 +1,6 @@
 import inspect
 from .fields import Field, ListOf, Compound, Text, ValidationError
+from ..storage.loader import Loader
 
 __all__ = [
     'Entity',
@@ -47,6 +48,20 @@ class Link(Text):
         return value
         
         
+    def validate_many(self, values):
+        """
+        Validate a list of links, checking that they all exist
+        with a single storage lookup.
+        """
+        values = [super(Link, self).validate(value) for value in values]
+        ids = [value for value in values if value is not None]
+        if ids:
+            references = Loader(self.model.storage).load_many(self.entity, ids, fields={})
+            if not all(references):
+                raise ValidationError(self.UNKNOWN)
+        return values
+        
+        
 class InverseLink(object):
     
     def __init__(self, entity, field, 
@@ -133,6 +148,10 @@ class EntityType(type):
         
         visible_fields = set(fields.keys()).difference(hidden_fields)
         
+        for k in attrs.get('searchable', {}):
+            if k not in fields:
+                raise InvalidModelException, "Cannot search the non-existent field '%s'" % k
+        
         # Create the new class
         attrs.update(dict(
             hierarchy = hierarchy,
@@ -191,6 +210,14 @@ class Entity(object):
     
     mixins = []
     
+    # Versioned entities have a `_version` that the storage increments on every 
+    # write, which lets updates be made conditional on the version they expect.
+    versioned = False
+    
+    # Fields that can be searched with a `$text` filter, and how much a match 
+    # in each counts towards an item's score, e.g. `{'title': 10, 'body': 1}`.
+    searchable = {}
+    
     
 
 class Model(object):
@@ -1,6 +1,38 @@
 class Serializer(object):
 	
 	mimetype = None
+	
+	# Serializers that take tables of fields and columns rather than items set this
+	tabular = False
+	
+	# Serializers that can't read request bodies set this
+	output_only = False
+	
+	# How much of a streamed body to read at a time, and the 
+	# largest item in it that will be held in memory.
+	read_size = 64 * 1024
+	max_item_size = 16 * 1024 * 1024
+	
+	def join_serialized(self, items):
+		"""
+		Frame items that were serialized one at a time into the serialized 
+		list of them, as `serialize` would give it, or return `None` if this 
+		serializer can't.
+		"""
+		return None
+		
+		
+	def unserialize_stream(self, stream, entity=None):
+		"""
+		Unserialize a body that may be a long array of items. An array comes 
+		back as an iterator that reads its items from `stream` as they're 
+		needed, so only one item at a time has to fit in memory. Anything 
+		else comes back as it would from `unserialize`.
+		
+		Errors in an array may only be raised part way through iterating it.
+		"""
+		data = self.unserialize(stream, entity=entity)
+		return iter(data) if isinstance(data, list) else data
 
 
 from json_serializer import JSONSerializer
@@ -0,0 +1,47 @@
+import json
+from . import Serializer
+from .json_serializer import encode_default
+
+try:
+	import pyarrow
+except ImportError:
+	pyarrow = None
+	
+	
+	
+class ArrowSerializer(Serializer):
+	"""
+	Writes tables of `{'fields': [...], 'columns': [[...], ...]}` as Arrow IPC 
+	streams. Raises `ImportError` when it's created if pyarrow isn't installed.
+	Request bodies can't be sent as Arrow.
+	
+	A column whose values Arrow can't find one type for, like a mix of 
+	numbers and strings, is sent as the JSON of each value.
+	"""
+	
+	mimetype = 'application/vnd.apache.arrow.stream'
+	
+	tabular = True
+	
+	output_only = True
+	
+	def __init__(self):
+		if pyarrow is None:
+			raise ImportError('No module named pyarrow')
+			
+			
+	def serialize(self, table):
+		arrays = [self.to_array(column) for column in table['columns']]
+		batch = pyarrow.RecordBatch.from_arrays(arrays, table['fields'])
+		sink = pyarrow.BufferOutputStream()
+		writer = pyarrow.RecordBatchStreamWriter(sink, batch.schema)
+		writer.write_batch(batch)
+		writer.close()
+		return sink.getvalue().to_pybytes()
+		
+		
+	def to_array(self, column):
+		try:
+			return pyarrow.array(column)
+		except (pyarrow.ArrowException, TypeError, ValueError):
+			return pyarrow.array([None if v is None else json.dumps(v, default=encode_default) for v in column])
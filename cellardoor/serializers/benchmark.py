@@ -0,0 +1,71 @@
+"""
+Compares how quickly the installed JSON backends serialize a list response::
+
+	python -m cellardoor.serializers.benchmark [items] [repeat]
+"""
+import sys
+import timeit
+from datetime import datetime, timedelta
+from .json_serializer import JSONSerializer, json_backends
+
+__all__ = [
+	'make_items',
+	'benchmark'
+]
+
+
+def make_items(count):
+	"""Make items like the ones list endpoints return, with dates, sets and embedded items"""
+	created = datetime(2014, 9, 5, 9, 23)
+	items = []
+	for i in range(count):
+		items.append({
+			'_id': '54d1c1d1a4e4a5c3f1b8%04x' % i,
+			'_type': 'Post',
+			'title': u'Post number %d \u2014 about coffee' % i,
+			'body': 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 4,
+			'score': i * 1.5,
+			'published': i % 2 == 0,
+			'created': created + timedelta(minutes=i),
+			'tags': set(['coffee', 'tea', 'tag%d' % (i % 10)]),
+			'author': {
+				'_id': '54d1c1d1a4e4a5c3f1b9%04x' % (i % 50),
+				'name': 'Author %d' % (i % 50),
+				'joined': created - timedelta(days=i % 50)
+			}
+		})
+	return items
+
+
+def benchmark(items=1000, repeat=5, compact=False):
+	"""
+	Get the best time each installed backend took to serialize `items`
+	items, in seconds, and check they all gave the same output.
+	"""
+	data = make_items(items)
+	times = {}
+	outputs = {}
+	for backend in json_backends:
+		try:
+			serializer = JSONSerializer(backend=backend.name, compact=compact)
+		except ImportError:
+			continue
+		outputs[backend.name] = serializer.serialize(data)
+		times[backend.name] = min(timeit.repeat(lambda: serializer.serialize(data), number=1, repeat=repeat))
+	if len(set(outputs.values())) > 1:
+		raise AssertionError('The backends gave different output: %s' % ', '.join(sorted(outputs)))
+	return times
+
+
+def main(argv):
+	items = int(argv[1]) if len(argv) > 1 else 1000
+	repeat = int(argv[2]) if len(argv) > 2 else 5
+	times = benchmark(items, repeat)
+	slowest = max(times.values())
+	print 'Serializing %d items, best of %d:' % (items, repeat)
+	for name, seconds in sorted(times.items(), key=lambda x: x[1]):
+		print '  %-12s %8.2f ms  %5.2fx' % (name, seconds * 1000, slowest / seconds)
+
+
+if __name__ == '__main__':
+	main(sys.argv)
@@ -1,42 +1,478 @@
 import re
 import json
+from json import encoder as json_encoder
 from datetime import datetime
 import collections
 
 from . import Serializer
+from ..model.fields import DateTime, ListOf, Compound, OneOf, Text, Integer
 
+try:
+	from bson.objectid import ObjectId
+except ImportError:
+	ObjectId = None
 
+
+# How to encode the types JSON doesn't have, looked up by exact type
+# before falling back to slower isinstance checks for subclasses.
+type_encoders = {
+	datetime: datetime.isoformat,
+	set: list,
+	frozenset: list
+}
+if ObjectId is not None:
+	type_encoders[ObjectId] = str
+
+
+def encode_default(obj):
+	encode = type_encoders.get(type(obj))
+	if encode is not None:
+		return encode(obj)
+	
+	if isinstance(obj, datetime):
+		return obj.isoformat()
+	
+	if isinstance(obj, collections.Iterable):
+		return list(obj)
+	
+	raise TypeError(repr(obj) + " is not JSON serializable")
+	
+	
+	
 class CellarDoorJSONEncoder(json.JSONEncoder):
 	
 	def default(self, obj):
-		if isinstance(obj, collections.Iterable):
-			return list(obj)
+		return encode_default(obj)
+		
+		
+		
+class JSONBackend(object):
+	"""
+	Encodes JSON with a particular library. Every backend must give the same 
+	output as the standard library for the same settings, so they can be 
+	swapped freely. A backend that can't be used raises `ImportError` when 
+	it's created.
+	"""
+	
+	name = None
+	
+	def dumps(self, obj, compact=False):
+		raise NotImplementedError
+		
+		
+		
+class StdlibJSONBackend(JSONBackend):
+	"""Uses the standard library's C accelerated encoder, which is always there"""
+	
+	name = 'json'
+	
+	def __init__(self):
+		# Reusing encoders saves making one on every call, as json.dumps does
+		self.encoders = {
+			False: json.JSONEncoder(default=encode_default),
+			True: json.JSONEncoder(default=encode_default, separators=(',', ':'))
+		}
+		
 		
-		if isinstance(obj, datetime):
-			return obj.isoformat()
+	def dumps(self, obj, compact=False):
+		return self.encoders[compact].encode(obj)
 		
-		return super(CellarDoorJSONEncoder, self).default(obj)
 		
 		
+class SimplejsonBackend(JSONBackend):
+	"""
+	Uses simplejson, whose C encoder turns sets and other iterables into 
+	arrays itself, leaving only dates and ids to Python.
+	"""
+	
+	name = 'simplejson'
+	
+	def __init__(self):
+		import simplejson
+		options = dict(default=encode_default, iterable_as_array=True, namedtuple_as_object=False, 
+			use_decimal=False, for_json=False)
+		self.encoders = {
+			False: simplejson.JSONEncoder(**options),
+			True: simplejson.JSONEncoder(separators=(',', ':'), **options)
+		}
+		
+		
+	def dumps(self, obj, compact=False):
+		return self.encoders[compact].encode(obj)
+		
+		
+# Backends in order of preference
+json_backends = [SimplejsonBackend, StdlibJSONBackend]
+
+
+def register_json_backend(backend, preferred=True):
+	"""Add a `JSONBackend` class, ahead of the others if it's `preferred`"""
+	if preferred:
+		json_backends.insert(0, backend)
+	else:
+		json_backends.insert(len(json_backends) - 1, backend)
+		
+		
+def get_json_backend(name=None):
+	"""Get the named JSON backend, or the most preferred one that's installed"""
+	for backend in json_backends:
+		if name is not None and backend.name != name:
+			continue
+		try:
+			return backend()
+		except ImportError:
+			if name is not None:
+				raise
+	raise ValueError("There's no JSON backend called '%s'" % name)
+	
+	
 def as_date(obj):
 	if '_date' in obj:
 		return datetime(*map(int, re.split('[^\d]', obj['_date'])[:-1]))
 	else:
 		return obj
 		
+		
+def to_date(value):
+	if isinstance(value, dict) and '_date' in value:
+		return as_date(value)
+	return value
+	
+	
+def to_dates(value):
+	if isinstance(value, list):
+		return [to_date(v) for v in value]
+	return to_date(value)
+	
+	
+	
+class DateDecoder(object):
+	"""
+	Turns `{"_date": ...}` objects into datetimes where an entity, or any of 
+	its subtypes, has `DateTime` fields, in fields sent to it or in filters 
+	of it. The fields to look at are worked out once, so decoding doesn't 
+	have to look at anything else.
+	"""
+	
+	UPDATE_OPERATORS = ('$push', '$pull', '$addToSet')
+	FILTER_OPERATORS = ('$and', '$or', '$nor')
+	
+	def __init__(self, entity):
+		fields = {}
+		for e in [entity] + entity.children:
+			fields.update(e.fields)
+		self.converters = self._compile_fields(fields)
+		self.filter_paths = {}
+		self._collect_paths(fields, '')
+		
+		
+	def decode_fields(self, fields):
+		"""Decode the dates in the fields of an item, a list of items or an update"""
+		if isinstance(fields, list):
+			return [self.decode_fields(f) for f in fields]
+		if isinstance(fields, dict):
+			for k,v in fields.items():
+				if k in self.converters:
+					fields[k] = self.converters[k](v)
+				elif k in self.UPDATE_OPERATORS:
+					self.decode_fields(v)
+		return fields
+		
+		
+	def decode_filter(self, filter):
+		"""Decode the dates compared to date fields in a filter"""
+		if isinstance(filter, dict):
+			for k,v in filter.items():
+				if k in self.filter_paths:
+					filter[k] = self._decode_condition(v)
+				elif k in self.FILTER_OPERATORS and isinstance(v, list):
+					for f in v:
+						self.decode_filter(f)
+		return filter
+		
+		
+	def _decode_condition(self, value):
+		if isinstance(value, dict) and '_date' not in value:
+			for k,v in value.items():
+				value[k] = self._decode_condition(v) if k == '$not' else to_dates(v)
+			return value
+		return to_dates(value)
+		
+		
+	def _compile_fields(self, fields):
+		converters = {}
+		for k,v in fields.items():
+			converter = self._compile(v)
+			if converter:
+				converters[k] = converter
+		return converters
+		
+		
+	def _compile(self, field):
+		if isinstance(field, DateTime):
+			return to_date
+		if isinstance(field, OneOf):
+			if any(isinstance(f, DateTime) for f in field.fields):
+				return to_date
+		if isinstance(field, ListOf):
+			convert = self._compile(field.field)
+			if convert:
+				# A single value is an item pushed to or pulled from the list
+				return lambda v: [convert(x) for x in v] if isinstance(v, list) else convert(v)
+		if isinstance(field, Compound):
+			converters = self._compile_fields(field.fields)
+			if converters:
+				def convert(value):
+					if isinstance(value, dict):
+						for k,v in value.items():
+							if k in converters:
+								value[k] = converters[k](v)
+					return value
+				return convert
+		return None
+		
+		
+	def _collect_paths(self, fields, prefix):
+		for k,v in fields.items():
+			while isinstance(v, ListOf):
+				v = v.field
+			if isinstance(v, Compound):
+				self._collect_paths(v.fields, prefix + k + '.')
+			elif self._compile(v):
+				self.filter_paths[prefix + k] = True
+				
+				
+_date_decoders = {}
+
+def get_date_decoder(entity):
+	decoder = _date_decoders.get(entity)
+	if decoder is None:
+		decoder = _date_decoders[entity] = DateDecoder(entity)
+	return decoder
+	
+	
+def make_value_encoder(dumps, compact=False):
+	"""
+	Get a function that encodes a value as `encode(value, 0)`, giving a list 
+	of strings to join. It's one of the standard library's C encoders, made 
+	once and kept, when they're there. Every backend gives the same output as 
+	the standard library, so it can stand in for any of them.
+	"""
+	if json_encoder.c_make_encoder is None:
+		return lambda value, level: [dumps(value, compact)]
+	key_separator, item_separator = (':', ',') if compact else (': ', ', ')
+	return json_encoder.c_make_encoder(None, encode_default, json_encoder.encode_basestring_ascii, None, 
+		key_separator, item_separator, False, False, True)
+		
+		
+def compile_item_encoder(entity, keys, dumps, compact=False):
+	"""
+	Generate a function that encodes items of `entity` (or its subtypes) that 
+	have exactly `keys`, writing their keys in sorted order. `Text`, `Integer` 
+	and `DateTime` values are written directly when they have the type their 
+	field expects, and anything else, including embedded items, goes to a 
+	value encoder from `make_value_encoder`. Dates are only written directly 
+	while `type_encoders` encodes them with `isoformat`, so replace that 
+	before encoding anything.
+	"""
+	fields = {}
+	for e in [entity] + entity.children:
+		fields.update(e.fields)
+	inline_dates = type_encoders.get(datetime) is datetime.isoformat
+	comma, colon = (',', ':') if compact else (', ', ': ')
+	lines = ['def encode(item):']
+	parts = []
+	for i, key in enumerate(sorted(keys)):
+		v = 'v%d' % i
+		lines.append('\t%s = item[%r]' % (v, key))
+		field = fields.get(key)
+		if isinstance(field, Text):
+			value = '(encode_string(%s) if type(%s) is unicode or type(%s) is str else join(encode_value(%s, 0)))' % (v, v, v, v)
+		elif isinstance(field, Integer):
+			value = '(str(%s) if type(%s) is int else join(encode_value(%s, 0)))' % (v, v, v)
+		elif isinstance(field, DateTime) and inline_dates:
+			value = '(\'"\' + %s.isoformat() + \'"\' if type(%s) is datetime else join(encode_value(%s, 0)))' % (v, v, v)
+		else:
+			value = 'join(encode_value(%s, 0))' % v
+		prefix = (comma if i else '{') + json_encoder.encode_basestring_ascii(key) + colon
+		parts.append('%r + %s' % (prefix, value))
+	if parts:
+		lines.append('\treturn (%s + \'}\')' % ' +\n\t\t'.join(parts))
+	else:
+		lines.append("\treturn '{}'")
+	namespace = dict(encode_string=json_encoder.encode_basestring_ascii, encode_value=make_value_encoder(dumps, compact), 
+		join=''.join, datetime=datetime)
+	exec compile('\n'.join(lines), '<%s encoder>' % entity.__name__, 'exec') in namespace
+	return namespace['encode']
+	
+	
+whitespace = re.compile(r'[ \t\n\r]*')
 
+def read_more(stream, buffer, pos, read_size, max_item_size):
+	"""
+	Drop what's been parsed from `buffer` and add more of `stream` to it, 
+	or return `None` at the end of the stream.
+	"""
+	pending = len(buffer) - pos
+	if pending > max_item_size:
+		raise ValueError('An item is larger than %d bytes' % max_item_size)
+	# Read more at once as an item grows, so it isn't parsed over and over
+	chunk = stream.read(max(read_size, pending))
+	if not chunk:
+		return None
+	return buffer[pos:] + chunk
+	
+	
+def read_trailing(stream, buffer, pos, read_size):
+	"""Raise `ValueError` if there's anything but whitespace after `pos` in `buffer` or the rest of `stream`"""
+	while True:
+		if whitespace.match(buffer, pos).end() < len(buffer):
+			raise ValueError('Unexpected data after the array')
+		buffer, pos = stream.read(read_size), 0
+		if not buffer:
+			return
+			
+			
+def read_array(stream, buffer, pos, decoder, decode=None, read_size=65536, max_item_size=16777216):
+	"""
+	Yield the items of a JSON array one at a time, reading more of `stream` 
+	as it's needed. `buffer` is what's been read of it so far, and `pos` is 
+	just after the opening `[`. Each item is passed through `decode`. Once 
+	the array is closed, the rest of the stream is read to check there's 
+	nothing but whitespace after it.
+	"""
+	first, after_item = True, False
+	while True:
+		pos = whitespace.match(buffer, pos).end()
+		if pos == len(buffer):
+			buffer = read_more(stream, buffer, pos, read_size, max_item_size)
+			if buffer is None:
+				raise ValueError('The array is never closed')
+			pos = 0
+			continue
+			
+		char = buffer[pos]
+		if char == ']' and (first or after_item):
+			read_trailing(stream, buffer, pos + 1, read_size)
+			return
+		if after_item:
+			if char != ',':
+				raise ValueError('Expected , or ] between items')
+			pos += 1
+			after_item = False
+			continue
+			
+		while True:
+			try:
+				item, end = decoder.raw_decode(buffer, pos)
+				error = None
+				if end < len(buffer):
+					break
+			except ValueError, e:
+				error = e
+			# The item may carry on past what's been read so far
+			more = read_more(stream, buffer, pos, read_size, max_item_size)
+			if more is None:
+				if error:
+					raise error
+				break
+			buffer, pos = more, 0
+			
+		yield decode(item) if decode else item
+		pos = end
+		first, after_item = False, True
+		
+		
 
 class JSONSerializer(Serializer):
+	"""
+	Serializes with the fastest installed JSON backend, or the one named by 
+	`backend`. Set `compact` to leave out the spaces after separators.
+	
+	Prepared items serialized on their own, as the NDJSON view and fragment 
+	caches do, are written by encoders compiled for their entity and keys, 
+	with their keys in sorted order. Set `compile_items` to `False` to always 
+	use the backend.
+	"""
 	
 	mimetype = 'application/json'
 	
+	# Item encoders are compiled for up to this many sets of keys, after 
+	# which items with new sets of keys are encoded by the backend.
+	max_item_encoders = 1000
+	
+	def __init__(self, backend=None, compact=False, compile_items=True):
+		self.backend = get_json_backend(backend)
+		self.compact = compact
+		self.compile_items = compile_items
+		self.item_encoders = {}
+		
+		
 	def serialize(self, obj):
-		return json.dumps(obj, cls=CellarDoorJSONEncoder)
+		entity = getattr(obj, 'entity', None)
+		if entity is not None and self.compile_items:
+			encode = self.get_item_encoder(entity, obj)
+			if encode is not None:
+				return encode(obj)
+		return self.backend.dumps(obj, self.compact)
+		
+		
+	def get_item_encoder(self, entity, item):
+		"""
+		Get the compiled encoder for items of an entity with the same keys as 
+		`item`, compiling it the first time those keys are seen. Encoding an 
+		item on its own this way skips the per call overhead of the backend, 
+		which is most of the cost of a small item. Whole lists are left to the 
+		backend, which is as fast on them.
+		"""
+		key = (entity, tuple(sorted(item)))
+		encode = self.item_encoders.get(key)
+		if encode is None:
+			if len(self.item_encoders) >= self.max_item_encoders:
+				return None
+			encode = self.item_encoders[key] = compile_item_encoder(entity, key[1], self.backend.dumps, self.compact)
+		return encode
+		
+		
+	def join_serialized(self, items):
+		return '[' + (',' if self.compact else ', ').join(items) + ']'
+		
+		
+	def unserialize(self, stream, entity=None):
+		"""
+		Decode fields sent to `entity`. Without an entity, any `{"_date": ...}`
+		object is taken to be a date, which means checking every object.
+		"""
+		if entity is None:
+			return json.load(stream, object_hook=as_date)
+		return get_date_decoder(entity).decode_fields(json.load(stream))
+		
+		
+	def unserialize_string(self, data, entity=None):
+		if entity is None:
+			return json.loads(data, object_hook=as_date)
+		return get_date_decoder(entity).decode_fields(json.loads(data))
 		
 		
-	def unserialize(self, stream):
-		return json.load(stream, object_hook=as_date)
+	def unserialize_stream(self, stream, entity=None):
+		head = ''
+		while not head.strip():
+			chunk = stream.read(self.read_size)
+			if not chunk:
+				break
+			head += chunk
+		start = whitespace.match(head).end()
+		if head[start:start + 1] != '[':
+			return self.unserialize_string(head + stream.read(), entity=entity)
+		if entity is None:
+			decoder, decode = json.JSONDecoder(object_hook=as_date), None
+		else:
+			decoder, decode = json.JSONDecoder(), get_date_decoder(entity).decode_fields
+		return read_array(stream, head, start + 1, decoder, decode, self.read_size, self.max_item_size)
 		
 		
-	def unserialize_string(self, data):
-		return json.loads(data, object_hook=as_date)
\ No newline at end of file
+	def unserialize_filter(self, data, entity=None):
+		"""Decode a filter of `entity`"""
+		if entity is None:
+			return json.loads(data, object_hook=as_date)
+		return get_date_decoder(entity).decode_filter(json.loads(data))
\ No newline at end of file
@@ -1,8 +1,22 @@
 import msgpack
-from datetime import datetime
+import struct
+import calendar
+from datetime import datetime, timedelta
 import collections
 from . import Serializer
 
+try:
+	from bson.objectid import ObjectId
+except ImportError:
+	ObjectId = None
+
+
+# Extension type codes
+DATETIME_EXT = 1
+OBJECTID_EXT = 2
+
+EPOCH = datetime(1970, 1, 1)
+
 
 def default_handler(obj):
 	if isinstance(obj, collections.Iterable):
@@ -13,15 +27,127 @@ def default_handler(obj):
 	
 	raise ValueError, "Can't pack object of type %s" % type(obj).__name__
 	
+	
+def ext_default(obj):
+	"""
+	Packs datetimes and ObjectIds as msgpack extension types so they
+	survive a round trip. Timezone aware datetimes are stored as UTC
+	and come back naive.
+	
+	Datetimes are laid out like the timestamps of the msgpack spec, in 4, 8 
+	or 12 bytes depending on whether they need nanoseconds and how far they 
+	are from 1970, so clients can reuse a timestamp decoder for them.
+	"""
+	if isinstance(obj, datetime):
+		if obj.utcoffset() is not None:
+			seconds = calendar.timegm(obj.utctimetuple())
+		else:
+			seconds = calendar.timegm(obj.timetuple())
+		nanoseconds = obj.microsecond * 1000
+		if seconds >> 34 == 0:
+			if nanoseconds == 0 and seconds >> 32 == 0:
+				data = struct.pack('!I', seconds)
+			else:
+				data = struct.pack('!Q', nanoseconds << 34 | seconds)
+		else:
+			data = struct.pack('!Iq', nanoseconds, seconds)
+		return msgpack.ExtType(DATETIME_EXT, data)
+	
+	if ObjectId is not None and isinstance(obj, ObjectId):
+		return msgpack.ExtType(OBJECTID_EXT, obj.binary)
+	
+	if isinstance(obj, collections.Iterable):
+		return list(obj)
+	
+	raise ValueError, "Can't pack object of type %s" % type(obj).__name__
+	
+	
+def ext_hook(code, data):
+	if code == DATETIME_EXT:
+		if len(data) == 4:
+			seconds, nanoseconds = struct.unpack('!I', data)[0], 0
+		elif len(data) == 8:
+			value = struct.unpack('!Q', data)[0]
+			seconds, nanoseconds = value & 0x3ffffffff, value >> 34
+		else:
+			nanoseconds, seconds = struct.unpack('!Iq', data)
+		return EPOCH + timedelta(seconds=seconds, microseconds=nanoseconds // 1000)
+	
+	if code == OBJECTID_EXT and ObjectId is not None:
+		return ObjectId(data)
+	
+	return msgpack.ExtType(code, data)
+	
+	
+def unpack_item(unpacker, stream, max_item_size):
+	"""Unpack the next item, raising `ValueError` if it's cut off or larger than `max_item_size`"""
+	try:
+		return unpacker.unpack()
+	except msgpack.OutOfData:
+		# The unpacker stops reading once its buffer is full
+		if stream.read(1):
+			raise ValueError('An item is larger than %d bytes' % max_item_size)
+		raise ValueError('The body is cut off')
+		
+		
+def unpack_end(unpacker):
+	"""Raise `ValueError` if there's anything left to unpack"""
+	try:
+		unpacker.skip()
+	except msgpack.OutOfData:
+		return
+	except Exception:
+		pass
+	raise ValueError('Unexpected data after the body')
+	
+	
+def unpack_items(unpacker, stream, length, max_item_size):
+	for _ in xrange(length):
+		yield unpack_item(unpacker, stream, max_item_size)
+	unpack_end(unpacker)
+		
 
 
 class MsgPackSerializer(Serializer):
+	"""
+	Packs dates as ISO strings, unless `ext_types` is set, in which case 
+	dates and ObjectIds are packed as the extension types of `ext_default`. 
+	Clients ask for those with the `EXT_MIMETYPE` media type, so clients 
+	that don't know about them keep getting strings.
+	
+	Extension types are always unpacked, whichever way it packs.
+	"""
 	
 	mimetype = 'application/x-msgpack'
 	
+	EXT_MIMETYPE = 'application/x-msgpack; ext=1'
+	
+	def __init__(self, ext_types=False):
+		self.ext_types = ext_types
+		self.default = ext_default if ext_types else default_handler
+		
+		
 	def serialize(self, obj):
-		return msgpack.packb(obj, default=default_handler)
+		return msgpack.packb(obj, default=self.default)
+		
+		
+	def join_serialized(self, items):
+		return msgpack.Packer().pack_array_header(len(items)) + ''.join(items)
+		
+		
+	def unserialize(self, stream, entity=None):
+		# Nothing here needs to know the entity, which is 
+		# taken so that every serializer can be called alike.
+		return msgpack.unpack(stream, ext_hook=ext_hook)
 		
 		
-	def unserialize(self, stream):
-		return msgpack.unpack(stream)
\ No newline at end of file
+	def unserialize_stream(self, stream, entity=None):
+		unpacker = msgpack.Unpacker(stream, ext_hook=ext_hook, 
+			read_size=self.read_size, max_buffer_size=self.max_item_size)
+		try:
+			length = unpacker.read_array_header()
+		except msgpack.UnpackValueError:
+			item = unpack_item(unpacker, stream, self.max_item_size)
+			unpack_end(unpacker)
+			return item
+		return unpack_items(unpacker, stream, length, self.max_item_size)
\ No newline at end of file
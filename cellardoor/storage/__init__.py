@@ -1,3 +1,11 @@
+# Read preferences. Storages that don't have replicas can ignore them.
+PRIMARY = 'primary'
+PRIMARY_PREFERRED = 'primary_preferred'
+SECONDARY = 'secondary'
+SECONDARY_PREFERRED = 'secondary_preferred'
+NEAREST = 'nearest'
+
+
 class Storage(object):
 	
 	# These are the methods you need to implement
@@ -8,15 +16,15 @@ class Storage(object):
 		pass
 		
 	
-	def get(self, entity, filter=None, fields=None, sort=None, offset=0, limit=0, count=False):
+	def get(self, entity, filter=None, fields=None, sort=None, offset=0, limit=0, count=False, read_preference=None):
 		raise NotImplementedError
 		
 		
-	def get_by_ids(self, entity, ids, filter=None, fields=None, sort=None, offset=0, limit=0, count=False):
+	def get_by_ids(self, entity, ids, filter=None, fields=None, sort=None, offset=0, limit=0, count=False, read_preference=None):
 		raise NotImplementedError
 		
 		
-	def get_by_id(self, entity, id, fields=None):
+	def get_by_id(self, entity, id, fields=None, read_preference=None):
 		raise NotImplementedError
 		
 		
@@ -24,7 +32,18 @@ class Storage(object):
 		raise NotImplementedError
 		
 		
-	def update(self, entity, id, fields, replace=False):
+	def update(self, entity, id, fields, replace=False, operations=None, filter=None, version=None):
+		"""
+		Set `fields` on an item, or replace it with them, and return the updated 
+		item. `operations` are atomic changes of the form `operator => {key: value}`, 
+		where the operator is one of `$inc`, `$push`, `$pull`, `$addToSet` and 
+		`$unset`, applied in the same write. If `filter` is given, the item is only 
+		updated if it also matches it. Returns `None` if no item was updated.
+		
+		Items of versioned entities get a new `_version` on every write. If `version` 
+		is given, the item is only updated if it's still at that version, otherwise 
+		`cellardoor.errors.VersionConflictError` is raised.
+		"""
 		raise NotImplementedError
 		
 		
@@ -33,4 +52,97 @@ class Storage(object):
 		
 		
 	def check_filter(self, filter, allowed_fields, context):
-		raise NotImplementedError
\ No newline at end of file
+		raise NotImplementedError
+		
+		
+	# Optional. Yield the items `get` would return as they're read, 
+	# for results too big to hold in memory at once.
+	
+	def iterate(self, entity, filter=None, fields=None, sort=None, offset=0, limit=0, read_preference=None):
+		return iter(self.get(entity, filter=filter, fields=fields, sort=sort, offset=offset, limit=limit, 
+			read_preference=read_preference))
+		
+		
+	# Optional. Describe how the storage would run a query.
+	
+	def explain(self, entity, filter=None, fields=None, sort=None, offset=0, limit=0):
+		return None
+		
+		
+	# Optional. Reject ids that can never belong to an item without looking them up.
+	
+	def is_valid_id(self, entity, id):
+		return True
+		
+		
+	# Optional. Convert an id to the value it's stored as in an item's `_id`.
+	
+	def stored_id(self, entity, id):
+		return id
+		
+		
+		
+class StorageWrapper(Storage):
+	"""
+	Passes every call through to another storage. Extend this to add
+	behavior around an existing storage without reimplementing it.
+	"""
+	
+	def __init__(self, storage):
+		self.storage = storage
+		
+		
+	def setup(self, model):
+		return self.storage.setup(model)
+		
+		
+	def get(self, entity, filter=None, fields=None, sort=None, offset=0, limit=0, count=False, read_preference=None):
+		return self.storage.get(entity, filter=filter, fields=fields, sort=sort, offset=offset, limit=limit, count=count, 
+			read_preference=read_preference)
+		
+		
+	def get_by_ids(self, entity, ids, filter=None, fields=None, sort=None, offset=0, limit=0, count=False, read_preference=None):
+		return self.storage.get_by_ids(entity, ids, filter=filter, fields=fields, sort=sort, offset=offset, limit=limit, count=count, 
+			read_preference=read_preference)
+		
+		
+	def get_by_id(self, entity, id, fields=None, read_preference=None):
+		return self.storage.get_by_id(entity, id, fields=fields, read_preference=read_preference)
+		
+		
+	def create(self, entity, fields):
+		return self.storage.create(entity, fields)
+		
+		
+	def update(self, entity, id, fields, replace=False, operations=None, filter=None, version=None):
+		return self.storage.update(entity, id, fields, replace=replace, operations=operations, filter=filter, 
+			version=version)
+		
+		
+	def delete(self, entity, id):
+		return self.storage.delete(entity, id)
+		
+		
+	def check_filter(self, filter, allowed_fields, context):
+		return self.storage.check_filter(filter, allowed_fields, context)
+		
+		
+	def iterate(self, entity, filter=None, fields=None, sort=None, offset=0, limit=0, read_preference=None):
+		return self.storage.iterate(entity, filter=filter, fields=fields, sort=sort, offset=offset, limit=limit, 
+			read_preference=read_preference)
+		
+		
+	def explain(self, entity, filter=None, fields=None, sort=None, offset=0, limit=0):
+		return self.storage.explain(entity, filter=filter, fields=fields, sort=sort, offset=offset, limit=limit)
+		
+		
+	def is_valid_id(self, entity, id):
+		return self.storage.is_valid_id(entity, id)
+		
+		
+	def stored_id(self, entity, id):
+		return self.storage.stored_id(entity, id)
+		
+		
+	def __getattr__(self, name):
+		return getattr(self.storage, name)
@@ -0,0 +1,245 @@
+import math
+import time
+import struct
+import hashlib
+import logging
+import threading
+from . import StorageWrapper
+
+__all__ = [
+	'BloomFilter',
+	'BloomFilterStorage'
+]
+
+
+class BloomFilter(object):
+	"""
+	A set of keys that can answer "definitely not in the set" or "probably in
+	the set". It's sized for `capacity` keys with a false positive rate of
+	`error_rate`; adding more keys than that makes false positives likelier.
+	Keys can't be removed.
+	"""
+
+	def __init__(self, capacity=100000, error_rate=0.01):
+		self.capacity = max(int(capacity), 1)
+		self.error_rate = error_rate
+		self.size = int(math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+		self.hashes = max(int(round(float(self.size) / self.capacity * math.log(2))), 1)
+		self.bits = bytearray((self.size + 7) // 8)
+		self.count = 0
+		self.lock = threading.Lock()
+
+
+	def add(self, key):
+		positions = self._positions(key)
+		with self.lock:
+			for i in positions:
+				self.bits[i >> 3] |= 1 << (i & 7)
+			self.count += 1
+
+
+	def __contains__(self, key):
+		bits = self.bits
+		return all(bits[i >> 3] & (1 << (i & 7)) for i in self._positions(key))
+
+
+	@property
+	def memory(self):
+		"""The size of the filter, in bytes"""
+		return len(self.bits)
+
+
+	@property
+	def false_positive_rate(self):
+		"""The expected false positive rate for the number of keys added so far"""
+		return (1 - math.exp(-float(self.hashes) * self.count / self.size)) ** self.hashes
+
+
+	def _positions(self, key):
+		if isinstance(key, unicode):
+			key = key.encode('utf-8')
+		elif not isinstance(key, str):
+			key = unicode(key).encode('utf-8')
+		h1, h2 = struct.unpack('<QQ', hashlib.md5(key).digest())
+		return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+
+
+class BloomFilterStorage(StorageWrapper):
+	"""
+	Keeps a Bloom filter of the ids of each of `entities`, so lookups of ids
+	that don't exist are answered without reaching the wrapped storage::
+
+		storage = BloomFilterStorage(MongoDBStorage('hamblog'), entities=('Person', 'Post'),
+			local=('Draft',), trusted=('Tag',), max_staleness=60, capacity=1000000, error_rate=0.001)
+
+	The filters are built when the model is set up, from a scan of every id,
+	and are kept up to date with items created and deleted through this
+	storage. They're kept by each process, so items created or deleted by
+	other processes aren't seen until the filter is rebuilt, which happens
+	when it's used more than `max_staleness` seconds after it was built. So
+	with several processes writing, an id created elsewhere can be reported
+	missing for up to `max_staleness` seconds. If a filter is stale while 
+	another thread rebuilds it, its misses go to the wrapped storage.
+
+	Ids missing from the filters of `local` entities, whose items are only
+	ever created by this process, are taken not to exist however stale they
+	are. Only use `local` with a single process writing.
+
+	For `trusted` entities, which are also local, an id the filter probably
+	has is also taken to exist when only its existence is being checked
+	(i.e. it's fetched with `fields={}`), as `Link.validate` does, unless the
+	filter is stale. Deleting an item of a trusted entity through this 
+	storage stops its id being trusted; deleting it elsewhere only does once
+	the filter is rebuilt.
+	"""
+
+	def __init__(self, storage, entities=(), local=(), trusted=(), max_staleness=60.0, capacity=100000, error_rate=0.01):
+		"""
+		Each process keeps its own filters: see the class docstring before using 
+		`local` or `trusted` with more than one process writing to the storage.
+		"""
+		super(BloomFilterStorage, self).__init__(storage)
+		self.entity_names = set(entities) | set(local) | set(trusted)
+		self.local = set(local) | set(trusted)
+		self.trusted = set(trusted)
+		self.max_staleness = max_staleness
+		self.capacity = capacity
+		self.error_rate = error_rate
+		self.model = None
+		self.filters = {}
+		self.built = {}
+		self.locks = dict((name, threading.Lock()) for name in self.entity_names)
+		self.deleted = {}
+		self.metrics = {}
+		self.logger = logging.getLogger(__name__)
+
+
+	def setup(self, model):
+		result = self.storage.setup(model)
+		self.model = model
+		self.rebuild()
+		return result
+
+
+	def rebuild(self, entity=None):
+		"""Build the filters again from the ids in storage"""
+		names = [entity.__name__] if entity else self.entity_names
+		for name in names:
+			items = self.storage.get(self.model.entities[name], fields={})
+			bloom = BloomFilter(capacity=max(self.capacity, len(items) * 2), error_rate=self.error_rate)
+			for item in items:
+				bloom.add(item['_id'])
+			self.filters[name] = bloom
+			self.deleted[name] = set()
+			self.built[name] = time.time()
+			self.metrics.setdefault(name, {'checks': 0, 'rejected': 0, 'trusted': 0, 'false_positives': 0, 'unseen': 0, 'rebuilds': 0})
+			self.metrics[name]['rebuilds'] += 1
+			self.logger.info('Built a %d byte Bloom filter of %d %s ids.', bloom.memory, len(items), name)
+
+
+	def get_by_id(self, entity, id, fields=None, read_preference=None):
+		bloom, fresh = self._get_filter(entity)
+		if bloom is None:
+			return self.storage.get_by_id(entity, id, fields=fields, read_preference=read_preference)
+
+		metrics = self.metrics[entity.__name__]
+		metrics['checks'] += 1
+		if id not in bloom:
+			if fresh or entity.__name__ in self.local:
+				metrics['rejected'] += 1
+				return None
+			item = self.storage.get_by_id(entity, id, fields=fields, read_preference=read_preference)
+			if item is not None:
+				metrics['unseen'] += 1
+			return item
+		if fresh and self._can_trust(entity, id, fields):
+			metrics['trusted'] += 1
+			return {'_id': id}
+
+		item = self.storage.get_by_id(entity, id, fields=fields, read_preference=read_preference)
+		if item is None:
+			metrics['false_positives'] += 1
+		return item
+
+
+	def get_by_ids(self, entity, ids, filter=None, fields=None, sort=None, offset=0, limit=0, count=False, read_preference=None):
+		bloom, fresh = self._get_filter(entity)
+		if bloom is not None and (fresh or entity.__name__ in self.local):
+			metrics = self.metrics[entity.__name__]
+			metrics['checks'] += len(ids)
+			found = [id for id in ids if id in bloom]
+			metrics['rejected'] += len(ids) - len(found)
+			ids = found
+			if not ids:
+				return 0 if count else []
+			if fresh and not (filter or sort or offset or limit or count) and all(self._can_trust(entity, id, fields) for id in ids):
+				metrics['trusted'] += len(ids)
+				seen = set()
+				return [{'_id': id} for id in ids if not (id in seen or seen.add(id))]
+		return self.storage.get_by_ids(entity, ids, filter=filter, fields=fields, sort=sort, offset=offset, limit=limit,
+			count=count, read_preference=read_preference)
+
+
+	def create(self, entity, fields):
+		id = self.storage.create(entity, fields)
+		# Subtypes are stored alongside their base entities
+		for e in [entity] + list(entity.hierarchy):
+			name = e.__name__
+			if name in self.filters:
+				self.filters[name].add(id)
+				self.deleted[name].discard(id)
+		return id
+
+
+	def delete(self, entity, id):
+		result = self.storage.delete(entity, id)
+		root = entity.hierarchy[0] if entity.hierarchy else entity
+		for e in [root] + root.children:
+			if e.__name__ in self.deleted:
+				self.deleted[e.__name__].add(id)
+		return result
+
+
+	def stats(self):
+		"""
+		Get the size and expected false positive rate of each filter, along with 
+		how many ids it was asked about, rejected and trusted, how many it let 
+		through that turned out to be missing (false positives or deleted ids), 
+		how many it didn't have that turned out to exist while it was stale 
+		(created elsewhere), and how many times it's been built.
+		"""
+		stats = {}
+		for name, bloom in self.filters.items():
+			stats[name] = dict(self.metrics[name],
+				ids=bloom.count,
+				capacity=bloom.capacity,
+				memory=bloom.memory,
+				hashes=bloom.hashes,
+				false_positive_rate=bloom.false_positive_rate
+			)
+		return stats
+
+
+	def _get_filter(self, entity):
+		# Gets an entity's filter, rebuilding it if it's stale, and whether it's 
+		# fresh. If another thread is already rebuilding it, it stays stale.
+		name = entity.__name__
+		bloom = self.filters.get(name)
+		if bloom is None:
+			return None, False
+		if time.time() - self.built[name] <= self.max_staleness:
+			return bloom, True
+		lock = self.locks[name]
+		if not lock.acquire(False):
+			return bloom, False
+		try:
+			self.rebuild(self.model.entities[name])
+		finally:
+			lock.release()
+		return self.filters[name], True
+
+
+	def _can_trust(self, entity, id, fields):
+		name = entity.__name__
+		return name in self.trusted and fields is not None and len(fields) == 0 and id not in self.deleted[name]
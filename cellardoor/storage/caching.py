@@ -0,0 +1,277 @@
+import logging
+import threading
+from copy import deepcopy
+from . import StorageWrapper
+from ..cache import LRUCache, CacheError, freeze
+
+
+class CachingStorage(StorageWrapper):
+	"""
+	A read-through cache in front of another storage::
+
+		storage = CachingStorage(MongoDBStorage('hamblog'), max_size=5000, ttl=30)
+
+	Items fetched by id are cached per entity and id. Query results are cached
+	by entity and the normalized query, tagged with a generation number for the
+	entity. Writing an item evicts its cached copies and bumps the generation of
+	its entity (and any entities sharing its collection) so cached queries are
+	no longer used.
+
+	Ids that weren't found are remembered for `negative_ttl` seconds, so
+	repeated lookups of missing items don't reach the wrapped storage, and
+	ids the wrapped storage says can never exist aren't looked up at all.
+	Creating an item forgets that its id was missing.
+
+	By default each process gets its own `cellardoor.cache.LRUCache`. Pass any
+	other `cellardoor.cache.Cache` as `cache` to share one between processes.
+	If the cache can't be reached, reads go straight to the wrapped storage.
+	"""
+
+	def __init__(self, storage, max_size=1000, ttl=60, cache=None, negative_ttl=5):
+		super(CachingStorage, self).__init__(storage)
+		self.cache = cache if cache is not None else LRUCache(max_size=max_size, ttl=ttl)
+		self.negative_ttl = negative_ttl
+		self.logger = logging.getLogger(__name__)
+		self.hits = 0
+		self.misses = 0
+		self.stats_lock = threading.Lock()
+
+
+	def get(self, entity, filter=None, fields=None, sort=None, offset=0, limit=0, count=False, read_preference=None):
+		key = lambda: self._query_key(entity, None, filter, fields, sort, offset, limit, count)
+		return self._get_query(key, self.storage.get, entity, 
+			filter=filter, fields=fields, sort=sort, offset=offset, limit=limit, count=count, 
+			read_preference=read_preference)
+
+
+	def get_by_ids(self, entity, ids, filter=None, fields=None, sort=None, offset=0, limit=0, count=False, read_preference=None):
+		if filter or sort or offset or limit or count:
+			key = lambda: self._query_key(entity, tuple(ids), filter, fields, sort, offset, limit, count)
+			return self._get_query(key, self.storage.get_by_ids, entity, ids, 
+				filter=filter, fields=fields, sort=sort, offset=offset, limit=limit, count=count, 
+				read_preference=read_preference)
+
+		fields_key = self._fields_key(fields)
+		found = {}
+		missing = []
+		seen = set()
+		try:
+			for id in ids:
+				if id in seen:
+					continue
+				seen.add(id)
+				if not self.storage.is_valid_id(entity, id) or self._is_missing(entity, id):
+					continue
+				item = self._get_cached_item(entity, id, fields_key)
+				if item is None:
+					missing.append(id)
+				else:
+					found[id] = item
+			generation = self._generation(entity)
+		except CacheError:
+			self.logger.exception('Could not read from the cache.')
+			return self.storage.get_by_ids(entity, ids, fields=fields, read_preference=read_preference)
+
+		if missing:
+			for item in self.storage.get_by_ids(entity, missing, fields=fields, read_preference=read_preference):
+				self._set_cached_item(entity, item['_id'], fields_key, item, generation)
+				found[item['_id']] = item
+			for id in missing:
+				if id not in found:
+					self._set_missing(entity, id, generation)
+
+		results = []
+		seen = set()
+		for id in ids:
+			if id in found and id not in seen:
+				seen.add(id)
+				results.append(found[id])
+		return results
+
+
+	def get_by_id(self, entity, id, fields=None, read_preference=None):
+		if not self.storage.is_valid_id(entity, id):
+			return None
+		fields_key = self._fields_key(fields)
+		try:
+			if self._is_missing(entity, id):
+				return None
+			item = self._get_cached_item(entity, id, fields_key)
+			if item is not None:
+				return item
+			generation = self._generation(entity)
+		except CacheError:
+			self.logger.exception('Could not read from the cache.')
+			return self.storage.get_by_id(entity, id, fields=fields, read_preference=read_preference)
+		
+		item = self.storage.get_by_id(entity, id, fields=fields, read_preference=read_preference)
+		if item is not None:
+			self._set_cached_item(entity, id, fields_key, item, generation)
+		else:
+			self._set_missing(entity, id, generation)
+		return item
+
+
+	def create(self, entity, fields):
+		id = self.storage.create(entity, fields)
+		self.invalidate(entity, id)
+		return id
+
+
+	def update(self, entity, id, fields, replace=False, operations=None, filter=None, version=None):
+		try:
+			return self.storage.update(entity, id, fields, replace=replace, operations=operations, filter=filter, 
+				version=version)
+		finally:
+			self.invalidate(entity, id)
+
+
+	def delete(self, entity, id):
+		try:
+			return self.storage.delete(entity, id)
+		finally:
+			self.invalidate(entity, id)
+
+
+	def invalidate(self, entity, id=None):
+		"""
+		Evict an item from the cache and any cached query results for its entity.
+		Entities that share a collection are invalidated together since the same
+		item can be fetched through any of them.
+		"""
+		try:
+			for name in self._family_names(entity):
+				self.cache.incr(('generation', name))
+				if id is not None:
+					self.cache.delete(('id', name, id))
+					self.cache.delete(('missing', name, id))
+		except CacheError:
+			self.logger.exception('Could not invalidate %s %s in the cache.', entity.__name__, id)
+
+
+	def stats(self):
+		stats = self.cache.stats()
+		with self.stats_lock:
+			stats.update(hits=self.hits, misses=self.misses)
+		return stats
+
+
+	def _get_query(self, key_fn, fn, *args, **kwargs):
+		try:
+			key = key_fn()
+			result = self.cache.get(key)
+		except CacheError:
+			self.logger.exception('Could not read from the cache.')
+			return fn(*args, **kwargs)
+		
+		if result is None:
+			self._count_miss()
+			result = fn(*args, **kwargs)
+			self._set(key, deepcopy(result))
+			return result
+		self._count_hit()
+		return deepcopy(result)
+
+
+	def _get_cached_item(self, entity, id, fields_key):
+		items = self.cache.get(('id', entity.__name__, id))
+		if items is not None and fields_key in items:
+			self._count_hit()
+			return deepcopy(items[fields_key])
+		self._count_miss()
+
+
+	def _set_cached_item(self, entity, id, fields_key, item, generation):
+		key = ('id', entity.__name__, id)
+		try:
+			# Don't cache something that was fetched before a write to its entity finished
+			if generation != self._generation(entity):
+				return
+			items = self.cache.get(key)
+		except CacheError:
+			self.logger.exception('Could not read from the cache.')
+			return
+		items = dict(items) if items is not None else {}
+		items[fields_key] = deepcopy(item)
+		self._set_unless_written(entity, key, items, generation)
+		
+		
+	def _is_missing(self, entity, id):
+		if not self.negative_ttl:
+			return False
+		if self.cache.get(('missing', entity.__name__, id)):
+			self._count_hit()
+			return True
+		return False
+		
+		
+	def _set_missing(self, entity, id, generation):
+		if not self.negative_ttl:
+			return
+		try:
+			# It may have been created while it was being looked up
+			if generation != self._generation(entity):
+				return
+		except CacheError:
+			self.logger.exception('Could not read from the cache.')
+			return
+		self._set_unless_written(entity, ('missing', entity.__name__, id), True, generation, ttl=self.negative_ttl)
+		
+		
+	def _set(self, key, value, ttl=None):
+		try:
+			self.cache.set(key, value, ttl=ttl)
+		except CacheError:
+			self.logger.exception('Could not write to the cache.')
+		
+		
+	def _set_unless_written(self, entity, key, value, generation, ttl=None):
+		# A write can bump the generation and evict the key between checking
+		# the generation and setting the key, so check again afterwards and
+		# take back the value if that happened.
+		self._set(key, value, ttl=ttl)
+		try:
+			if generation != self._generation(entity):
+				self.cache.delete(key)
+		except CacheError:
+			self.logger.exception('Could not write to the cache.')
+		
+		
+	def _count_hit(self):
+		with self.stats_lock:
+			self.hits += 1
+		
+		
+	def _count_miss(self):
+		with self.stats_lock:
+			self.misses += 1
+		
+		
+	def _fields_key(self, fields):
+		# Cached items are grouped by id in a dict keyed by this, so it
+		# needs to be a string to survive being encoded by a shared cache.
+		return repr(freeze(fields))
+
+
+	def _query_key(self, entity, ids, filter, fields, sort, offset, limit, count):
+		return (
+			'query',
+			entity.__name__,
+			self._generation(entity),
+			ids,
+			freeze(filter),
+			freeze(fields),
+			freeze(sort),
+			offset,
+			limit,
+			count
+		)
+
+
+	def _generation(self, entity):
+		return self.cache.counter(('generation', entity.__name__))
+
+
+	def _family_names(self, entity):
+		root = entity.hierarchy[0] if entity.hierarchy else entity
+		return [root.__name__] + [c.__name__ for c in root.children]
@@ -0,0 +1,144 @@
+import math
+from ..model.fields import LatLng, BoundingBox, ValidationError
+from .. import errors
+
+__all__ = [
+	'WITHIN_BOX',
+	'WITHIN_RADIUS',
+	'parse_box',
+	'parse_radius',
+	'distance',
+	'GridIndex'
+]
+
+# Filter operators for `LatLng` fields:
+#
+#     {'location': {'$withinBox': [37.73, -122.48, 37.78, -122.37]}}
+#     {'location': {'$withinRadius': {'center': [37.76, -122.43], 'radius': 2.5}}}
+#
+# Boxes are SWNE, like `BoundingBox`, and radiuses are in kilometres.
+WITHIN_BOX = '$withinBox'
+WITHIN_RADIUS = '$withinRadius'
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 2 * math.pi * EARTH_RADIUS_KM / 360
+
+
+def parse_box(value):
+	"""Get a `(south, west, north, east)` box from the value of a `$withinBox` filter"""
+	try:
+		return BoundingBox(required=True).validate(value)
+	except ValidationError, e:
+		raise errors.CompoundValidationError({'filter': '%s: %s' % (WITHIN_BOX, e)})
+
+
+def parse_radius(value):
+	"""Get a `((lat, lng), radius)` from the value of a `$withinRadius` filter"""
+	if not isinstance(value, dict) or 'center' not in value or 'radius' not in value:
+		raise errors.CompoundValidationError({'filter': '%s: Expected a center and a radius' % WITHIN_RADIUS})
+	try:
+		center = LatLng(required=True).validate(value['center'])
+	except ValidationError, e:
+		raise errors.CompoundValidationError({'filter': '%s: %s' % (WITHIN_RADIUS, e)})
+	try:
+		radius = float(value['radius'])
+	except (ValueError, TypeError):
+		radius = -1
+	if radius < 0:
+		raise errors.CompoundValidationError({'filter': '%s: The radius must be a positive number' % WITHIN_RADIUS})
+	return center, radius
+
+
+def distance(a, b):
+	"""Get the great-circle distance between two `(lat, lng)` points in kilometres"""
+	lat1, lng1, lat2, lng2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+	h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+	return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(h)))
+
+
+
+class GridIndex(object):
+	"""
+	An in-memory spatial index of `(lat, lng)` points, for storages that
+	don't have one. Points are bucketed into cells of `cell_size` degrees,
+	so a query only looks at the points in the cells it overlaps::
+
+		index = GridIndex(cell_size=0.1)
+		index.add(place['_id'], place['location'])
+		index.within_box((37.73, -122.48, 37.78, -122.37))
+		index.within_radius((37.76, -122.43), 2.5)
+
+	Neither query wraps around the antimeridian.
+	"""
+
+	def __init__(self, cell_size=1.0):
+		self.cell_size = float(cell_size)
+		self.cells = {}
+		self.points = {}
+
+
+	def __len__(self):
+		return len(self.points)
+
+
+	def add(self, key, point):
+		if key in self.points:
+			self.remove(key)
+		point = tuple(point)
+		self.points[key] = point
+		self.cells.setdefault(self._cell(point), set()).add(key)
+
+
+	def remove(self, key):
+		point = self.points.pop(key, None)
+		if point is None:
+			return
+		cell = self._cell(point)
+		keys = self.cells[cell]
+		keys.discard(key)
+		if not keys:
+			del self.cells[cell]
+
+
+	def within_box(self, box):
+		"""Get the keys of the points inside a `(south, west, north, east)` box"""
+		south, west, north, east = box
+		return [key for key in self._candidates(south, west, north, east)
+			if south <= self.points[key][0] <= north and west <= self.points[key][1] <= east]
+
+
+	def within_radius(self, center, radius):
+		"""Get the keys of the points within `radius` kilometres of `center`, nearest first"""
+		lat, lng = center
+		lat_span = radius / KM_PER_DEGREE
+		south, north = max(lat - lat_span, -90.0), min(lat + lat_span, 90.0)
+		# A degree of longitude gets shorter away from the equator
+		widest = max(abs(south), abs(north))
+		if widest >= 90.0:
+			west, east = -180.0, 180.0
+		else:
+			lng_span = lat_span / math.cos(math.radians(widest))
+			west, east = max(lng - lng_span, -180.0), min(lng + lng_span, 180.0)
+		found = []
+		for key in self._candidates(south, west, north, east):
+			d = distance(center, self.points[key])
+			if d <= radius:
+				found.append((d, key))
+		found.sort()
+		return [key for d, key in found]
+
+
+	def _cell(self, point):
+		return (int(math.floor(point[0] / self.cell_size)), int(math.floor(point[1] / self.cell_size)))
+
+
+	def _candidates(self, south, west, north, east):
+		(min_x, min_y), (max_x, max_y) = self._cell((south, west)), self._cell((north, east))
+		if (max_x - min_x + 1) * (max_y - min_y + 1) > len(self.cells):
+			# Fewer occupied cells than cells in range
+			cells = [c for c in self.cells if min_x <= c[0] <= max_x and min_y <= c[1] <= max_y]
+		else:
+			cells = [(x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1) if (x, y) in self.cells]
+		for cell in cells:
+			for key in self.cells[cell]:
+				yield key
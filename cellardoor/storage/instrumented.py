@@ -0,0 +1,226 @@
+import time
+import json
+import bisect
+import logging
+import threading
+from copy import deepcopy
+from . import StorageWrapper
+
+__all__ = [
+	'InstrumentedStorage',
+	'MetricsSink',
+	'HistogramSink',
+	'LoggingSink',
+	'query_shape'
+]
+
+
+class MetricsSink(object):
+	"""
+	Receives a record for every storage call made through an `InstrumentedStorage`.
+	`error` is set if the call raised an exception.
+	"""
+
+	def record(self, entity, operation, duration, documents, shape, error=False):
+		raise NotImplementedError
+
+
+
+class HistogramSink(MetricsSink):
+	"""
+	Keeps latency histograms in memory for each entity and operation.
+	`buckets` are the upper bounds, in seconds, of each histogram bucket.
+	"""
+
+	buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+	def __init__(self, buckets=None):
+		if buckets is not None:
+			self.buckets = tuple(sorted(buckets))
+		self.metrics = {}
+		self.lock = threading.Lock()
+
+
+	def record(self, entity, operation, duration, documents, shape, error=False):
+		key = (entity, operation)
+		with self.lock:
+			metric = self.metrics.get(key)
+			if metric is None:
+				metric = self.metrics[key] = {
+					'count': 0,
+					'total_time': 0.0,
+					'max_time': 0.0,
+					'documents': 0,
+					'errors': 0,
+					'histogram': [0] * (len(self.buckets) + 1),
+					'shapes': {}
+				}
+			metric['count'] += 1
+			metric['total_time'] += duration
+			metric['max_time'] = max(metric['max_time'], duration)
+			metric['documents'] += documents
+			if error:
+				metric['errors'] += 1
+			metric['histogram'][bisect.bisect_left(self.buckets, duration)] += 1
+			if shape is not None:
+				metric['shapes'][shape] = metric['shapes'].get(shape, 0) + 1
+
+
+	def stats(self):
+		"""
+		Get a copy of the metrics, keyed by (entity name, operation). The
+		histogram has a count for each bucket plus one for everything slower
+		than the last bucket.
+		"""
+		with self.lock:
+			return deepcopy(self.metrics)
+
+
+
+class LoggingSink(MetricsSink):
+	"""
+	Logs every storage call at debug level.
+	"""
+
+	def __init__(self, logger=None):
+		self.logger = logger if logger else logging.getLogger(__name__)
+
+
+	def record(self, entity, operation, duration, documents, shape, error=False):
+		if error:
+			self.logger.debug('%s.%s failed after %.1fms: %s', entity, operation, duration * 1000, shape)
+		else:
+			self.logger.debug('%s.%s took %.1fms and returned %d documents: %s',
+				entity, operation, duration * 1000, documents, shape)
+
+
+
+class InstrumentedStorage(StorageWrapper):
+	"""
+	Times every call made to another storage and reports it to a `MetricsSink`::
+
+		sink = HistogramSink()
+		storage = InstrumentedStorage(MongoDBStorage('hamblog'), sink=sink, slow_query_threshold=0.1)
+
+	Queries that take longer than `slow_query_threshold` seconds are logged as
+	warnings, along with the storage's explanation of how it ran the query
+	if `explain_slow_queries` is set. Calls that raise are recorded too, with
+	the sink's `error` flag set.
+	"""
+
+	def __init__(self, storage, sink=None, slow_query_threshold=None, explain_slow_queries=True, clock=time.time):
+		super(InstrumentedStorage, self).__init__(storage)
+		self.sink = sink if sink is not None else HistogramSink()
+		self.slow_query_threshold = slow_query_threshold
+		self.explain_slow_queries = explain_slow_queries
+		self.clock = clock
+		self.logger = logging.getLogger(__name__)
+
+
+	def get(self, entity, filter=None, fields=None, sort=None, offset=0, limit=0, count=False, read_preference=None):
+		query = dict(filter=filter, fields=fields, sort=sort, offset=offset, limit=limit)
+		return self._measure(entity, 'count' if count else 'get', query, self.storage.get, entity,
+			filter=filter, fields=fields, sort=sort, offset=offset, limit=limit, count=count,
+			read_preference=read_preference)
+
+
+	def get_by_ids(self, entity, ids, filter=None, fields=None, sort=None, offset=0, limit=0, count=False, read_preference=None):
+		ids_filter = dict(filter) if filter else {}
+		ids_filter['_id'] = {'$in': [self.storage.stored_id(entity, id) for id in ids if self.storage.is_valid_id(entity, id)]}
+		query = dict(filter=ids_filter, fields=fields, sort=sort, offset=offset, limit=limit)
+		return self._measure(entity, 'count_by_ids' if count else 'get_by_ids', query, self.storage.get_by_ids, entity, ids,
+			filter=filter, fields=fields, sort=sort, offset=offset, limit=limit, count=count,
+			read_preference=read_preference)
+
+
+	def get_by_id(self, entity, id, fields=None, read_preference=None):
+		query = dict(filter={'_id': self.storage.stored_id(entity, id)}, fields=fields, limit=1)
+		return self._measure(entity, 'get_by_id', query, self.storage.get_by_id, entity, id,
+			fields=fields, read_preference=read_preference)
+
+
+	def create(self, entity, fields):
+		return self._measure(entity, 'create', None, self.storage.create, entity, fields)
+
+
+	def update(self, entity, id, fields, replace=False, operations=None, filter=None, version=None):
+		return self._measure(entity, 'replace' if replace else 'update', None, self.storage.update, entity, id, fields,
+			replace=replace, operations=operations, filter=filter, version=version)
+
+
+	def delete(self, entity, id):
+		return self._measure(entity, 'delete', None, self.storage.delete, entity, id)
+
+
+	def _measure(self, entity, operation, query, fn, *args, **kwargs):
+		# Storages are allowed to modify the query they are given, so keep
+		# a copy in case it needs to be explained later.
+		if query is not None and self.slow_query_threshold is not None and self.explain_slow_queries:
+			query = deepcopy(query)
+
+		result = None
+		error = True
+		start = self.clock()
+		try:
+			result = fn(*args, **kwargs)
+			error = False
+			return result
+		finally:
+			duration = self.clock() - start
+			if isinstance(result, list):
+				documents = len(result)
+			elif isinstance(result, dict):
+				documents = 1
+			else:
+				documents = 0
+			shape = query_shape(query) if query is not None else None
+
+			try:
+				self.sink.record(entity.__name__, operation, duration, documents, shape, error=error)
+			except Exception:
+				self.logger.exception('Failed to record storage metrics.')
+
+			if self.slow_query_threshold is not None and duration >= self.slow_query_threshold:
+				self._log_slow_query(entity, operation, duration, documents, shape, query)
+
+
+	def _log_slow_query(self, entity, operation, duration, documents, shape, query):
+		plan = None
+		if query is not None and self.explain_slow_queries:
+			try:
+				plan = self.storage.explain(entity, **query)
+			except Exception:
+				self.logger.exception('Failed to explain a slow query.')
+		self.logger.warning('Slow query: %s.%s took %.1fms and returned %d documents: %s%s',
+			entity.__name__, operation, duration * 1000, documents, shape,
+			'\nPlan: %r' % (plan,) if plan is not None else '')
+
+
+
+def query_shape(query):
+	"""
+	Describe a query without its values so that queries that differ only
+	by value can be grouped together::
+
+		query_shape({'filter': {'age': {'$gt': 21}, 'name': 'Bob'}, 'sort': ('-age',), 'limit': 10})
+		# '{"filter": {"age": {"$gt": "?"}, "name": "?"}, "limit": "?", "sort": ["-age"]}'
+	"""
+	shape = {}
+	if query.get('filter'):
+		shape['filter'] = _shape(query['filter'])
+	if query.get('sort'):
+		shape['sort'] = list(query['sort'])
+	if query.get('fields') is not None:
+		shape['fields'] = sorted(query['fields'])
+	for k in ('offset', 'limit'):
+		if query.get(k):
+			shape[k] = '?'
+	return json.dumps(shape, sort_keys=True)
+
+
+def _shape(value):
+	if isinstance(value, dict):
+		return dict((k, _shape(v)) for k,v in value.items())
+	if isinstance(value, (list, tuple)) and any(isinstance(v, (dict, list, tuple)) for v in value):
+		return [_shape(v) for v in value]
+	return '?'
@@ -0,0 +1,98 @@
+from ..cache import freeze
+
+__all__ = [
+	'Loader'
+]
+
+
+class Loader(object):
+	"""
+	Batches and memoizes lookups by id for the length of a single API call.
+	Ids that are going to be needed can be queued with `prime` and are then
+	fetched together, with a single `get_by_ids`, the first time any of them
+	is loaded::
+
+		loader = Loader(storage)
+		loader.prime(Author, [post['author'] for post in posts])
+		for post in posts:
+			post['author'] = loader.load(Author, post['author']) # one query in total
+
+	Repeated ids are only fetched once. Every load returns a copy of the item
+	so callers are free to modify what they get back. Call `clear` after a
+	write so later loads see it.
+	"""
+
+	def __init__(self, storage):
+		self.storage = storage
+		self.items = {}
+		self.pending = {}
+
+
+	def prime(self, entity, ids, fields=None):
+		"""Queue ids to be fetched by the next load of the same entity and fields"""
+		key = self._key(entity, fields)
+		items = self.items.get(key, {})
+		pending = self.pending.setdefault(key, [])
+		queued = set(pending)
+		for id in ids:
+			if id is not None and id not in items and id not in queued:
+				queued.add(id)
+				pending.append(id)
+
+
+	def add(self, entity, items, fields=None):
+		"""Remember items that have already been fetched"""
+		memo = self.items.setdefault(self._key(entity, fields), {})
+		for item in items:
+			memo[item['_id']] = dict(item)
+
+
+	def load(self, entity, id, fields=None, read_preference=None):
+		return self.load_many(entity, [id], fields=fields, read_preference=read_preference)[0]
+
+
+	def load_many(self, entity, ids, fields=None, read_preference=None):
+		"""Get items by id, in the order given, with `None` for any that weren't found"""
+		key = self._key(entity, fields)
+		memo = self.items.setdefault(key, {})
+		missing = self.pending.pop(key, [])
+		queued = set(missing)
+		for id in ids:
+			if id not in memo and id not in queued:
+				queued.add(id)
+				missing.append(id)
+		if missing:
+			self._fetch(entity, missing, fields, read_preference, memo)
+		return [dict(memo[id]) if memo.get(id) is not None else None for id in ids]
+
+
+	def clear(self):
+		self.items.clear()
+		self.pending.clear()
+
+
+	def _fetch(self, entity, ids, fields, read_preference, memo):
+		kwargs = {}
+		if fields is not None:
+			kwargs['fields'] = fields
+		if read_preference:
+			kwargs['read_preference'] = read_preference
+
+		if len(ids) == 1:
+			memo[ids[0]] = self.storage.get_by_id(entity, ids[0], **kwargs)
+			return
+
+		for id in ids:
+			memo[id] = None
+		for item in self.storage.get_by_ids(entity, ids, **kwargs):
+			memo[item['_id']] = item
+
+
+	def _key(self, entity, fields):
+		return (entity, freeze(fields))
+
+
+	def __deepcopy__(self, memo):
+		# Loaders are shared by everything that happens during
+		# an API call, so they survive options being copied.
+		return self
@@ -1,46 +1,270 @@
 import re
+import time
+import itertools
+import logging
 import pymongo
 from datetime import datetime
 from bson.objectid import ObjectId
-from . import Storage
+from bson.son import SON
+from bson.errors import InvalidId
+from . import Storage, PRIMARY, PRIMARY_PREFERRED, SECONDARY, SECONDARY_PREFERRED, NEAREST
+from .geo import WITHIN_BOX, WITHIN_RADIUS, EARTH_RADIUS_KM, parse_box, parse_radius
+from .search import AFTER, parse_after
+from ..model.fields import LatLng
 from .. import errors
 
 find_dupe_index_pattern = re.compile(r'\$([a-zA-Z0-9_]+)\s+')
 
 class MongoDBStorage(Storage):
+	"""
+	Stores items in MongoDB, an entity and its subtypes to a collection.
+	
+	`LatLng` points are kept as `[lng, lat]` pairs, the order MongoDB's geo 
+	queries and 2dsphere indexes take them in, and turned back into 
+	`[lat, lng]` as they're read and in filters that match them. Points were 
+	stored `[lat, lng]` before, so `setup` won't go on while a collection 
+	may still have points in that order, unless `migrate_points` is set to 
+	have it swap them. Only one process should do that.
+	"""
 	
 	special_fields = { '$where', '$text' }
 	
+	# Set if items only ever get generated ids, so that any id
+	# that isn't an ObjectId can be rejected without a query.
+	object_ids_only = False
+	
+	# Set to build missing indexes in the background, so setup doesn't
+	# wait for them and the collections stay usable while they're built.
+	background_indexes = False
+	
+	# Set to have setup swap points stored as [lat, lng] to [lng, lat]. Each
+	# collection is only swapped once, recorded in the meta collection.
+	migrate_points = False
+	meta_collection = 'cellardoor_meta'
+	
+	read_preferences = {
+		PRIMARY: pymongo.ReadPreference.PRIMARY,
+		PRIMARY_PREFERRED: pymongo.ReadPreference.PRIMARY_PREFERRED,
+		SECONDARY: pymongo.ReadPreference.SECONDARY,
+		SECONDARY_PREFERRED: pymongo.ReadPreference.SECONDARY_PREFERRED,
+		NEAREST: pymongo.ReadPreference.NEAREST
+	}
+	
 	def __init__(self, db=None, *args, **kwargs):
 		self.client = pymongo.MongoClient(*args, **kwargs)
 		self.db = self.client[db]
 		self.unique_fields_by_index = {}
+		self.point_fields = {}
+		self.setup_report = None
+		self.logger = logging.getLogger(__name__)
 		
 		
 	def setup(self, model):
+		"""
+		Create the indexes the model needs that don't exist yet. The existing 
+		indexes are read once per collection, so a process that starts against 
+		an up to date database only sends one command per collection.
+		"""
+		started = time.time()
+		report = {'collections':0, 'existing':0, 'created':[], 'conflicts':[], 'migrated':[]}
+		self._setup_points(model, report)
+		for collection, indexes in self.get_indexes(model).values():
+			report['collections'] += 1
+			existing = collection.index_information()
+			for keys, options in indexes:
+				name = self._find_index(existing, keys, options)
+				if name is None:
+					name = collection.create_index(keys, background=self.background_indexes, **options)
+					report['created'].append('%s.%s' % (collection.name, name))
+				elif name is False:
+					report['conflicts'].append('%s.%s' % (collection.name, keys[0][0]))
+					continue
+				else:
+					report['existing'] += 1
+				if options.get('unique'):
+					self.unique_fields_by_index[name] = keys[0][0]
+		report['seconds'] = time.time() - started
+		self.setup_report = report
+		self.logger.info('Checked the indexes of %d collections in %.3fs: %d existed, created %s.', 
+			report['collections'], report['seconds'], report['existing'], ', '.join(report['created']) or 'none')
+		
+		
+	def get_indexes(self, model):
+		"""Get the `(keys, options)` of each index the model needs, by collection"""
+		indexes = {}
+		text_weights = {}
 		for e in model.entities.values():
-			collection = self.get_collection(e)
+			root = e.hierarchy[0] if e.hierarchy else e
+			collection, collection_indexes = indexes.setdefault(root.__name__, (self.get_collection(e), []))
 			for k,v in e.fields.items():
 				if v.unique:
-					index_name = collection.ensure_index(k, unique=True, sparse=True)
-					self.unique_fields_by_index[index_name] = k
+					collection_indexes.append(([(k, pymongo.ASCENDING)], {'unique':True, 'sparse':True}))
+				if isinstance(v, LatLng):
+					# Indexes points for circles on a sphere
+					collection_indexes.append(([(k, pymongo.GEOSPHERE)], {}))
+			if e.searchable:
+				# A collection can only have one text index, so it covers
+				# the searchable fields of every entity stored in it.
+				text_weights.setdefault(root.__name__, {}).update(e.searchable)
+		for name, weights in text_weights.items():
+			indexes[name][1].append(([(k, pymongo.TEXT) for k in sorted(weights)], {'weights':weights, 'name':'text'}))
 		
-	
-	def get(self, entity, filter=None, fields=None, sort=None, offset=0, limit=0, count=False):
-		to_dict = self.document_to_dict
-		if filter and '_id' in filter and isinstance(filter['_id'], basestring):
-			filter['_id'] = self._objectid(filter['_id'])
+		for name, (collection, collection_indexes) in indexes.items():
+			# Subtypes share the unique fields of their base entities
+			unique_indexes = []
+			for index in collection_indexes:
+				if index not in unique_indexes:
+					unique_indexes.append(index)
+			indexes[name] = (collection, unique_indexes)
+		return indexes
+		
+		
+	def _setup_points(self, model, report):
+		# Makes sure the points in each collection are stored [lng, lat]
+		meta = getattr(self.db, self.meta_collection)
+		roots = set(e.hierarchy[0] if e.hierarchy else e for e in model.entities.values())
+		for root in roots:
+			points = self.get_point_fields(root)
+			if not points:
+				continue
+			key = 'points.%s' % root.__name__
+			if meta.find_one({'_id':key}):
+				continue
+			collection = self.get_collection(root)
+			query = {'$or':[{k:{'$exists':True}} for k in points]}
+			if collection.find_one(query, {'_id':True}) is None:
+				meta.save({'_id':key, 'order':'lng,lat'})
+				continue
+			if not self.migrate_points:
+				raise Exception, "%s may have points stored as [lat, lng]. Set migrate_points to swap them." % collection.name
+			try:
+				# Claimed first, so that only one process swaps them
+				meta.insert({'_id':key, 'order':'lat,lng'})
+			except pymongo.errors.DuplicateKeyError:
+				continue
+			for doc in collection.find(query, dict((k, True) for k in points)):
+				swapped = self._points_to_storage(root, doc)
+				del swapped['_id']
+				collection.update({'_id':doc['_id']}, {'$set':swapped})
+			meta.update({'_id':key}, {'$set':{'order':'lng,lat'}})
+			report['migrated'].append(collection.name)
+			self.logger.info('Swapped the points in %s to [lng, lat].', collection.name)
+			
+			
+	def _find_index(self, existing, keys, options):
+		# Returns the name of a matching index, `None` if there isn't one, or 
+		# `False` if there's one with the same keys but different options, 
+		# which can't be created without dropping it first.
+		if keys[0][1] == pymongo.TEXT:
+			key = [('_fts', 'text'), ('_ftsx', 1)]
+		else:
+			key = keys
+		for name, info in existing.items():
+			if [tuple(k) for k in info['key']] != key:
+				continue
+			if all(info.get(k, False) == v for k,v in options.items() if k != 'name'):
+				return name
+			self.logger.warning('The %s index has different options to %s. Drop it so it can be created again.', name, options)
+			return False
+		return None
+		
+		
+	def get(self, entity, filter=None, fields=None, sort=None, offset=0, limit=0, count=False, read_preference=None):
+		if filter and isinstance(filter.get('$text'), dict) and AFTER in filter['$text']:
+			return self._search_after(entity, filter, fields=fields, sort=sort, offset=offset, limit=limit, count=count, 
+									  read_preference=read_preference)
+		
+		results = self._find(entity, filter=filter, fields=fields, sort=sort, offset=offset, limit=limit, 
+							 read_preference=read_preference)
+		
+		if count:
+			return results.count()
+		else:
+			return [self.document_to_dict(doc, entity) for doc in results]
+			
+			
+	def iterate(self, entity, filter=None, fields=None, sort=None, offset=0, limit=0, read_preference=None):
+		if filter and isinstance(filter.get('$text'), dict) and AFTER in filter['$text']:
+			return iter(self._search_after(entity, filter, fields=fields, sort=sort, offset=offset, limit=limit, 
+										   read_preference=read_preference))
+		results = self._find(entity, filter=filter, fields=fields, sort=sort, offset=offset, limit=limit, 
+							 read_preference=read_preference)
+		return itertools.imap(lambda doc: self.document_to_dict(doc, entity), results)
 		
+		
+	def explain(self, entity, filter=None, fields=None, sort=None, offset=0, limit=0):
+		return self._find(entity, filter=filter, fields=fields, sort=sort, offset=offset, limit=limit).explain()
+		
+		
+	def _find(self, entity, filter=None, fields=None, sort=None, offset=0, limit=0, read_preference=None):
 		sort_pairs = []
 		if filter and '$text' in filter:
 			sort_pairs.append(('score', {'$meta':'textScore'}))
-			if not fields:
-				fields = {}
+			# An empty projection gets every field, as if there was none
+			fields = self._projection(fields or None)
 			fields['score'] = {'$meta':'textScore'}
+			if not sort:
+				# Break ties the same way _search_after does
+				sort_pairs.append(('_id', 1))
 		if sort:
 			sort_pairs.extend([(field[1:], 1) if field[0] == '+' else (field[1:], -1) for field in sort])
 		
-		collection = self.get_collection(entity)
+		collection = self.get_collection(entity, read_preference=read_preference)
+		filter = self._prepare_filter(entity, filter)
+		
+		return collection.find(spec=filter, 
+							   fields=fields, 
+							   sort=sort_pairs, 
+							   skip=offset, 
+							   limit=limit)
+			
+			
+	def _search_after(self, entity, filter, fields=None, sort=None, offset=0, limit=0, count=False, read_preference=None):
+		# The text score can't be filtered on in a find, so results after
+		# a cursor are found with an aggregation that projects it first.
+		if sort:
+			raise errors.CompoundValidationError({'sort': 'Results after a %s cursor are in score order and cannot be sorted.' % AFTER})
+		filter['$text'] = dict(filter['$text'])
+		score, id = parse_after(filter['$text'].pop(AFTER))
+		filter = self._prepare_filter(entity, filter)
+		
+		if not fields:
+			projection = {'doc':'$$ROOT'}
+		else:
+			projection = self._projection(fields)
+		projection['score'] = {'$meta':'textScore'}
+		
+		pipeline = [
+			{'$match':filter},
+			{'$project':projection},
+			{'$match':{'$or':[{'score':{'$lt':score}}, {'score':score, '_id':{'$gt':self._objectid(id)}}]}}
+		]
+		if count:
+			pipeline.append({'$group':{'_id':None, 'count':{'$sum':1}}})
+		else:
+			pipeline.append({'$sort':SON([('score', -1), ('_id', 1)])})
+			if offset:
+				pipeline.append({'$skip':offset})
+			if limit:
+				pipeline.append({'$limit':limit})
+		
+		collection = self.get_collection(entity, read_preference=read_preference)
+		results = collection.aggregate(pipeline, cursor={})
+		
+		if count:
+			return next(iter(results), {'count':0})['count']
+		if not fields:
+			results = (dict(r['doc'], score=r['score']) for r in results)
+		return [self.document_to_dict(doc, entity) for doc in results]
+		
+		
+	def _prepare_filter(self, entity, filter):
+		if filter and '_id' in filter and isinstance(filter['_id'], basestring):
+			filter['_id'] = self._objectid(filter['_id'])
+		
+		if filter:
+			self._points_filter(entity, filter)
+			self._geo_filter(filter)
 		
 		type_filter = self.get_type_filter(entity)
 		if type_filter:
@@ -48,29 +272,36 @@ class MongoDBStorage(Storage):
 				filter = type_filter
 			else:
 				filter.update(type_filter)
+		return filter
 		
-		results = collection.find(spec=filter, 
-								  fields=fields, 
-								  sort=sort_pairs, 
-								  skip=offset, 
-								  limit=limit)
 		
-		if count:
-			return results.count()
+	def _projection(self, fields):
+		if fields is None:
+			return {}
+		if isinstance(fields, dict):
+			projection = dict(fields)
 		else:
-			return map(to_dict, results)
-			
-			
-	def get_by_ids(self, entity, ids, filter=None, fields=None, sort=None, offset=0, limit=0, count=False):
+			projection = dict((k, 1) for k in fields)
+		return projection
+		
+		
+	def get_by_ids(self, entity, ids, filter=None, fields=None, sort=None, offset=0, limit=0, count=False, read_preference=None):
+		ids = [id for id in ids if self.is_valid_id(entity, id)]
+		if not ids:
+			return 0 if count else []
 		if not filter:
 			filter = {}
 		filter['_id'] = {'$in':map(self._objectid, ids)}
-		return self.get(entity, filter=filter, fields=fields, sort=sort, offset=offset, limit=limit, count=count)
+		return self.get(entity, filter=filter, fields=fields, sort=sort, offset=offset, limit=limit, count=count, 
+			read_preference=read_preference)
 		
 		
-	def get_by_id(self, entity, id, filter=None, fields=None):
-		collection = self.get_collection(entity)
+	def get_by_id(self, entity, id, filter=None, fields=None, read_preference=None):
+		if not self.is_valid_id(entity, id):
+			return None
+		collection = self.get_collection(entity, read_preference=read_preference)
 		filter = filter if filter else {}
+		self._points_filter(entity, filter)
 		filter['_id'] = self._objectid(id)
 		type_filter = self.get_type_filter(entity)
 		if type_filter:
@@ -80,7 +311,7 @@ class MongoDBStorage(Storage):
 		if result is None:
 			return None
 		else:
-			return self.document_to_dict(result)
+			return self.document_to_dict(result, entity)
 		
 		
 	def create(self, entity, fields):
@@ -88,45 +319,156 @@ class MongoDBStorage(Storage):
 		type_name = self.get_type_name(entity)
 		if type_name:
 			fields['_type'] = type_name
+		if entity.versioned:
+			fields['_version'] = 1
 		if '_id' in fields:
 			fields['_id'] = self._objectid(fields['_id'])
 		try:
-			obj_id = collection.insert(fields.copy())
+			obj_id = collection.insert(self._points_to_storage(entity, fields))
 		except pymongo.errors.DuplicateKeyError, e:
 			self._raise_dupe_error(e)
 			
 		return self._from_objectid(obj_id)
 		
 		
-	def update(self, entity, id, fields, replace=False):
+	def update(self, entity, id, fields, replace=False, operations=None, filter=None, version=None):
 		type_name = self.get_type_name(entity)
 		if type_name:
 			fields['_type'] = type_name
+		fields = self._points_to_storage(entity, fields)
 		try:
 			collection = self.get_collection(entity)
-			obj_id = self._objectid(id)
+			query = dict(filter) if filter else {}
+			self._points_filter(entity, query)
+			query['_id'] = self._objectid(id)
+			if replace and entity.versioned:
+				return self._replace_versioned(entity, collection, query, fields, version)
+			if version is not None:
+				query['_version'] = version
 			if replace:
 				doc = fields
+			elif operations:
+				doc = self._update_operations(operations)
+				if fields:
+					doc['$set'] = fields
 			else:
 				doc = { '$set': fields }
-			doc = collection.find_and_modify({ '_id': obj_id }, doc, new=True)
+			if entity.versioned:
+				doc.setdefault('$inc', {})['_version'] = 1
+			doc = collection.find_and_modify(query, doc, new=True)
 			if doc:
-				return self.document_to_dict(doc)
+				return self.document_to_dict(doc, entity)
+			if version is not None:
+				self._check_version(entity, collection, query['_id'], version)
 		except pymongo.errors.DuplicateKeyError, e:
 			self._raise_dupe_error(e)
 			
 			
+	def _replace_versioned(self, entity, collection, query, fields, version):
+		# A replacement can't increment the version, so it's swapped in only
+		# if the version it's replacing is current. Without an expected
+		# version that's retried until it goes in, as each miss means
+		# another write went in first.
+		while True:
+			expected = version
+			if expected is None:
+				current = collection.find_one(query, {'_version':True})
+				if not current:
+					return None
+				expected = current.get('_version')
+			doc = dict(fields, _version=(expected or 0) + 1)
+			result = collection.find_and_modify(dict(query, _version=expected), doc, new=True)
+			if result:
+				return self.document_to_dict(result, entity)
+			if version is not None:
+				self._check_version(entity, collection, query['_id'], version)
+				return None
+		
+		
+	def _check_version(self, entity, collection, id, version):
+		current = collection.find_one({'_id':id})
+		if current and current.get('_version') != version:
+			raise errors.VersionConflictError(self.document_to_dict(current, entity))
+			
+			
+	def _update_operations(self, operations):
+		doc = {}
+		for operator, values in operations.items():
+			if operator == '$unset':
+				values = dict((k, '') for k in values)
+			doc[operator] = dict(values)
+		return doc
+		
+		
 	def delete(self, entity, id):
 		collection = self.get_collection(entity)
 		collection.remove(self._objectid(id))
 		
 		
-	def document_to_dict(self, doc):
+	def document_to_dict(self, doc, entity=None):
 		doc['_id'] = self._from_objectid(doc['_id'])
+		if entity is not None:
+			for k in self.get_point_fields(entity):
+				point = doc.get(k)
+				if isinstance(point, list) and len(point) == 2:
+					doc[k] = [point[1], point[0]]
 		return doc
 		
 		
-	def get_collection(self, entity):
+	def get_point_fields(self, entity):
+		"""Get the names of the `LatLng` fields stored in an entity's collection"""
+		root = entity.hierarchy[0] if entity.hierarchy else entity
+		points = self.point_fields.get(root)
+		if points is None:
+			points = set()
+			for e in [root] + root.children:
+				points.update(k for k,v in e.fields.items() if isinstance(v, LatLng))
+			points = self.point_fields[root] = tuple(points)
+		return points
+		
+		
+	def _points_to_storage(self, entity, fields):
+		# Gets a copy of fields with points swapped to [lng, lat]
+		fields = fields.copy()
+		for k in self.get_point_fields(entity):
+			point = fields.get(k)
+			if isinstance(point, (list, tuple)) and len(point) == 2:
+				fields[k] = [point[1], point[0]]
+		return fields
+		
+		
+	def _points_filter(self, entity, filter):
+		# Swaps the points a filter matches point fields against to [lng, lat]
+		points = self.get_point_fields(entity)
+		if not points:
+			return
+		for k, v in filter.items():
+			if k in ('$and', '$or', '$nor') and isinstance(v, (list, tuple)):
+				for x in v:
+					if isinstance(x, dict):
+						self._points_filter(entity, x)
+			elif k in points:
+				filter[k] = self._swap_point_values(v)
+				
+				
+	def _swap_point_values(self, value):
+		if isinstance(value, (list, tuple)):
+			return [value[1], value[0]] if len(value) == 2 else value
+		if not isinstance(value, dict):
+			return value
+		value = dict(value)
+		for operator in ('$eq', '$ne'):
+			if operator in value:
+				value[operator] = self._swap_point_values(value[operator])
+		for operator in ('$in', '$nin'):
+			if isinstance(value.get(operator), (list, tuple)):
+				value[operator] = [self._swap_point_values(x) for x in value[operator]]
+		if '$not' in value:
+			value['$not'] = self._swap_point_values(value['$not'])
+		return value
+		
+		
+	def get_collection(self, entity, read_preference=None):
 		if len(entity.hierarchy) > 0:
 			collection_name = entity.hierarchy[0].__name__
 		else:
@@ -135,7 +477,10 @@ class MongoDBStorage(Storage):
 		# We use getattr here instead of __getitem__ to
 		# make it easier to inject mock collections objects
 		# for testing
-		return getattr(self.db, collection_name)
+		collection = getattr(self.db, collection_name)
+		if read_preference:
+			collection = collection.with_options(read_preference=self.read_preferences[read_preference])
+		return collection
 			
 			
 	def get_type_name(self, entity):
@@ -183,6 +528,25 @@ class MongoDBStorage(Storage):
 			elif isinstance(v, dict):
 				self._check_filter(v, allowed_fields, context)
 				
+	def _geo_filter(self, filter):
+		if isinstance(filter, (list, tuple)):
+			for x in filter:
+				self._geo_filter(x)
+		if not isinstance(filter, dict):
+			return
+		if WITHIN_BOX in filter and WITHIN_RADIUS in filter:
+			raise errors.CompoundValidationError({'filter': 'A field can be filtered by %s or %s, not both.' % (WITHIN_BOX, WITHIN_RADIUS)})
+		if WITHIN_BOX in filter:
+			south, west, north, east = parse_box(filter.pop(WITHIN_BOX))
+			filter['$geoWithin'] = {'$box':[[west, south], [east, north]]}
+		if WITHIN_RADIUS in filter:
+			# A circle on a sphere, with its radius in radians
+			(lat, lng), radius = parse_radius(filter.pop(WITHIN_RADIUS))
+			filter['$geoWithin'] = {'$centerSphere':[[lng, lat], radius / EARTH_RADIUS_KM]}
+		for v in filter.values():
+			self._geo_filter(v)
+			
+			
 	def _get_identity_value(self, key, context):
 		if isinstance(key, basestring):
 			if key.startswith('$identity'):
@@ -203,10 +567,22 @@ class MongoDBStorage(Storage):
 		raise errors.DuplicateError(key_name)
 			
 		
+	def is_valid_id(self, entity, id):
+		if isinstance(id, ObjectId):
+			return True
+		if self.object_ids_only:
+			return isinstance(id, basestring) and ObjectId.is_valid(id)
+		return id is not None and id != '' and not isinstance(id, (dict, list))
+		
+		
+	def stored_id(self, entity, id):
+		return self._objectid(id)
+		
+		
 	def _objectid(self, id):
 		try:
 			return ObjectId(id)
-		except:
+		except (InvalidId, TypeError):
 			return str(id)
 			
 	def _from_objectid(self, id):
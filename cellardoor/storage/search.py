@@ -0,0 +1,118 @@
+import re
+from .. import errors
+
+__all__ = [
+	'AFTER',
+	'parse_after',
+	'InvertedIndex'
+]
+
+# A `$text` filter can carry a cursor to page through results in score order,
+# made of the `score` and `_id` of the last item of the page before:
+#
+#     {'$text': {'$search': 'coffee', '$after': [1.25, '54d1c1d1a4e4a5c3f1b8e2a7']}}
+#
+AFTER = '$after'
+
+word_pattern = re.compile(r'\w+', re.UNICODE)
+
+
+def parse_after(value):
+	"""Get the `(score, id)` from the cursor of a `$text` filter"""
+	if not isinstance(value, (list, tuple)) or len(value) != 2:
+		raise errors.CompoundValidationError({'filter': '%s: Expected the score and id of the last result' % AFTER})
+	try:
+		score = float(value[0])
+	except (ValueError, TypeError):
+		raise errors.CompoundValidationError({'filter': '%s: The score must be a number' % AFTER})
+	return score, value[1]
+
+
+def tokenize(text):
+	return [word.lower() for word in word_pattern.findall(text)]
+
+
+
+class InvertedIndex(object):
+	"""
+	An in-memory full-text index of items, for storages that don't have one.
+	Results are paged by `(score, key)` cursors, like `$after` cursors::
+
+		index = InvertedIndex({'title': 10, 'body': 1})
+		index.add(post['_id'], post)
+		index.search('coffee -decaf', limit=20)
+		index.search('coffee -decaf', after=(1.25, last_id), limit=20)
+
+	A query matches items that have any of its words and none of the words
+	prefixed with `-`. An item scores the weight of each field for every
+	match in it, divided by `0.5 + 0.5 * n` for a field of `n` words. Words
+	are only lowercased, not stemmed, and there are no stop words. That
+	isn't how MongoDB scores text, so scores and cursors from one can't be
+	used with the other.
+	"""
+
+	def __init__(self, weights):
+		self.weights = dict(weights)
+		self.postings = {}
+		self.terms = {}
+
+
+	def __len__(self):
+		return len(self.terms)
+
+
+	def add(self, key, item):
+		if key in self.terms:
+			self.remove(key)
+		terms = {}
+		for field, weight in self.weights.items():
+			value = item.get(field)
+			if isinstance(value, (list, tuple)):
+				value = ' '.join(v for v in value if isinstance(v, basestring))
+			if not isinstance(value, basestring):
+				continue
+			words = tokenize(value)
+			for word in words:
+				terms[word] = terms.get(word, 0) + weight / (0.5 + 0.5 * len(words))
+		self.terms[key] = terms
+		for word in terms:
+			self.postings.setdefault(word, set()).add(key)
+
+
+	def remove(self, key):
+		terms = self.terms.pop(key, None)
+		if terms is None:
+			return
+		for word in terms:
+			keys = self.postings[word]
+			keys.discard(key)
+			if not keys:
+				del self.postings[word]
+
+
+	def search(self, query, after=None, offset=0, limit=0):
+		"""
+		Get the `(score, key)` of each item that matches a query, highest scores
+		first and then in key order. If `after` is the `(score, key)` of a result,
+		only the results that come after it are returned.
+		"""
+		words, excluded = set(), set()
+		for part in query.split():
+			(excluded if part.startswith('-') else words).update(tokenize(part))
+		keys = set()
+		for word in words.difference(excluded):
+			keys.update(self.postings.get(word, ()))
+		for word in excluded:
+			keys.difference_update(self.postings.get(word, ()))
+
+		results = []
+		for key in keys:
+			terms = self.terms[key]
+			score = sum(terms.get(word, 0) for word in words)
+			if after is None or score < after[0] or (score == after[0] and key > after[1]):
+				results.append((-score, key))
+		results.sort()
+		results = [(-score, key) for score, key in results]
+		if limit:
+			return results[offset:offset + limit]
+		return results[offset:]
@@ -1,11 +1,25 @@
+from ..cache import LRUCache
+
+
 class View(object):
 	
 	serializers = None
 	
+	# Views that can send a list as it's being read set this and implement `get_list_stream`
+	streaming = False
+	
+	# Views that serialize the items of lists one at a time, and so need them prepared, set this
+	prepared_items = False
+	
 	def get_list_response(self, accept_header, objs):
 		raise NotImplementedError
 		
 		
+	def get_list_stream(self, accept_header, objs):
+		"""Get the content type and an iterator of the pieces of a list response"""
+		raise NotImplementedError
+		
+		
 	def get_individual_response(self, accept_header, obj):
 		raise NotImplementedError
 		
@@ -21,13 +35,120 @@ class View(object):
 		
 	@classmethod
 	def choose(cls, accept_header, views):
-		if accept_header:
-			accept = accept_header.split(';')[0].split(',')
-			for a in accept:
-				for k,v in views:
-					if a == k:
-						return k, v
-		return views[0]
+		"""Get the `(mimetype, view)` of `views` that best matches an Accept header"""
+		return get_negotiator(views).choose(accept_header)
+		
+		
+def parse_media_type(media_type):
+	"""
+	Split a media type into its type and its parameters, leaving out the
+	quality and anything after it, so that `application/x-msgpack; ext=1` 
+	and `application/x-msgpack` are told apart.
+	"""
+	parts = media_type.split(';')
+	params = []
+	for param in parts[1:]:
+		name, _, value = param.partition('=')
+		name = name.strip().lower()
+		if name == 'q':
+			break
+		params.append((name, value.strip().strip('"')))
+	return parts[0].strip().lower(), tuple(sorted(params))
+	
+	
+def parse_quality(media_range):
+	"""Get the quality of a media range, which is 1 unless it says otherwise"""
+	for param in media_range.split(';')[1:]:
+		name, _, value = param.partition('=')
+		if name.strip().lower() == 'q':
+			try:
+				return min(max(float(value), 0.0), 1.0)
+			except ValueError:
+				return 0.0
+	return 1.0
+	
+	
+	
+class Negotiator(object):
+	"""
+	Chooses between `(mimetype, value)` pairs for Accept headers, the way
+	RFC 7231 describes::
+	
+		negotiator = Negotiator((('application/json', json_view), ('application/x-msgpack', msgpack_view)))
+		negotiator.choose('application/x-msgpack, application/json;q=0.5') # ('application/x-msgpack', msgpack_view)
+		
+	Each pair gets the quality of the most specific media range that matches 
+	it, where `type/*` and `*/*` match any of their types but other ranges 
+	only match a mimetype with the same parameters. The pair with the highest 
+	quality wins, then the one matched most specifically, then the one whose 
+	range came first in the header, then the one that came first in `offers`. 
+	If nothing is acceptable, the first pair is chosen.
+	
+	Choices are kept in an LRU cache of up to `max_size` headers, since
+	clients send the same few over and over.
+	"""
+	
+	def __init__(self, offers, max_size=1000):
+		self.offers = tuple(offers)
+		self.parsed = []
+		for mimetype, _ in self.offers:
+			media_type, params = parse_media_type(mimetype)
+			self.parsed.append((media_type, media_type.split('/')[0], params))
+		self.cache = LRUCache(max_size=max_size)
+		
+		
+	def choose(self, accept_header):
+		if not accept_header:
+			return self.offers[0]
+		offer = self.cache.get(accept_header)
+		if offer is None:
+			offer = self.negotiate(accept_header)
+			self.cache.set(accept_header, offer)
+		return offer
 		
 		
-from minimal import MinimalView
\ No newline at end of file
+	def negotiate(self, accept_header):
+		ranges = []
+		for position, media_range in enumerate(accept_header.split(',')):
+			media_type, params = parse_media_type(media_range)
+			if media_type:
+				ranges.append((media_type, params, parse_quality(media_range), position))
+		
+		best, best_rank = self.offers[0], None
+		for index, (media_type, type_, params) in enumerate(self.parsed):
+			match = None
+			for range_type, range_params, quality, position in ranges:
+				if range_type == media_type and range_params == params:
+					specificity = 2
+				elif range_type == type_ + '/*':
+					specificity = 1
+				elif range_type == '*/*':
+					specificity = 0
+				else:
+					continue
+				if match is None or specificity > match[1]:
+					match = (quality, specificity, -position)
+			if match is None or match[0] <= 0:
+				continue
+			rank = match + (-index,)
+			if best_rank is None or rank > best_rank:
+				best, best_rank = self.offers[index], rank
+		return best
+		
+		
+		
+negotiators = LRUCache(max_size=100)
+
+def get_negotiator(offers):
+	"""Get the negotiator for some `(mimetype, value)` pairs, compiling it the first time they're seen"""
+	key = tuple(offers)
+	negotiator = negotiators.get(key)
+	if negotiator is None:
+		negotiator = Negotiator(key)
+		negotiators.set(key, negotiator)
+	return negotiator
+	
+	
+from minimal import MinimalView
+from ndjson import NDJSONView
+from columnar import ColumnarView
\ No newline at end of file
@@ -0,0 +1,65 @@
+from . import View
+from ..serializers import JSONSerializer, MsgPackSerializer
+from ..serializers.arrow_serializer import ArrowSerializer
+
+
+def to_columns(objs):
+	"""
+	Turn a list of items into a table of their field names and a column of 
+	values for each field. Fields are in the order they're first seen, and 
+	an item without one of them has `None` in its column.
+	"""
+	fields = []
+	seen = set()
+	for obj in objs:
+		for k in obj:
+			if k not in seen:
+				seen.add(k)
+				fields.append(k)
+	return {
+		'fields': fields,
+		'columns': [[obj.get(k) for obj in objs] for k in fields]
+	}
+	
+	
+def get_serializers():
+	serializers = [
+		('application/vnd.cellardoor.columns+json', JSONSerializer()),
+		('application/vnd.cellardoor.columns+msgpack', MsgPackSerializer())
+	]
+	try:
+		serializers.append((ArrowSerializer.mimetype, ArrowSerializer()))
+	except ImportError:
+		pass
+	return tuple(serializers)
+	
+	
+	
+class ColumnarView(View):
+	"""
+	Sends lists as a header of field names and a column of values for each 
+	field, so key names aren't repeated for every item::
+	
+		{"fields": ["_id", "name"], "columns": [["1", "2"], ["foo", "bar"]]}
+		
+	It's opt in, through its own media types for JSON and msgpack, and an 
+	Arrow IPC stream when pyarrow is installed::
+	
+		FalconApp(api, views=(MinimalView, ColumnarView))
+		
+	The fields are the ones left on the items once hidden fields and fields 
+	that weren't asked for have been removed. Single items are sent as they 
+	are, except to Arrow, which gets a table of one row.
+	"""
+	
+	serializers = get_serializers()
+	
+	def get_list_response(self, accept_header, objs):
+		return self.serialize(accept_header, to_columns(objs))
+		
+		
+	def get_individual_response(self, accept_header, obj):
+		content_type, serializer = self.get_serializer(accept_header)
+		if serializer.tabular:
+			obj = to_columns([obj])
+		return content_type, serializer.serialize(obj)
@@ -0,0 +1,84 @@
+import logging
+from ..cache import LRUCache, CacheError
+from ..api.interface import PreparedItem
+
+__all__ = [
+	'FragmentCache',
+	'fragment_key'
+]
+
+
+def fragment_key(item):
+	"""
+	Get a key for the exact contents of a prepared item, or `None` if there 
+	isn't one. Only items with a `_version` have keys, since nothing else 
+	says when they've changed, and personal items don't, as hooks and rules 
+	may have changed them for the identity they were read for. Embedded 
+	items are part of the key, so an item's key changes whenever one of them 
+	does, or one is added or removed.
+	"""
+	if not isinstance(item, PreparedItem) or '_version' not in item or item.personal:
+		return None
+	embedded = []
+	for k, v in item.iteritems():
+		if isinstance(v, PreparedItem):
+			key = fragment_key(v)
+			if key is None:
+				return None
+			embedded.append((k, key))
+		elif isinstance(v, list) and v and isinstance(v[0], PreparedItem):
+			keys = tuple(fragment_key(i) for i in v)
+			if None in keys:
+				return None
+			embedded.append((k, keys))
+	return (item.entity_name, item.get('_id'), item['_version'], tuple(sorted(item)), tuple(sorted(embedded)))
+	
+	
+	
+class FragmentCache(object):
+	"""
+	Caches the serialized form of each item, so an item that's in many 
+	responses, like an author embedded in a page of posts, is only serialized 
+	once until it changes. A list is put together from the cached items, and 
+	only the ones that weren't cached are serialized::
+	
+		fragment_cache = FragmentCache(max_size=100000)
+		FalconApp(api, views=(MinimalView(fragment_cache=fragment_cache),))
+		
+	Items are keyed by `fragment_key` and the content type they're serialized 
+	as. Only items of versioned entities are cached, along with the items 
+	that embed them if those are versioned too, and only when they weren't 
+	read for an identity.
+	"""
+	
+	def __init__(self, cache=None, max_size=10000, ttl=None):
+		self.cache = cache if cache is not None else LRUCache(max_size=max_size, ttl=ttl)
+		self.logger = logging.getLogger(__name__)
+		
+		
+	def serialize(self, content_type, serializer, item):
+		"""Serialize an item, or get it from the cache"""
+		key = fragment_key(item)
+		if key is None:
+			return serializer.serialize(item)
+		key = ('fragment', content_type, key)
+		try:
+			body = self.cache.get(key)
+		except CacheError:
+			self.logger.exception('Could not read from the cache.')
+			return serializer.serialize(item)
+		if body is None:
+			body = serializer.serialize(item)
+			try:
+				self.cache.set(key, body)
+			except CacheError:
+				self.logger.exception('Could not write to the cache.')
+		return body
+		
+		
+	def serialize_list(self, content_type, serializer, items):
+		"""Serialize a list of items, taking the ones that are cached from the cache"""
+		body = serializer.join_serialized([self.serialize(content_type, serializer, item) for item in items])
+		if body is None:
+			return serializer.serialize(items)
+		return body
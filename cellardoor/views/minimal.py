@@ -3,15 +3,31 @@ from ..serializers import JSONSerializer, MsgPackSerializer
 
 
 class MinimalView(View):
+	"""
+	Sends items and lists of them as they are. Give it a `FragmentCache` 
+	to reuse the serialized forms of items that haven't changed.
+	"""
 	
 	serializers = (
 		('application/json', JSONSerializer()),
-		('application/x-msgpack', MsgPackSerializer())
+		('application/x-msgpack', MsgPackSerializer()),
+		(MsgPackSerializer.EXT_MIMETYPE, MsgPackSerializer(ext_types=True))
 	)
 	
+	def __init__(self, fragment_cache=None):
+		self.fragment_cache = fragment_cache
+		self.prepared_items = fragment_cache is not None
+		
+		
 	def get_list_response(self, accept_header, objs):
-		return self.serialize(accept_header, objs)
+		if self.fragment_cache is None:
+			return self.serialize(accept_header, objs)
+		content_type, serializer = self.get_serializer(accept_header)
+		return content_type, self.fragment_cache.serialize_list(content_type, serializer, objs)
 		
 		
 	def get_individual_response(self, accept_header, obj):
-		return self.serialize(accept_header, obj)
\ No newline at end of file
+		if self.fragment_cache is None:
+			return self.serialize(accept_header, obj)
+		content_type, serializer = self.get_serializer(accept_header)
+		return content_type, self.fragment_cache.serialize(content_type, serializer, obj)
\ No newline at end of file
@@ -0,0 +1,65 @@
+from . import View
+from ..serializers import JSONSerializer
+
+
+class NDJSONView(View):
+	"""
+	Sends lists as newline delimited JSON, one item per line, written as the 
+	items are read from storage. Whole collections can be exported without 
+	holding them in memory, and clients can handle each line as it arrives::
+	
+		FalconApp(api, views=(MinimalView, NDJSONView))
+		
+	Streamed lists aren't cached and don't get an ETag, since that would mean 
+	reading all of them first. A single item is sent as a line of its own.
+	Items can be taken from a `FragmentCache`, like with `MinimalView`.
+	"""
+	
+	mimetype = 'application/x-ndjson'
+	
+	streaming = True
+	
+	prepared_items = True
+	
+	serializers = (
+		(mimetype, JSONSerializer(compact=True)),
+	)
+	
+	# Lines are sent in pieces of about this many bytes, rather than one at a time
+	chunk_size = 16 * 1024
+	
+	def __init__(self, fragment_cache=None):
+		self.fragment_cache = fragment_cache
+		
+		
+	def get_list_response(self, accept_header, objs):
+		content_type, lines = self.get_list_stream(accept_header, objs)
+		return content_type, ''.join(lines)
+		
+		
+	def get_list_stream(self, accept_header, objs):
+		content_type, serializer = self.get_serializer(accept_header)
+		return content_type, self.write_lines(content_type, serializer, objs)
+		
+		
+	def get_individual_response(self, accept_header, obj):
+		content_type, body = self.serialize(accept_header, obj)
+		return content_type, body + '\n'
+		
+		
+	def write_lines(self, content_type, serializer, objs):
+		lines = []
+		size = 0
+		for obj in objs:
+			if self.fragment_cache is None:
+				line = serializer.serialize(obj) + '\n'
+			else:
+				line = self.fragment_cache.serialize(content_type, serializer, obj) + '\n'
+			lines.append(line)
+			size += len(line)
+			if size >= self.chunk_size:
+				yield ''.join(lines)
+				lines = []
+				size = 0
+		if lines:
+			yield ''.join(lines)
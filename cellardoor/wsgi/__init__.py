@@ -1,19 +1,27 @@
+import re
+import json
 from urlparse import parse_qs
+from hashlib import md5
 from cellardoor.serializers import JSONSerializer
 from cellardoor.errors import ParseError
 
 params_serializer = JSONSerializer()
 
-def parse_params(environ, *include):
-	"""Parse out the filter, sort, etc., parameters from a request"""
+def parse_params(environ, *include, **kwargs):
+	"""
+	Parse out the filter, sort, etc., parameters from a request. If the 
+	`entity` being filtered is given, only the values compared to its date 
+	fields are checked for dates.
+	"""
 	if environ.get('QUERY_STRING'):
 		params = parse_qs(environ['QUERY_STRING'])
 	else:
 		params = {}
+	entity = kwargs.get('entity')
 	param_handlers = (
-		('embedded', params_serializer.unserialize_string, None),
-		('filter', params_serializer.unserialize_string, None),
-		('sort', params_serializer.unserialize_string, None),
+		('embedded', json.loads, None),
+		('filter', lambda data: params_serializer.unserialize_filter(data, entity), None),
+		('sort', json.loads, None),
 		('offset', int, 0),
 		('limit', int, 0),
 		('show_hidden', bool_field, False)
@@ -31,6 +39,10 @@ def parse_params(environ, *include):
 		
 	if not include or 'context' in include:
 		results['context'] = get_context(environ)
+	if include and 'version' in include:
+		version = get_version(environ)
+		if version is not None:
+			results['version'] = version
 	return results
 	
 	
@@ -55,4 +67,106 @@ def get_context(environ):
 	if identity:
 		context['identity'] = identity
 	return context
-	
\ No newline at end of file
+	
+	
+def get_if_match(environ):
+	"""Get the tag in the If-Match header without its weak marker or quotes, or `None` if there isn't one"""
+	header = environ.get('HTTP_IF_MATCH', '').strip()
+	if not header or header == '*':
+		return None
+	if ',' in header:
+		raise ParseError("Only one version can be given in If-Match: %s" % header)
+	tag = header[2:] if header.startswith('W/') else header
+	return tag.strip('"')
+	
+	
+def get_version(environ):
+	"""
+	Get the version an update expects from the If-Match header. The tag can 
+	either be the version itself or an ETag made by `version_etag`. An ETag 
+	made by `body_etag` has no version, so `None` is returned for it, as 
+	when there's no header; get it with `get_body_tag` instead.
+	"""
+	tag = get_if_match(environ)
+	if tag is None or body_tag_pattern.match(tag):
+		return None
+	try:
+		return int(tag.rsplit('-', 1)[-1].split('+', 1)[0])
+	except ValueError:
+		raise ParseError("Could not parse If-Match header: %s" % environ['HTTP_IF_MATCH'])
+		
+		
+def get_body_tag(environ):
+	"""Get the ETag in the If-Match header if it was made by `body_etag`"""
+	tag = get_if_match(environ)
+	if tag is not None and body_tag_pattern.match(tag):
+		return 'W/"%s"' % tag
+	return None
+	
+	
+def version_etag(data):
+	"""
+	Make a weak ETag for an item or list of items from the ids and versions 
+	of everything in it, without having to serialize it. An item gets the tag 
+	`"<id>-<version>"`, followed by `+<digest>` if it has embedded items. 
+	Returns `None` if any item in the response isn't versioned.
+	"""
+	versions = []
+	if not collect_versions(data, versions):
+		return None
+	if isinstance(data, dict):
+		if '_id' not in data:
+			return None
+		tag = '%s-%s' % (data['_id'], data['_version'])
+		if len(versions) > 1:
+			tag += '+' + md5(repr(versions[1:])).hexdigest()[:16]
+		return 'W/"%s"' % tag
+	return 'W/"%s"' % md5(repr(versions)).hexdigest()
+	
+	
+def collect_versions(data, versions):
+	if isinstance(data, dict):
+		if '_id' in data:
+			if '_version' not in data:
+				return False
+			versions.append((data['_id'], data['_version']))
+		return all(collect_versions(v, versions) for v in data.values())
+	if isinstance(data, (list, tuple)):
+		return all(collect_versions(v, versions) for v in data)
+	return True
+	
+	
+body_tag_pattern = re.compile(r'^[0-9a-f]{32}$')
+
+def body_etag(body):
+	"""Make a weak ETag from a serialized response"""
+	return 'W/"%s"' % md5(body).hexdigest()
+	
+	
+def get_none_match(environ):
+	"""Get the ETags in the If-None-Match header, without their weak markers"""
+	header = environ.get('HTTP_IF_NONE_MATCH', '')
+	tags = set()
+	for tag in header.split(','):
+		tag = tag.strip()
+		if tag.startswith('W/'):
+			tag = tag[2:]
+		if tag:
+			tags.add(tag)
+	return tags
+	
+	
+def etag_matches(environ, etag):
+	"""Check whether the client already has the response with an ETag, comparing weakly"""
+	tags = get_none_match(environ)
+	if etag.startswith('W/'):
+		etag = etag[2:]
+	return '*' in tags or etag in tags
+	
+	
+def can_probe_version(environ):
+	"""
+	Check whether the client has a version of an item with nothing embedded 
+	in it, whose ETag can be checked without resolving embedded links.
+	"""
+	return any(tag != '*' and '+' not in tag for tag in get_none_match(environ))
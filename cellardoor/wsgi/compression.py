@@ -0,0 +1,80 @@
+import zlib
+
+__all__ = [
+	'Compression'
+]
+
+# The window bits zlib needs for each content coding
+WBITS = {
+	'gzip': 16 + zlib.MAX_WBITS,
+	'deflate': zlib.MAX_WBITS
+}
+
+
+class Compression(object):
+	"""
+	Compresses responses for clients that accept gzip or deflate::
+	
+		FalconApp(api, compression=Compression(min_size=1024, level=6))
+		
+	Bodies smaller than `min_size` bytes aren't worth compressing and are 
+	sent as they are. `level` trades speed for size, from 1 (fastest) to 9 
+	(smallest). Streamed lists are always compressed, with each piece flushed 
+	as it's sent so clients can still handle it as it arrives.
+	
+	ETags are weak, so a response keeps the same one however it's encoded.
+	"""
+	
+	# In order of preference when a client accepts more than one equally
+	encodings = ('gzip', 'deflate')
+	
+	def __init__(self, min_size=1024, level=6):
+		self.min_size = min_size
+		self.level = level
+		
+		
+	def choose(self, accept_encoding):
+		"""Get the encoding to use for an Accept-Encoding header, or `None` to send bodies as they are"""
+		if not accept_encoding:
+			return None
+		qualities = {}
+		for coding in accept_encoding.split(','):
+			name, _, params = coding.partition(';')
+			quality = 1.0
+			for param in params.split(';'):
+				key, _, value = param.partition('=')
+				if key.strip().lower() == 'q':
+					try:
+						quality = float(value)
+					except ValueError:
+						quality = 0.0
+			qualities[name.strip().lower()] = quality
+		best, best_quality = None, 0.0
+		for encoding in self.encodings:
+			quality = qualities.get(encoding, qualities.get('*', 0.0))
+			if quality > best_quality:
+				best, best_quality = encoding, quality
+		return best
+		
+		
+	def should_compress(self, body):
+		return len(body) >= self.min_size
+		
+		
+	def compress(self, body, encoding):
+		compressor = self.compressor(encoding)
+		return compressor.compress(body) + compressor.flush()
+		
+		
+	def compress_stream(self, pieces, encoding):
+		"""Compress the pieces of a streamed body as they come"""
+		compressor = self.compressor(encoding)
+		for piece in pieces:
+			data = compressor.compress(piece) + compressor.flush(zlib.Z_SYNC_FLUSH)
+			if data:
+				yield data
+		yield compressor.flush()
+		
+		
+	def compressor(self, encoding):
+		return zlib.compressobj(self.level, zlib.DEFLATED, WBITS[encoding])
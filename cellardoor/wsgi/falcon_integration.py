@@ -2,12 +2,13 @@ import functools
 import falcon
 import logging
 import inspect
+import collections
 from cellardoor import errors
 from cellardoor.api.methods import LIST, CREATE, GET, REPLACE, UPDATE, DELETE, get_http_methods
 from cellardoor.serializers import JSONSerializer, MsgPackSerializer
 from cellardoor.views import View
 from cellardoor.views.minimal import MinimalView
-from cellardoor.wsgi import parse_params, get_context
+from cellardoor.wsgi import parse_params, get_context, version_etag, body_etag, etag_matches, can_probe_version, get_body_tag
 
 class Resource(object):
 	"""
@@ -17,10 +18,16 @@ class Resource(object):
 	# The types of content that are accepted.
 	accept_serializers = (JSONSerializer(), MsgPackSerializer())
 	
+	# How many items of a posted array are validated and written at a time
+	bulk_chunk_size = 100
 	
-	def __init__(self, interface, views):
+	
+	def __init__(self, interface, views, response_cache=None, single_flight=None, compression=None):
 		self.interface = interface
 		self.views = views
+		self.response_cache = response_cache
+		self.single_flight = single_flight
+		self.compression = compression
 		self.logger = logging.getLogger(__name__)
 		
 		
@@ -46,8 +53,20 @@ class Resource(object):
 	
 	def list(self, req, resp):
 		kwargs = self.parse_params(req)
-		items = self.interface.list(**kwargs)
-		self.send_list(req, resp, items)
+		view = self.get_view(req)
+		if view.streaming:
+			return self.stream_list(req, resp, view, kwargs)
+		cache_key = self.get_cache_key(req, LIST, kwargs)
+		if self.send_cached(req, resp, cache_key):
+			return
+		self.respond(req, resp, LIST, kwargs, lambda: self.interface.list(**kwargs), 'get_list_response', cache_key)
+		
+		
+	def stream_list(self, req, resp, view, kwargs):
+		"""Send a list a piece at a time as it's read from storage"""
+		items = self.interface.stream(**kwargs)
+		resp.content_type, pieces = view.get_list_stream(req.get_header('accept'), items)
+		resp.stream = self.encode_stream(req, resp, pieces)
 		
 		
 	def count(self, req, resp):
@@ -59,48 +78,88 @@ class Resource(object):
 		
 		
 	def create(self, req, resp):
-		fields = self.get_fields_from_request(req)
+		body = self.get_fields_from_request(req, stream=True)
+		if isinstance(body, collections.Iterator):
+			return self.create_many(req, resp, body)
 		kwargs = self.parse_params(req, 'show_hidden', 'context', 'embedded')
-		item = self.interface.create(fields, **kwargs)
+		item = self.interface.create(body, **kwargs)
 		resp.status = falcon.HTTP_201
 		self.send_one(req, resp, item)
 		
+		
+	def create_many(self, req, resp, items):
+		"""
+		Create the items of an array posted to the list endpoint. They're read 
+		from the body as they're created, so it can be larger than memory. The 
+		response only has how many were created, in X-Count.
+		"""
+		kwargs = self.parse_params(req, 'context')
+		count = self.interface.create_many(self.read_items(items), chunk_size=self.bulk_chunk_size, **kwargs)
+		resp.status = falcon.HTTP_201
+		resp.content_type, _ = View.choose(req.get_header('accept'), self.views)
+		resp.set_header('X-Count', str(count))
+		
 	
 	def get(self, req, resp, id):
 		kwargs = self.parse_params(req, 'show_hidden', 'context', 'embedded')
-		item = self.interface.get(id, **kwargs)
-		self.send_one(req, resp, item)
+		cache_key = self.get_cache_key(req, GET, dict(kwargs, id=id))
+		if self.send_cached(req, resp, cache_key):
+			return
+		fetch = lambda: self.interface.get(id, **kwargs)
+		if self.interface.entity.versioned and can_probe_version(req.env):
+			# Check the version before going to the trouble of embedding links. 
+			# The tag only covers the item itself when nothing is embedded in it.
+			item = self.interface.get(id, allow_embedding=False, **kwargs)
+			if not self.interface.embedded_links(item, **kwargs):
+				etag = version_etag(item)
+				if etag and etag_matches(req.env, etag):
+					return self.send_not_modified(resp, etag)
+			fetch = lambda: self.interface.embed(item, **kwargs)
+		self.respond(req, resp, GET, dict(kwargs, id=id), fetch, 'get_individual_response', cache_key)
 		
 		
 	def update(self, req, resp, id):
 		fields = self.get_fields_from_request(req)
-		kwargs = self.parse_params(req, 'show_hidden', 'context', 'embedded')
+		kwargs = self.parse_params(req, 'show_hidden', 'context', 'embedded', 'version')
+		self.check_body_tag(req)
 		item = self.interface.update(id, fields, **kwargs)
 		self.send_one(req, resp, item)
 		
 		
 	def replace(self, req, resp, id):
 		fields = self.get_fields_from_request(req)
-		kwargs = self.parse_params(req, 'show_hidden', 'context', 'embedded')
+		kwargs = self.parse_params(req, 'show_hidden', 'context', 'embedded', 'version')
+		self.check_body_tag(req)
 		item = self.interface.replace(id, fields, **kwargs)
 		self.send_one(req, resp, item)
 		
 		
+	def check_body_tag(self, req):
+		"""
+		Items that aren't versioned get ETags made from their bodies, which 
+		can't be checked as part of an update, so an If-Match with one of 
+		those always fails.
+		"""
+		if get_body_tag(req.env):
+			raise falcon.HTTPPreconditionFailed('Precondition Failed', 
+				'%s is not versioned, so it can only be updated unconditionally.' % self.interface.entity.__name__)
+			
+			
 	def delete(self, req, resp, id):
 		self.interface.delete(id, context=get_context(req.env))
 		
 		
 	def get_link_or_reference(self, req, resp, id, link_name):
-		kwargs = self.parse_params(req)
+		kwargs = self.parse_params(req, entity=self.interface.entity.get_link(link_name).entity)
 		result = self.interface.link(id, link_name, **kwargs)
 		if isinstance(result, dict):
-			self.send_one(req, resp, result)
+			self.send_one(req, resp, result, conditional=True)
 		else:
-			self.send_list(req, resp, result)
+			self.send_list(req, resp, result, conditional=True)
 			
 			
 	def count_link_or_reference(self, req, resp, id, link_name):
-		kwargs = self.parse_params(req)
+		kwargs = self.parse_params(req, entity=self.interface.entity.get_link(link_name).entity)
 		kwargs['count'] = True
 		result = self.interface.link(id, link_name, **kwargs)
 		resp.content_type, _ = View.choose(req.get_header('accept'), self.views)
@@ -108,12 +167,134 @@ class Resource(object):
 			resp.set_header('X-Count', str(result))
 		
 		
-	def send_one(self, req, resp, item):
-		resp.content_type, resp.body = self.serialize_one(req, item)
+	def send_one(self, req, resp, item, conditional=False, cache_key=None):
+		self.send(req, resp, 'get_individual_response', item, conditional, cache_key)
+		
+		
+	def send_list(self, req, resp, items, conditional=False, cache_key=None):
+		self.send(req, resp, 'get_list_response', items, conditional, cache_key)
+		
+		
+	def send(self, req, resp, method_name, data, conditional=False, cache_key=None):
+		"""
+		Send a response with an ETag. If the response is `conditional` and the 
+		client already has it, a 304 is sent instead. A `cache_key` from 
+		`get_cache_key` stores the response in the response cache.
+		"""
+		etag = version_etag(data)
+		if conditional and etag and etag_matches(req.env, etag):
+			return self.send_not_modified(resp, etag)
+		self.send_rendered(req, resp, self.render(req, method_name, data, cache_key, etag), conditional, cache_key)
+		
+		
+	def respond(self, req, resp, method, params, fetch, method_name, cache_key=None):
+		"""
+		Send the response to a read made by `fetch`. With a single flight, 
+		identical requests that arrive while it's being made share it.
+		"""
+		if self.single_flight is None:
+			return self.send(req, resp, method_name, fetch(), conditional=True, cache_key=cache_key)
+		
+		def render():
+			data = fetch()
+			return self.render(req, method_name, data, cache_key, version_etag(data))
+		
+		key = self.single_flight.key(self.interface, method, params, self.get_content_type(req))
+		self.send_rendered(req, resp, self.single_flight.do(key, render), cache_key=cache_key)
+		
+		
+	def render(self, req, method_name, data, cache_key=None, etag=None):
+		"""
+		Serialize a response into `(content_type, body, etag)`, storing 
+		it in the response cache if there's a `cache_key`.
+		"""
+		content_type, body = self.serialize(req, method_name, data)
+		if etag is None:
+			etag = body_etag(body)
+		if cache_key is not None:
+			self.response_cache.set(cache_key, content_type, body, etag)
+		return content_type, body, etag
+		
+		
+	def send_rendered(self, req, resp, rendered, conditional=True, cache_key=None):
+		content_type, body, etag = rendered
+		if conditional and etag_matches(req.env, etag):
+			return self.send_not_modified(resp, etag)
+		resp.content_type, resp.body = content_type, self.encode(req, resp, rendered, cache_key)
+		resp.set_header('ETag', etag)
+		resp.set_header('Vary', self.vary)
+		
+		
+	def encode(self, req, resp, rendered, cache_key=None):
+		"""
+		Get the body of a rendered response, compressed if the client accepts it 
+		and it's big enough. With a `cache_key`, compressed bodies are kept in 
+		the response cache alongside the uncompressed ones.
+		"""
+		content_type, body, etag = rendered
+		if self.compression is None:
+			return body
+		encoding = self.compression.choose(req.get_header('accept-encoding'))
+		if encoding is None or not self.compression.should_compress(body):
+			return body
+		cached = self.response_cache.get(cache_key, encoding) if cache_key is not None else None
+		if cached is not None:
+			body = cached[1]
+		else:
+			body = self.compression.compress(body, encoding)
+			if cache_key is not None:
+				self.response_cache.set(cache_key, content_type, body, etag, encoding)
+		resp.set_header('Content-Encoding', encoding)
+		return body
+		
+		
+	def encode_stream(self, req, resp, pieces):
+		"""Compress the pieces of a streamed response as they're sent, if the client accepts it"""
+		if self.compression is None:
+			return pieces
+		resp.set_header('Vary', 'Accept-Encoding')
+		encoding = self.compression.choose(req.get_header('accept-encoding'))
+		if encoding is None:
+			return pieces
+		resp.set_header('Content-Encoding', encoding)
+		return self.compression.compress_stream(pieces, encoding)
+		
+		
+	def get_content_type(self, req):
+		content_type, _ = View.choose(req.get_header('accept'), self.views)
+		return content_type
+		
+		
+	def get_cache_key(self, req, method, params):
+		if self.response_cache is None:
+			return None
+		return self.response_cache.key(self.interface, method, params, self.get_content_type(req))
+		
+		
+	def send_cached(self, req, resp, cache_key):
+		"""Send a response from the response cache, if it's there"""
+		if cache_key is None:
+			return False
+		cached = self.response_cache.get(cache_key)
+		if cached is None:
+			return False
+		self.send_rendered(req, resp, cached, cache_key=cache_key)
+		return True
+		
 		
+	def send_not_modified(self, resp, etag):
+		resp.status = falcon.HTTP_304
+		resp.set_header('ETag', etag)
+		resp.set_header('Vary', self.vary)
 		
-	def send_list(self, req, resp, items):
-		resp.content_type, resp.body = self.serialize_list(req, items)
+		
+	@property
+	def vary(self):
+		"""
+		The request headers that choose between the representations a response 
+		with an ETag could have. Version ETags are the same for all of them.
+		"""
+		return 'Accept, Accept-Encoding' if self.compression is not None else 'Accept'
 		
 		
 	def serialize_one(self, req, data):
@@ -140,22 +321,38 @@ class Resource(object):
 		return view
 			
 			
-	def get_fields_from_request(self, req):
-		"""Unserializes the request body based on the request's content type"""
-		for serializer in self.accept_serializers:
+	def get_fields_from_request(self, req, stream=False):
+		"""
+		Unserializes the request body based on the request's content type. If 
+		`stream` is set, an array body is read lazily by `read_items`.
+		"""
+		accept_serializers = [x for x in self.accept_serializers if not x.output_only]
+		for serializer in accept_serializers:
 			if req.content_type.startswith( serializer.mimetype ):
+				unserialize = serializer.unserialize_stream if stream else serializer.unserialize
 				try:
-					return serializer.unserialize(req.stream)
+					return unserialize(req.stream, entity=self.interface.entity)
 				except Exception:
 					self.logger.exception('Could not parse request body.')
 					raise falcon.HTTPBadRequest('Bad Request', 'Could not parse request body.')
 		raise falcon.HTTPUnsupportedMediaType(
-			'The supported types are: %s' % ', '.join([x.mimetype for x in self.accept_serializers]))
+			'The supported types are: %s' % ', '.join([x.mimetype for x in accept_serializers]))
 		
 		
-	def parse_params(self, req, *args):
+	def read_items(self, items):
+		"""Yield the items of a streamed body, with errors part way through it as a 400"""
+		try:
+			for item in items:
+				yield item
+		except Exception:
+			self.logger.exception('Could not parse request body.')
+			raise falcon.HTTPBadRequest('Bad Request', 'Could not parse request body.')
+			
+			
+	def parse_params(self, req, *args, **kwargs):
+		kwargs.setdefault('entity', self.interface.entity)
 		try:
-			return parse_params(req.env, *args)
+			return parse_params(req.env, *args, **kwargs)
 		except errors.ParseError, e:
 			raise falcon.HTTPBadRequest('Bad Request', e.message)
 			
@@ -244,6 +441,14 @@ def validation_error_handler(views, exc, req, resp, params):
 	resp.status = falcon.HTTP_400
 	
 	
+def version_conflict_handler(exc, req, resp, params):
+	raise falcon.HTTPPreconditionFailed('Precondition Failed', 'The item has been changed since the version given in If-Match.')
+	
+	
+def not_versioned_handler(exc, req, resp, params):
+	raise falcon.HTTPBadRequest('Bad Request', exc.message)
+	
+	
 def disabled_field_error(exc, req, resp, params):
 	raise falcon.HTTPUnauthorized('Unauthorized', exc.message)
 	
@@ -258,7 +463,7 @@ def duplicate_field_error(views, exc, req, resp, params):
 		
 class FalconApp(object):
 	
-	def __init__(self, api, falcon_app=None, views=(MinimalView,)):
+	def __init__(self, api, falcon_app=None, views=(MinimalView,), response_cache=None, single_flight=None, compression=None):
 		if falcon_app is None:
 			falcon_app = falcon.API()
 		self.falcon_app = falcon_app
@@ -270,6 +475,8 @@ class FalconApp(object):
 		for v in views:
 			if inspect.isclass(v):
 				v = v()
+			if v.prepared_items:
+				api.prepare_list_items = True
 			for mimetype, _ in v.serializers:
 				views_by_type.append((mimetype, v))
 				
@@ -279,11 +486,14 @@ class FalconApp(object):
 		validation_error_handler_with_views = functools.partial(validation_error_handler, views_by_type)
 		falcon_app.add_error_handler(errors.CompoundValidationError, validation_error_handler_with_views)
 		falcon_app.add_error_handler(errors.DisabledFieldError, disabled_field_error)
+		falcon_app.add_error_handler(errors.VersionConflictError, version_conflict_handler)
+		falcon_app.add_error_handler(errors.NotVersionedError, not_versioned_handler)
 		duplicate_field_error_with_views = functools.partial(duplicate_field_error, views_by_type)
 		falcon_app.add_error_handler(errors.DuplicateError, duplicate_field_error_with_views)
 		
 		for interface in api.interfaces.values():
-			resource = Resource(interface, views_by_type)
+			resource = Resource(interface, views_by_type, response_cache=response_cache, single_flight=single_flight, 
+				compression=compression)
 			resource.add_to_falcon(falcon_app)
 			self.resources[interface.plural_name] = resource
 			
@@ -2,61 +2,229 @@ import inspect
 from functools import wraps
 import logging
 import collections
-from flask import Blueprint, request, abort, make_response
+from flask import Blueprint, Response, request, abort, make_response
 from flask.views import MethodView
 from cellardoor import errors
 from cellardoor.serializers import JSONSerializer, MsgPackSerializer
-from cellardoor.wsgi import parse_params, get_context
+from cellardoor.wsgi import parse_params, get_context, version_etag, body_etag, etag_matches, can_probe_version, get_body_tag
 from cellardoor.views.minimal import MinimalView
 from cellardoor.views import View
 from cellardoor.api.methods import LIST, CREATE, GET, UPDATE, REPLACE, DELETE
 
 class Resource(MethodView):
 	
-	def response(self, content, status_code=200):
+	compression = None
+	
+	def response(self, content, status_code=200, conditional=False, cache_key=None):
+		etag = version_etag(content)
+		if conditional and etag and etag_matches(request.environ, etag):
+			return self.not_modified(etag)
+		return self.rendered_response(self.render(content, cache_key, etag), status_code, conditional, cache_key)
+		
+		
+	def shared_response(self, method, params, fetch, cache_key=None):
+		"""
+		Respond to a read made by `fetch`. With a single flight, identical 
+		requests that arrive while it's being made share the response.
+		"""
+		if self.single_flight is None:
+			return self.response(fetch(), conditional=True, cache_key=cache_key)
+		
+		def render():
+			content = fetch()
+			return self.render(content, cache_key, version_etag(content))
+		
+		key = self.single_flight.key(self.interface, method, params, self.get_content_type())
+		return self.rendered_response(self.single_flight.do(key, render), cache_key=cache_key)
+		
+		
+	def render(self, content, cache_key=None, etag=None):
+		"""
+		Serialize a response into `(content_type, body, etag)`, storing 
+		it in the response cache if there's a `cache_key`.
+		"""
 		_, view = View.choose(request.headers.get('accept'), self.views)
 		serialize_fn = view.get_list_response if isinstance(content, collections.Sequence) else view.get_individual_response
 		content_type, body = serialize_fn(request.headers.get('accept'), content)
+		if etag is None:
+			etag = body_etag(body)
+		if cache_key is not None:
+			self.response_cache.set(cache_key, content_type, body, etag)
+		return content_type, body, etag
+		
+		
+	def rendered_response(self, rendered, status_code=200, conditional=True, cache_key=None):
+		content_type, body, etag = rendered
+		if conditional and etag_matches(request.environ, etag):
+			return self.not_modified(etag)
+		body, encoding = self.encode(rendered, cache_key)
+		res = self.make_response(content_type, body, etag, status_code)
+		self.set_encoding_headers(res, encoding)
+		return res
+		
+		
+	def encode(self, rendered, cache_key=None):
+		"""
+		Get the body of a rendered response and the encoding it's in, compressed 
+		if the client accepts it and it's big enough. With a `cache_key`, compressed 
+		bodies are kept in the response cache alongside the uncompressed ones.
+		"""
+		content_type, body, etag = rendered
+		if self.compression is None:
+			return body, None
+		encoding = self.compression.choose(request.headers.get('accept-encoding'))
+		if encoding is None or not self.compression.should_compress(body):
+			return body, None
+		cached = self.response_cache.get(cache_key, encoding) if cache_key is not None else None
+		if cached is not None:
+			return cached[1], encoding
+		body = self.compression.compress(body, encoding)
+		if cache_key is not None:
+			self.response_cache.set(cache_key, content_type, body, etag, encoding)
+		return body, encoding
+		
+		
+	def set_encoding_headers(self, res, encoding):
+		if self.compression is not None and 'vary' not in res.headers:
+			res.headers['vary'] = 'Accept-Encoding'
+		if encoding:
+			res.headers['content-encoding'] = encoding
+		
+		
+	def make_response(self, content_type, body, etag, status_code=200):
 		res = make_response(body)
 		res.status_code = status_code
 		res.headers['content-type'] = content_type
+		res.headers['etag'] = etag
+		res.headers['vary'] = self.vary
 		return res
 		
 		
-	def parse_params(self, *args):
-		return parse_params(request.environ, *args)
+	@property
+	def vary(self):
+		"""
+		The request headers that choose between the representations a response 
+		with an ETag could have. Version ETags are the same for all of them.
+		"""
+		return 'Accept, Accept-Encoding' if self.compression is not None else 'Accept'
+		
+		
+	def get_content_type(self):
+		content_type, _ = View.choose(request.headers.get('accept'), self.views)
+		return content_type
+		
 		
+	def get_cache_key(self, method, params):
+		if self.response_cache is None:
+			return None
+		return self.response_cache.key(self.interface, method, params, self.get_content_type())
+		
+		
+	def cached_response(self, cache_key):
+		"""Get a response from the response cache, if it's there"""
+		if cache_key is None:
+			return None
+		cached = self.response_cache.get(cache_key)
+		if cached is None:
+			return None
+		return self.rendered_response(cached, cache_key=cache_key)
+		
+		
+	def not_modified(self, etag):
+		res = make_response('')
+		res.status_code = 304
+		res.headers['etag'] = etag
+		res.headers['vary'] = self.vary
+		return res
 		
-	def get_fields_from_request(self):
+		
+	def parse_params(self, *args, **kwargs):
+		kwargs.setdefault('entity', self.interface.entity)
+		return parse_params(request.environ, *args, **kwargs)
+		
+		
+	def get_fields_from_request(self, stream=False):
 		for serializer in self.accept_serializers:
+			if serializer.output_only:
+				continue
 			if request.headers.get('content-type', '').startswith( serializer.mimetype ):
+				unserialize = serializer.unserialize_stream if stream else serializer.unserialize
 				try:
-					return serializer.unserialize(request.stream)
+					return unserialize(request.stream, entity=self.interface.entity)
 				except Exception:
 					self.logger.exception('Could not parse request body.')
 					abort(400)
 		abort(415)
+		
+		
+	def read_items(self, items):
+		"""Yield the items of a streamed body, with errors part way through it as a 400"""
+		try:
+			for item in items:
+				yield item
+		except Exception:
+			self.logger.exception('Could not parse request body.')
+			abort(400)
 
 
 class EntityResource(Resource):
 	
 	accept_serializers = (JSONSerializer(), MsgPackSerializer())
 	
-	def __init__(self, interface, views):
+	# How many items of a posted array are validated and written at a time
+	bulk_chunk_size = 100
+	
+	def __init__(self, interface, views, response_cache=None, single_flight=None, compression=None):
 		self.interface = interface
 		self.views = views
+		self.response_cache = response_cache
+		self.single_flight = single_flight
+		self.compression = compression
 		self.logger = logging.getLogger(__name__)
 		
 		
 	def get(self, id):
 		if id:
 			kwargs = self.parse_params('show_hidden', 'context', 'embedded')
-			item = self.interface.get(id, **kwargs)
-			return self.response(item)
+			cache_key = self.get_cache_key(GET, dict(kwargs, id=id))
+			cached = self.cached_response(cache_key)
+			if cached is not None:
+				return cached
+			fetch = lambda: self.interface.get(id, **kwargs)
+			if self.interface.entity.versioned and can_probe_version(request.environ):
+				# Check the version before going to the trouble of embedding links. 
+				# The tag only covers the item itself when nothing is embedded in it.
+				item = self.interface.get(id, allow_embedding=False, **kwargs)
+				if not self.interface.embedded_links(item, **kwargs):
+					etag = version_etag(item)
+					if etag and etag_matches(request.environ, etag):
+						return self.not_modified(etag)
+				fetch = lambda: self.interface.embed(item, **kwargs)
+			return self.shared_response(GET, dict(kwargs, id=id), fetch, cache_key)
 		else:
 			kwargs = self.parse_params()
-			items = self.interface.list(**kwargs)
-			return self.response(items)
+			_, view = View.choose(request.headers.get('accept'), self.views)
+			if view.streaming:
+				return self.stream_response(view, kwargs)
+			cache_key = self.get_cache_key(LIST, kwargs)
+			cached = self.cached_response(cache_key)
+			if cached is not None:
+				return cached
+			return self.shared_response(LIST, kwargs, lambda: self.interface.list(**kwargs), cache_key)
+		
+		
+	def stream_response(self, view, kwargs):
+		"""Respond with a list a piece at a time as it's read from storage"""
+		items = self.interface.stream(**kwargs)
+		content_type, pieces = view.get_list_stream(request.headers.get('accept'), items)
+		encoding = None
+		if self.compression is not None:
+			encoding = self.compression.choose(request.headers.get('accept-encoding'))
+		if encoding:
+			pieces = self.compression.compress_stream(pieces, encoding)
+		res = Response(pieces, content_type=content_type)
+		self.set_encoding_headers(res, encoding)
+		return res
 		
 		
 	def head(self):
@@ -70,29 +238,60 @@ class EntityResource(Resource):
 		
 		
 	def post(self):
-		fields = self.get_fields_from_request()
+		body = self.get_fields_from_request(stream=True)
+		if isinstance(body, collections.Iterator):
+			return self.post_many(body)
 		kwargs = self.parse_params('show_hidden', 'context', 'embedded')
 		try:
-			item = self.interface.create(fields, **kwargs)
+			item = self.interface.create(body, **kwargs)
 		except errors.CompoundValidationError, e:
 			return self.response(e.errors, status_code=400)
 		return self.response(item, status_code=201)
 		
 		
+	def post_many(self, items):
+		"""
+		Create the items of a posted array. They're read from the body as 
+		they're created, so it can be larger than memory. The response only 
+		has how many were created, in X-Count.
+		"""
+		kwargs = self.parse_params('context')
+		try:
+			count = self.interface.create_many(self.read_items(items), chunk_size=self.bulk_chunk_size, **kwargs)
+		except errors.CompoundValidationError, e:
+			return self.response(e.errors, status_code=400)
+		res = make_response('', 201)
+		res.headers['Content-Type'], _ = View.choose(request.headers.get('accept'), self.views)
+		res.headers['X-Count'] = str(count)
+		return res
+		
+		
 	def put(self, id):
 		fields = self.get_fields_from_request()
-		kwargs = self.parse_params('show_hidden', 'context', 'embedded')
+		kwargs = self.parse_params('show_hidden', 'context', 'embedded', 'version')
+		self.check_body_tag()
 		item = self.interface.replace(id, fields, **kwargs)
 		return self.response(item)
 		
 		
 	def patch(self, id):
 		fields = self.get_fields_from_request()
-		kwargs = self.parse_params('show_hidden', 'context', 'embedded')
+		kwargs = self.parse_params('show_hidden', 'context', 'embedded', 'version')
+		self.check_body_tag()
 		item = self.interface.update(id, fields, **kwargs)
 		return self.response(item)
 		
 		
+	def check_body_tag(self):
+		"""
+		Items that aren't versioned get ETags made from their bodies, which 
+		can't be checked as part of an update, so an If-Match with one of 
+		those always fails.
+		"""
+		if get_body_tag(request.environ):
+			abort(412)
+			
+			
 	def delete(self, id):
 		self.interface.delete(id, context=get_context(request.environ))
 		return ''
@@ -100,20 +299,21 @@ class EntityResource(Resource):
 	
 class LinkResource(Resource):
 	
-	def __init__(self, interface, link_name, views):
+	def __init__(self, interface, link_name, views, compression=None):
 		self.interface = interface
 		self.link_name = link_name
 		self.views = views
+		self.compression = compression
 		
 		
 	def get(self, id):
-		kwargs = self.parse_params()
+		kwargs = self.parse_params(entity=self.interface.entity.get_link(self.link_name).entity)
 		result = self.interface.link(id, self.link_name, **kwargs)
-		return self.response(result)
+		return self.response(result, conditional=True)
 		
 		
 	def head(self, id):
-		kwargs = self.parse_params()
+		kwargs = self.parse_params(entity=self.interface.entity.get_link(self.link_name).entity)
 		kwargs['count'] = True
 		count = self.interface.link(id, self.link_name, **kwargs)
 		res = make_response('')
@@ -152,10 +352,15 @@ def handle_errors(fn, views):
 			return error_response(400, {e.message:'A duplicate already exists.'}, views=views)
 		except errors.ParseError, e:
 			return error_response(400, e.message, views=views)
+		except errors.VersionConflictError:
+			return error_response(412, views=views)
+		except errors.NotVersionedError, e:
+			return error_response(400, e.message, views=views)
 	return wrapper
 		
 		
-def create_blueprint(api, name="api", import_name=__name__, views=(MinimalView,)):
+def create_blueprint(api, name="api", import_name=__name__, views=(MinimalView,), response_cache=None, single_flight=None, 
+	compression=None):
 	bp = Blueprint(name, import_name)
 	
 	views_by_type = []
@@ -163,11 +368,14 @@ def create_blueprint(api, name="api", import_name=__name__, views=(MinimalView,)
 	for v in views:
 		if inspect.isclass(v):
 			v = v()
+		if v.prepared_items:
+			api.prepare_list_items = True
 		for mimetype, _ in v.serializers:
 			views_by_type.append((mimetype, v))
 	
 	for interface_name, interface in api.interfaces.items():
-		view = handle_errors(EntityResource.as_view(interface_name, interface, views_by_type), views_by_type)
+		view = handle_errors(EntityResource.as_view(interface_name, interface, views_by_type, response_cache, single_flight, 
+			compression), views_by_type)
 		if LIST in interface.rules.enabled_methods:
 			bp.add_url_rule(
 				'/%s/' % interface_name,
@@ -212,7 +420,8 @@ def create_blueprint(api, name="api", import_name=__name__, views=(MinimalView,)
 			)
 		for link_name, link in interface.entity.get_links().items():
 			if interface.api.get_interface_for_entity(link.entity):
-				link_view = handle_errors(LinkResource.as_view('%s.%s' % (interface_name, link_name), interface, link_name, views_by_type), views_by_type)
+				link_view = handle_errors(LinkResource.as_view('%s.%s' % (interface_name, link_name), interface, link_name, views_by_type, 
+					compression), views_by_type)
 				trailing_slash = '/' if interface.entity.is_multiple_link(getattr(interface.entity, link_name)) else ''
 				bp.add_url_rule(
 					'/%s/<id>/%s%s' % (interface_name, link_name, trailing_slash),
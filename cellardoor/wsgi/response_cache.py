@@ -0,0 +1,130 @@
+import logging
+from ..cache import LRUCache, CacheError, freeze
+from ..storage import StorageWrapper
+
+__all__ = [
+	'ResponseCache',
+	'InvalidatingStorage'
+]
+
+
+class ResponseCache(object):
+	"""
+	Caches serialized responses to anonymous list and get requests. Every
+	anonymous client gets the same response for the same parameters, so it
+	only needs to be made once::
+	
+		response_cache = ResponseCache(cache=SocketCache())
+		model = Model(storage=response_cache.track(MongoDBStorage('hamblog')))
+		...
+		FalconApp(api, response_cache=response_cache)
+		
+	Responses are keyed by interface, method, parameters and content type,
+	tagged with a generation number for the interface's entity and every
+	entity it links to. Writes made through a storage wrapped with `track`
+	bump the generation of their entity, so responses that could contain
+	what was written are no longer used.
+	"""
+	
+	def __init__(self, cache=None, max_size=1000, ttl=60):
+		self.cache = cache if cache is not None else LRUCache(max_size=max_size, ttl=ttl)
+		self.logger = logging.getLogger(__name__)
+		
+		
+	def track(self, storage):
+		"""Wrap a storage so writes made through it invalidate cached responses"""
+		return InvalidatingStorage(storage, self)
+		
+		
+	def key(self, interface, method, params, content_type):
+		"""
+		Get the key of a response, or `None` if it can't be cached. Get it before
+		handling the request so a write made in the meantime isn't missed.
+		"""
+		if params.get('context'):
+			return None
+		try:
+			generations = tuple(self.cache.counter(('response-generation', name))
+				for name in self._dependencies(interface.entity))
+		except CacheError:
+			self.logger.exception('Could not read from the cache.')
+			return None
+		return ('response', interface.plural_name, method, generations, freeze(params), content_type)
+		
+		
+	def get(self, key, encoding=None):
+		"""
+		Get a cached `(content_type, body, etag)`. If an `encoding` is given, 
+		the body is the one compressed with it, which is cached separately.
+		"""
+		if encoding:
+			key = key + (encoding,)
+		try:
+			return self.cache.get(key)
+		except CacheError:
+			self.logger.exception('Could not read from the cache.')
+			
+			
+	def set(self, key, content_type, body, etag, encoding=None):
+		if encoding:
+			key = key + (encoding,)
+		try:
+			self.cache.set(key, (content_type, body, etag))
+		except CacheError:
+			self.logger.exception('Could not write to the cache.')
+			
+			
+	def invalidate(self, entity):
+		try:
+			self.cache.incr(('response-generation', self._root(entity).__name__))
+		except CacheError:
+			self.logger.exception('Could not invalidate %s responses in the cache.', entity.__name__)
+			
+			
+	def _dependencies(self, entity):
+		# Any type in the hierarchy can turn up in a response,
+		# along with anything they link to.
+		root = self._root(entity)
+		names = set([root.__name__])
+		for e in [root] + root.children:
+			for link in e.get_links().values():
+				names.add(self._root(link.entity).__name__)
+		return sorted(names)
+		
+		
+	def _root(self, entity):
+		return entity.hierarchy[0] if entity.hierarchy else entity
+		
+		
+		
+class InvalidatingStorage(StorageWrapper):
+	"""
+	Invalidates the cached responses of a `ResponseCache` for each entity written to.
+	"""
+	
+	def __init__(self, storage, response_cache):
+		super(InvalidatingStorage, self).__init__(storage)
+		self.response_cache = response_cache
+		
+		
+	def create(self, entity, fields):
+		try:
+			return self.storage.create(entity, fields)
+		finally:
+			self.response_cache.invalidate(entity)
+			
+			
+	def update(self, entity, id, fields, replace=False, operations=None, filter=None, version=None):
+		try:
+			return self.storage.update(entity, id, fields, replace=replace, operations=operations, filter=filter,
+				version=version)
+		finally:
+			self.response_cache.invalidate(entity)
+			
+			
+	def delete(self, entity, id):
+		try:
+			return self.storage.delete(entity, id)
+		finally:
+			self.response_cache.invalidate(entity)
+			
\ No newline at end of file
@@ -0,0 +1,84 @@
+import sys
+import threading
+from ..cache import freeze
+
+__all__ = [
+	'SingleFlight'
+]
+
+
+class Call(object):
+
+	def __init__(self):
+		self.done = threading.Event()
+		self.result = None
+		self.error = None
+		self.waiters = 0
+		
+		
+		
+class SingleFlight(object):
+	"""
+	Coalesces identical requests that arrive at the same time. The first one
+	is handled and the rest wait for it and share its response::
+	
+		FalconApp(api, single_flight=SingleFlight())
+		
+	Requests are identical if they are for the same interface, method and
+	parameters, including the identity in their context, and want the same
+	content type, so a response is never shared between identities.
+	
+	It waits with `threading` primitives, which greenlet servers like gevent
+	and eventlet make cooperative when they patch the standard library. If
+	`timeout` is given, a request that has waited that many seconds stops
+	waiting and is handled on its own.
+	"""
+	
+	def __init__(self, timeout=None):
+		self.timeout = timeout
+		self.calls = {}
+		self.lock = threading.Lock()
+		self.shared = 0
+		
+		
+	def key(self, interface, method, params, content_type):
+		return (interface.plural_name, method, freeze(params), content_type)
+		
+		
+	def do(self, key, fn):
+		"""Call `fn`, unless a call with the same key is in flight, in which case wait for its result"""
+		with self.lock:
+			call = self.calls.get(key)
+			leader = call is None
+			if leader:
+				call = self.calls[key] = Call()
+			else:
+				call.waiters += 1
+				
+		if not leader:
+			if not call.done.wait(self.timeout):
+				with self.lock:
+					# The call may have finished since the wait timed out,
+					# in which case this has been counted as sharing it
+					gave_up = self.calls.get(key) is call
+					if gave_up:
+						call.waiters -= 1
+				if gave_up:
+					return fn()
+				call.done.wait()
+			if call.error:
+				raise call.error[0], call.error[1], call.error[2]
+			return call.result
+			
+		try:
+			call.result = fn()
+			return call.result
+		except Exception:
+			call.error = sys.exc_info()
+			raise
+		finally:
+			with self.lock:
+				del self.calls[key]
+				self.shared += call.waiters
+			call.done.set()
+			
\ No newline at end of file
@@ -1,7 +1,7 @@
 import unittest
 from mock import Mock
 from cellardoor.authorization import *
-from cellardoor.model import Model, Text, Link
+from cellardoor.model import Model, Text, Link, Integer, ListOf
 from cellardoor.storage import Storage
 
 
@@ -16,6 +16,12 @@ class Bar(model.Entity):
 	pass
 	
 	
+class Baz(model.Entity):
+	owner = Text()
+	views = Integer()
+	tags = ListOf(Text())
+	
+	
 model.freeze()
 
 
@@ -437,4 +443,64 @@ class TestAuthorization(unittest.TestCase):
 		interface.link.assert_called_once_with(
 			'123', 'link-name', bypass_authorization=True, show_hidden=True
 		)
-		
\ No newline at end of file
+		
+		
+		
+		
+class TestItemFilter(unittest.TestCase):
+	
+	def setUp(self):
+		self.item = ItemProxy(Baz)
+		self.identity = ObjectProxy('identity')
+		self.context = {'identity':{'id':'123', 'role':'user'}}
+		
+		
+	def filter(self, rule):
+		return item_filter(rule, self.context, Baz.fields)
+		
+		
+	def test_comparisons(self):
+		"""Comparisons of item fields become filters"""
+		item = self.item
+		self.assertEquals(self.filter(item.owner == 'bob'), {'owner':'bob'})
+		self.assertEquals(self.filter(item.owner != 'bob'), {'owner':{'$ne':'bob'}})
+		self.assertEquals(self.filter(item.views < 5), {'views':{'$lt':5}})
+		self.assertEquals(self.filter(item.views > 5), {'views':{'$gt':5}})
+		self.assertEquals(self.filter(item.views <= 5), {'views':{'$lte':5}})
+		self.assertEquals(self.filter(item.views >= 5), {'views':{'$gte':5}})
+		self.assertEquals(self.filter(item.owner.in_(['a', 'b'])), {'owner':{'$in':['a', 'b']}})
+		self.assertEquals(self.filter(item.owner.exists()), {'owner':{'$exists':True}})
+		
+		
+	def test_identity_values(self):
+		"""Values from the identity are filled in"""
+		self.assertEquals(self.filter(self.item.owner == self.identity.id), {'owner':'123'})
+		
+		
+	def test_boolean(self):
+		"""Rules that don't use the item are evaluated right away"""
+		item = self.item
+		identity = self.identity
+		self.assertEquals(self.filter(identity.role == 'user'), True)
+		self.assertEquals(self.filter(identity.role == 'admin'), False)
+		self.assertEquals(self.filter((identity.role == 'admin') | (item.owner == identity.id)), {'owner':'123'})
+		self.assertEquals(self.filter((identity.role == 'user') | (item.owner == identity.id)), True)
+		self.assertEquals(self.filter((identity.role == 'admin') & (item.owner == identity.id)), False)
+		self.assertEquals(self.filter((identity.role == 'user') & (item.owner == identity.id)), {'owner':'123'})
+		self.assertEquals(self.filter((item.views > 1) & (item.owner == identity.id)), 
+			{'$and':[{'views':{'$gt':1}}, {'owner':'123'}]})
+		self.assertEquals(self.filter((item.views > 1) | (item.owner == identity.id)), 
+			{'$or':[{'views':{'$gt':1}}, {'owner':'123'}]})
+		
+		
+	def test_untranslatable(self):
+		"""Rules the storage can't check return None"""
+		item = self.item
+		self.assertEquals(self.filter(lambda context: True), None)
+		self.assertEquals(self.filter(item.tags == 'a'), None)
+		self.assertEquals(self.filter(item.unknown == 'a'), None)
+		self.assertEquals(self.filter(item.owner == item.views), None)
+		self.assertEquals(self.filter(item.owner == ['a']), None)
+		self.assertEquals(self.filter(item.owner.in_('abc')), None)
+		self.assertEquals(self.filter(item.match(lambda x: True)), None)
+		self.assertEquals(self.filter((item.views > 1) & item.match(lambda x: True)), None)
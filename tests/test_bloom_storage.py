@@ -0,0 +1,196 @@
+import unittest
+from mock import Mock
+from cellardoor.model import Model, Text, Link
+from cellardoor.storage import Storage
+from cellardoor.storage.bloom import BloomFilter, BloomFilterStorage
+
+
+model = Model(storage=Storage())
+
+
+class Foo(model.Entity):
+	name = Text()
+	
+	
+class Bar(model.Entity):
+	name = Text()
+	
+	
+class Tag(model.Entity):
+	name = Text()
+	
+	
+class Primate(model.Entity):
+	pass
+	
+	
+class Human(Primate):
+	pass
+	
+	
+	
+class TestBloomFilter(unittest.TestCase):
+	
+	def test_contains(self):
+		"""
+		Should always find keys that were added
+		"""
+		bloom = BloomFilter(capacity=1000, error_rate=0.01)
+		for i in range(1000):
+			bloom.add(str(i))
+		for i in range(1000):
+			self.assertTrue(str(i) in bloom)
+		self.assertEquals(bloom.count, 1000)
+		
+		
+	def test_false_positive_rate(self):
+		"""
+		Should only rarely find keys that weren't added
+		"""
+		bloom = BloomFilter(capacity=1000, error_rate=0.01)
+		for i in range(1000):
+			bloom.add(u'id-%d' % i)
+		false_positives = sum(1 for i in range(10000) if 'other-%d' % i in bloom)
+		self.assertTrue(false_positives < 300)
+		self.assertAlmostEquals(bloom.false_positive_rate, 0.01, places=2)
+		
+		
+	def test_size(self):
+		"""
+		Should use more memory and hashes for a lower error rate
+		"""
+		loose = BloomFilter(capacity=1000, error_rate=0.1)
+		tight = BloomFilter(capacity=1000, error_rate=0.001)
+		self.assertTrue(tight.memory > loose.memory)
+		self.assertTrue(tight.hashes > loose.hashes)
+		
+		
+		
+class TestBloomFilterStorage(unittest.TestCase):
+	
+	def setUp(self):
+		self.inner = Storage()
+		self.inner.get = Mock(return_value=[{'_id':'1'}, {'_id':'2'}])
+		self.storage = BloomFilterStorage(self.inner, entities=('Bar',), local=('Foo', 'Primate', 'Human'), trusted=('Tag',))
+		self.storage.setup(model)
+		
+		
+	def test_setup(self):
+		"""
+		Should build the filters from the ids in storage
+		"""
+		self.inner.get.assert_any_call(Foo, fields={})
+		self.assertEquals(sorted(self.storage.filters.keys()), ['Bar', 'Foo', 'Human', 'Primate', 'Tag'])
+		
+		
+	def test_get_by_id(self):
+		"""
+		Ids not in the filter shouldn't be looked up
+		"""
+		self.inner.get_by_id = Mock(return_value={'_id':'1', 'name':'foo'})
+		self.assertEquals(self.storage.get_by_id(Foo, '1'), {'_id':'1', 'name':'foo'})
+		self.assertEquals(self.storage.get_by_id(Foo, '3'), None)
+		self.inner.get_by_id.assert_called_once_with(Foo, '1', fields=None, read_preference=None)
+		
+		
+	def test_stale(self):
+		"""
+		Filters should be rebuilt once they're stale, and their misses looked up while another thread rebuilds them
+		"""
+		self.inner.get_by_id = Mock(return_value={'_id':'3', 'name':'bar'})
+		self.inner.get_by_ids = Mock(return_value=[{'_id':'3'}])
+		self.assertEquals(self.storage.get_by_id(Bar, '3'), None)
+		self.assertFalse(self.inner.get_by_id.called)
+		
+		self.inner.get = Mock(return_value=[{'_id':'1'}, {'_id':'3'}])
+		self.storage.built['Bar'] -= 61
+		self.assertEquals(self.storage.get_by_id(Bar, '3'), {'_id':'3', 'name':'bar'})
+		self.inner.get.assert_called_once_with(Bar, fields={})
+		self.assertEquals(self.storage.stats()['Bar']['rebuilds'], 2)
+		
+		self.inner.get_by_id.reset_mock()
+		self.storage.built['Bar'] -= 61
+		self.storage.built['Foo'] -= 61
+		self.storage.locks['Bar'].acquire()
+		self.storage.locks['Foo'].acquire()
+		self.assertEquals(self.storage.get_by_id(Bar, '4'), {'_id':'3', 'name':'bar'})
+		self.inner.get_by_id.assert_called_once_with(Bar, '4', fields=None, read_preference=None)
+		self.assertEquals(self.storage.stats()['Bar']['unseen'], 1)
+		self.assertEquals(self.storage.get_by_ids(Bar, ['3', '4']), [{'_id':'3'}])
+		self.inner.get_by_ids.assert_called_once_with(Bar, ['3', '4'], filter=None, fields=None, sort=None, offset=0, limit=0, 
+			count=False, read_preference=None)
+		
+		# Local entities' misses are final however stale they are
+		self.assertEquals(self.storage.get_by_id(Foo, '4'), None)
+		self.assertEquals(self.inner.get_by_id.call_count, 1)
+		
+		
+	def test_trusted_stale(self):
+		"""
+		Ids of trusted entities shouldn't be trusted while the filter is stale
+		"""
+		self.inner.get_by_id = Mock(return_value=None)
+		self.storage.built['Tag'] -= 61
+		self.storage.locks['Tag'].acquire()
+		self.assertEquals(self.storage.get_by_id(Tag, '1', fields={}), None)
+		self.inner.get_by_id.assert_called_once_with(Tag, '1', fields={}, read_preference=None)
+		
+		
+	def test_get_by_ids(self):
+		"""
+		Ids not in the filter shouldn't be looked up
+		"""
+		self.inner.get_by_ids = Mock(return_value=[{'_id':'1'}])
+		self.assertEquals(self.storage.get_by_ids(Foo, ['1', '3']), [{'_id':'1'}])
+		self.inner.get_by_ids.assert_called_once_with(Foo, ['1'], filter=None, fields=None, sort=None, offset=0, limit=0, 
+			count=False, read_preference=None)
+		self.assertEquals(self.storage.get_by_ids(Foo, ['3', '4']), [])
+		self.assertEquals(self.storage.get_by_ids(Foo, ['3', '4'], count=True), 0)
+		self.assertEquals(self.inner.get_by_ids.call_count, 1)
+		
+		
+	def test_create(self):
+		"""
+		Created items should be found, along with the base entities of their type
+		"""
+		self.inner.create = Mock(return_value='3')
+		self.inner.get_by_id = Mock(return_value={'_id':'3'})
+		self.storage.create(Human, {})
+		self.assertEquals(self.storage.get_by_id(Human, '3'), {'_id':'3'})
+		self.assertEquals(self.storage.get_by_id(Primate, '3'), {'_id':'3'})
+		
+		
+	def test_trusted(self):
+		"""
+		Existence checks of trusted entities shouldn't reach the storage unless the item was deleted
+		"""
+		self.inner.get_by_id = Mock(return_value=None)
+		self.inner.get_by_ids = Mock(return_value=[])
+		self.inner.delete = Mock()
+		self.assertEquals(self.storage.get_by_id(Tag, '1', fields={}), {'_id':'1'})
+		self.assertEquals(self.storage.get_by_ids(Tag, ['1', '2', '1', '3'], fields={}), [{'_id':'1'}, {'_id':'2'}])
+		self.assertFalse(self.inner.get_by_id.called)
+		self.assertFalse(self.inner.get_by_ids.called)
+		
+		self.storage.get_by_id(Tag, '1')
+		self.inner.get_by_id.assert_called_once_with(Tag, '1', fields=None, read_preference=None)
+		
+		self.storage.delete(Tag, '2')
+		self.assertEquals(self.storage.get_by_id(Tag, '2', fields={}), None)
+		self.assertEquals(self.inner.get_by_id.call_count, 2)
+		
+		
+	def test_stats(self):
+		"""
+		Should report the size and answers of each filter
+		"""
+		self.inner.get_by_id = Mock(return_value=None)
+		self.storage.get_by_id(Foo, '1')
+		self.storage.get_by_id(Foo, '3')
+		stats = self.storage.stats()['Foo']
+		self.assertEquals(stats['checks'], 2)
+		self.assertEquals(stats['rejected'], 1)
+		self.assertEquals(stats['false_positives'], 1)
+		self.assertEquals(stats['ids'], 2)
+		self.assertTrue(stats['memory'] > 0)
+		self.assertTrue(0 < stats['false_positive_rate'] < 0.01)
@@ -0,0 +1,93 @@
+import unittest
+from cellardoor.cache import LRUCache, freeze
+
+
+class FakeClock(object):
+	
+	def __init__(self):
+		self.now = 0
+		
+		
+	def __call__(self):
+		return self.now
+		
+		
+
+class TestLRUCache(unittest.TestCase):
+	
+	def test_get_set(self):
+		"""
+		Should return what was set and the default for missing keys
+		"""
+		cache = LRUCache()
+		cache.set('foo', 123)
+		self.assertEquals(cache.get('foo'), 123)
+		self.assertEquals(cache.get('bar'), None)
+		self.assertEquals(cache.get('bar', 'nope'), 'nope')
+		
+		
+	def test_evict_least_recently_used(self):
+		"""
+		Should evict the least recently used entry when full
+		"""
+		cache = LRUCache(max_size=2)
+		cache.set('a', 1)
+		cache.set('b', 2)
+		cache.get('a')
+		cache.set('c', 3)
+		self.assertEquals(cache.get('a'), 1)
+		self.assertEquals(cache.get('b'), None)
+		self.assertEquals(cache.get('c'), 3)
+		self.assertEquals(cache.stats()['evictions'], 1)
+		
+		
+	def test_ttl(self):
+		"""
+		Should treat entries older than their time to live as missing
+		"""
+		clock = FakeClock()
+		cache = LRUCache(ttl=10, clock=clock)
+		cache.set('a', 1)
+		cache.set('b', 2, ttl=100)
+		clock.now = 11
+		self.assertEquals(cache.get('a'), None)
+		self.assertEquals(cache.get('b'), 2)
+		self.assertEquals(len(cache), 1)
+		
+		
+	def test_delete_and_clear(self):
+		cache = LRUCache()
+		cache.set('a', 1)
+		cache.set('b', 2)
+		cache.delete('a')
+		cache.delete('nothing')
+		self.assertEquals(cache.get('a'), None)
+		cache.clear()
+		self.assertEquals(len(cache), 0)
+		
+		
+	def test_stats(self):
+		cache = LRUCache()
+		cache.set('a', 1)
+		cache.get('a')
+		cache.get('a')
+		cache.get('b')
+		self.assertEquals(cache.stats(), {'size':1, 'hits':2, 'misses':1, 'evictions':0})
+		
+		
+		
+class TestFreeze(unittest.TestCase):
+	
+	def test_equal_structures(self):
+		"""
+		Equal structures should freeze to equal, hashable values
+		"""
+		a = freeze({'foo': [1, 2, {'bar': set([3, 4])}], 'baz': None})
+		b = freeze({'baz': None, 'foo': (1, 2, {'bar': set([4, 3])})})
+		self.assertEquals(a, b)
+		self.assertEquals(hash(a), hash(b))
+		
+		
+	def test_different_structures(self):
+		self.assertNotEquals(freeze({'foo':1}), freeze({'foo':2}))
+		self.assertNotEquals(freeze({'foo':1}), freeze([('foo', 1)]))
@@ -0,0 +1,179 @@
+import os
+import stat
+import socket
+import unittest
+import tempfile
+import threading
+from datetime import datetime
+from bson.objectid import ObjectId
+from cellardoor.cache import CacheError
+from cellardoor.cache.daemon import CacheServer, SocketCache, default_socket_path
+
+
+class TestCacheDaemon(unittest.TestCase):
+	
+	def setUp(self):
+		self.path = os.path.join(tempfile.mkdtemp(), 'cache.sock')
+		self.server = CacheServer(self.path, max_size=10)
+		self.thread = threading.Thread(target=self.server.serve_forever)
+		self.thread.daemon = True
+		self.thread.start()
+		self.cache = SocketCache(self.path)
+		
+		
+	def tearDown(self):
+		self.cache.disconnect()
+		self.server.shutdown()
+		self.server.server_close()
+		
+		
+	def test_get_set(self):
+		"""
+		Should store and return values without changing their types
+		"""
+		doc = {
+			'_id': ObjectId(),
+			u'name': u'Sn\xf6rre',
+			'created': datetime(2014, 9, 5, 9, 23, 12, 555),
+			'tags': ['a', 'b'],
+			'count': 3,
+			'nothing': None
+		}
+		self.cache.set(('id', 'Foo', '123'), doc)
+		self.assertEquals(self.cache.get(('id', 'Foo', '123')), doc)
+		self.assertEquals(self.cache.get(('id', 'Foo', '321')), None)
+		self.assertEquals(self.cache.get(('id', 'Foo', '321'), 'nope'), 'nope')
+		
+		
+	def test_delete_and_clear(self):
+		self.cache.set('a', 1)
+		self.cache.set('b', 2)
+		self.cache.delete('a')
+		self.assertEquals(self.cache.get('a'), None)
+		self.assertEquals(self.cache.get('b'), 2)
+		self.cache.clear()
+		self.assertEquals(self.cache.get('b'), None)
+		
+		
+	def test_counters(self):
+		self.assertEquals(self.cache.counter('gen'), 0)
+		self.assertEquals(self.cache.incr('gen'), 1)
+		self.assertEquals(self.cache.incr('gen'), 2)
+		self.assertEquals(self.cache.counter('gen'), 2)
+		
+		
+	def test_shared(self):
+		"""
+		Changes made through one client are seen by the others
+		"""
+		other_cache = SocketCache(self.path)
+		self.cache.set('a', 1)
+		self.assertEquals(other_cache.get('a'), 1)
+		other_cache.delete('a')
+		self.assertEquals(self.cache.get('a'), None)
+		other_cache.disconnect()
+		
+		
+	def test_stats(self):
+		self.cache.set('a', 1)
+		self.cache.get('a')
+		self.cache.get('b')
+		stats = self.cache.stats()
+		self.assertEquals(stats['hits'], 1)
+		self.assertEquals(stats['misses'], 1)
+		self.assertEquals(stats['size'], 1)
+		
+		
+	def test_reconnect(self):
+		"""
+		Should reconnect if the connection was dropped
+		"""
+		self.cache.set('a', 1)
+		self.cache.local.sock.close()
+		self.assertEquals(self.cache.get('a'), 1)
+		
+		
+	def test_unreachable(self):
+		"""
+		Should raise a CacheError if the daemon can't be reached
+		"""
+		cache = SocketCache(self.path + '.nope')
+		with self.assertRaises(CacheError):
+			cache.get('a')
+			
+			
+	def test_private(self):
+		"""
+		Only the user running the daemon can connect by default
+		"""
+		self.assertEquals(stat.S_IMODE(os.stat(self.path).st_mode), 0600)
+		
+		
+	def test_mode(self):
+		"""
+		The socket can be shared by passing a mode
+		"""
+		path = self.path + '.shared'
+		server = CacheServer(path, mode=0660)
+		try:
+			self.assertEquals(stat.S_IMODE(os.stat(path).st_mode), 0660)
+		finally:
+			server.server_close()
+			
+			
+	def test_replace_socket(self):
+		"""
+		A socket left behind by an earlier server is replaced
+		"""
+		path = self.path + '.old'
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		sock.bind(path)
+		sock.close()
+		server = CacheServer(path)
+		server.server_close()
+		self.assertFalse(os.path.exists(path))
+		
+		
+	def test_not_socket(self):
+		"""
+		Should refuse to remove something that isn't a socket
+		"""
+		path = self.path + '.file'
+		open(path, 'w').close()
+		with self.assertRaises(Exception):
+			CacheServer(path)
+		self.assertTrue(os.path.isfile(path))
+		
+		
+	def test_default_path(self):
+		"""
+		The default socket is in a directory only the current user can access
+		"""
+		runtime_dir = os.environ.pop('XDG_RUNTIME_DIR', None)
+		tempdir = tempfile.tempdir
+		tempfile.tempdir = tempfile.mkdtemp()
+		try:
+			path = default_socket_path()
+			self.assertEquals(os.path.dirname(os.path.dirname(path)), tempfile.tempdir)
+			server = CacheServer()
+			try:
+				self.assertEquals(server.server_address, path)
+				self.assertEquals(stat.S_IMODE(os.stat(os.path.dirname(path)).st_mode), 0700)
+				cache = SocketCache()
+				self.assertEquals(cache.path, path)
+			finally:
+				server.server_close()
+			os.chmod(os.path.dirname(path), 0755)
+			with self.assertRaises(Exception):
+				CacheServer()
+		finally:
+			tempfile.tempdir = tempdir
+			if runtime_dir is not None:
+				os.environ['XDG_RUNTIME_DIR'] = runtime_dir
+			
+			
+	def test_unencodable(self):
+		class Foo(object):
+			pass
+		with self.assertRaises(CacheError):
+			self.cache.set('a', Foo())
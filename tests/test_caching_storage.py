@@ -0,0 +1,277 @@
+import unittest
+from mock import Mock
+from cellardoor.model import Model, Text
+from cellardoor.storage import Storage
+from cellardoor.storage.caching import CachingStorage
+from cellardoor.cache import CacheError, LRUCache
+
+
+model = Model(storage=Storage())
+
+
+class Foo(model.Entity):
+	name = Text()
+	
+	
+class Primate(model.Entity):
+	pass
+	
+	
+class Human(Primate):
+	pass
+	
+	
+
+class TestCachingStorage(unittest.TestCase):
+	
+	def setUp(self):
+		self.inner = Storage()
+		self.storage = CachingStorage(self.inner)
+		
+		
+	def test_get_by_id(self):
+		"""
+		Should only hit the wrapped storage the first time an item is fetched
+		"""
+		self.inner.get_by_id = Mock(return_value={'_id':'123', 'name':'foo'})
+		self.assertEquals(self.storage.get_by_id(Foo, '123'), {'_id':'123', 'name':'foo'})
+		self.assertEquals(self.storage.get_by_id(Foo, '123'), {'_id':'123', 'name':'foo'})
+		self.inner.get_by_id.assert_called_once_with(Foo, '123', fields=None, read_preference=None)
+		self.assertEquals(self.storage.stats()['hits'], 1)
+		self.assertEquals(self.storage.stats()['misses'], 1)
+		
+		
+	def test_get_by_id_copies(self):
+		"""
+		Modifying a returned item should not modify the cached item
+		"""
+		self.inner.get_by_id = Mock(return_value={'_id':'123', 'name':'foo'})
+		item = self.storage.get_by_id(Foo, '123')
+		item['name'] = 'bar'
+		self.assertEquals(self.storage.get_by_id(Foo, '123'), {'_id':'123', 'name':'foo'})
+		
+		
+	def test_get_by_id_fields(self):
+		"""
+		Items fetched with different fields are cached separately
+		"""
+		self.inner.get_by_id = Mock(return_value={'_id':'123'})
+		self.storage.get_by_id(Foo, '123', fields={})
+		self.storage.get_by_id(Foo, '123', fields={})
+		self.assertEquals(self.inner.get_by_id.call_count, 1)
+		self.storage.get_by_id(Foo, '123')
+		self.assertEquals(self.inner.get_by_id.call_count, 2)
+		
+		
+	def test_get_by_id_missing(self):
+		"""
+		Missing items are remembered until one is created with their id
+		"""
+		self.inner.get_by_id = Mock(return_value=None)
+		self.inner.create = Mock(return_value='123')
+		self.assertEquals(self.storage.get_by_id(Foo, '123'), None)
+		self.assertEquals(self.storage.get_by_id(Foo, '123'), None)
+		self.assertEquals(self.inner.get_by_id.call_count, 1)
+		
+		self.storage.create(Foo, {'_id':'123'})
+		self.inner.get_by_id = Mock(return_value={'_id':'123'})
+		self.assertEquals(self.storage.get_by_id(Foo, '123'), {'_id':'123'})
+		
+		
+	def test_get_by_id_missing_ttl(self):
+		"""
+		Missing items are only remembered for a short time, if at all
+		"""
+		clock = Mock(return_value=100)
+		storage = CachingStorage(self.inner, cache=LRUCache(clock=clock), negative_ttl=5)
+		self.inner.get_by_id = Mock(return_value=None)
+		storage.get_by_id(Foo, '123')
+		clock.return_value = 106
+		storage.get_by_id(Foo, '123')
+		self.assertEquals(self.inner.get_by_id.call_count, 2)
+		
+		storage = CachingStorage(self.inner, negative_ttl=0)
+		storage.get_by_id(Foo, '123')
+		storage.get_by_id(Foo, '123')
+		self.assertEquals(self.inner.get_by_id.call_count, 4)
+		
+		
+	def test_get_by_ids_missing(self):
+		"""
+		Ids that weren't found are not asked for again
+		"""
+		self.inner.get_by_ids = Mock(return_value=[{'_id':'1'}])
+		self.assertEquals(self.storage.get_by_ids(Foo, ['1', '2']), [{'_id':'1'}])
+		self.assertEquals(self.storage.get_by_ids(Foo, ['1', '2']), [{'_id':'1'}])
+		self.inner.get_by_ids.assert_called_once_with(Foo, ['1', '2'], fields=None, read_preference=None)
+		
+		
+	def test_invalid_id(self):
+		"""
+		Ids the wrapped storage says can't exist are never looked up
+		"""
+		self.inner.is_valid_id = Mock(side_effect=lambda entity, id: id != 'junk')
+		self.inner.get_by_id = Mock()
+		self.inner.get_by_ids = Mock(return_value=[{'_id':'1'}])
+		self.assertEquals(self.storage.get_by_id(Foo, 'junk'), None)
+		self.assertFalse(self.inner.get_by_id.called)
+		self.assertEquals(self.storage.get_by_ids(Foo, ['junk', '1']), [{'_id':'1'}])
+		self.inner.get_by_ids.assert_called_once_with(Foo, ['1'], fields=None, read_preference=None)
+		
+		
+	def test_get_by_ids(self):
+		"""
+		Should only fetch the items that aren't already cached
+		"""
+		self.inner.get_by_id = Mock(return_value={'_id':'1'})
+		self.storage.get_by_id(Foo, '1')
+		self.inner.get_by_ids = Mock(return_value=[{'_id':'3'}, {'_id':'2'}])
+		result = self.storage.get_by_ids(Foo, ['1', '2', '3', '2'])
+		self.inner.get_by_ids.assert_called_once_with(Foo, ['2', '3'], fields=None, read_preference=None)
+		self.assertEquals(result, [{'_id':'1'}, {'_id':'2'}, {'_id':'3'}])
+		
+		result = self.storage.get_by_ids(Foo, ['3', '1'])
+		self.assertEquals(result, [{'_id':'3'}, {'_id':'1'}])
+		self.assertEquals(self.inner.get_by_ids.call_count, 1)
+		
+		
+	def test_get_by_ids_query(self):
+		"""
+		Fetching ids with a filter or sort is cached as a query
+		"""
+		self.inner.get_by_ids = Mock(return_value=[{'_id':'2'}, {'_id':'1'}])
+		self.storage.get_by_ids(Foo, ['1', '2'], sort=('-name',))
+		result = self.storage.get_by_ids(Foo, ['1', '2'], sort=('-name',))
+		self.assertEquals(result, [{'_id':'2'}, {'_id':'1'}])
+		self.inner.get_by_ids.assert_called_once_with(Foo, ['1', '2'], 
+			filter=None, fields=None, sort=('-name',), offset=0, limit=0, count=False, read_preference=None)
+		
+		
+	def test_get(self):
+		"""
+		Equivalent queries should share a cached result
+		"""
+		self.inner.get = Mock(return_value=[{'_id':'1'}])
+		self.storage.get(Foo, filter={'name':'foo', 'x':{'$in':[1,2]}}, sort=['+name'])
+		result = self.storage.get(Foo, filter={'x':{'$in':[1,2]}, 'name':'foo'}, sort=('+name',))
+		self.assertEquals(result, [{'_id':'1'}])
+		self.assertEquals(self.inner.get.call_count, 1)
+		
+		self.storage.get(Foo, filter={'name':'foo'}, limit=10)
+		self.assertEquals(self.inner.get.call_count, 2)
+		
+		
+	def test_get_count(self):
+		self.inner.get = Mock(return_value=0)
+		self.assertEquals(self.storage.get(Foo, count=True), 0)
+		self.assertEquals(self.storage.get(Foo, count=True), 0)
+		self.assertEquals(self.inner.get.call_count, 1)
+		
+		
+	def test_update_invalidates(self):
+		"""
+		Updating an item evicts it and invalidates cached queries for its entity
+		"""
+		self.inner.get_by_id = Mock(return_value={'_id':'1', 'name':'foo'})
+		self.inner.get = Mock(return_value=[{'_id':'1', 'name':'foo'}])
+		self.inner.update = Mock(return_value={'_id':'1', 'name':'bar'})
+		self.storage.get_by_id(Foo, '1')
+		self.storage.get(Foo)
+		
+		self.storage.update(Foo, '1', {'name':'bar'})
+		self.inner.update.assert_called_once_with(Foo, '1', {'name':'bar'}, replace=False, operations=None, filter=None, version=None)
+		
+		self.storage.get_by_id(Foo, '1')
+		self.storage.get(Foo)
+		self.assertEquals(self.inner.get_by_id.call_count, 2)
+		self.assertEquals(self.inner.get.call_count, 2)
+		
+		
+	def test_create_invalidates(self):
+		self.inner.get = Mock(return_value=[])
+		self.inner.create = Mock(return_value='1')
+		self.storage.get(Foo)
+		self.assertEquals(self.storage.create(Foo, {'name':'foo'}), '1')
+		self.storage.get(Foo)
+		self.assertEquals(self.inner.get.call_count, 2)
+		
+		
+	def test_delete_invalidates(self):
+		self.inner.get_by_id = Mock(return_value={'_id':'1'})
+		self.inner.delete = Mock()
+		self.storage.get_by_id(Foo, '1')
+		self.storage.delete(Foo, '1')
+		self.inner.delete.assert_called_once_with(Foo, '1')
+		self.storage.get_by_id(Foo, '1')
+		self.assertEquals(self.inner.get_by_id.call_count, 2)
+		
+		
+	def test_invalidate_hierarchy(self):
+		"""
+		Writing to an entity invalidates the entities that share its collection
+		"""
+		self.inner.get_by_id = Mock(return_value={'_id':'1', '_type':'Primate.Human'})
+		self.inner.update = Mock()
+		self.storage.get_by_id(Primate, '1')
+		self.storage.update(Human, '1', {})
+		self.storage.get_by_id(Primate, '1')
+		self.assertEquals(self.inner.get_by_id.call_count, 2)
+		
+		
+	def test_write_during_read(self):
+		"""
+		An item read before a concurrent write finishes is not cached
+		"""
+		def get_by_id(entity, id, fields=None, read_preference=None):
+			self.storage.invalidate(entity, id)
+			return {'_id':'1'}
+		self.inner.get_by_id = Mock(side_effect=get_by_id)
+		self.storage.get_by_id(Foo, '1')
+		self.storage.get_by_id(Foo, '1')
+		self.assertEquals(self.inner.get_by_id.call_count, 2)
+		
+		
+	def test_write_during_set(self):
+		"""
+		An item set in the cache just after a concurrent write evicts it is taken back
+		"""
+		self.inner.get_by_id = Mock(return_value={'_id':'1'})
+		cache_set = self.storage.cache.set
+		def set(key, value, ttl=None):
+			self.storage.invalidate(Foo, '1')
+			cache_set(key, value, ttl=ttl)
+		self.storage.cache.set = Mock(side_effect=set)
+		self.storage.get_by_id(Foo, '1')
+		self.storage.cache.set = cache_set
+		self.storage.get_by_id(Foo, '1')
+		self.assertEquals(self.inner.get_by_id.call_count, 2)
+		
+		
+	def test_passthrough(self):
+		"""
+		Anything else is passed to the wrapped storage
+		"""
+		self.inner.check_filter = Mock()
+		self.inner.something_else = 'foo'
+		self.storage.check_filter({}, ('a',), {})
+		self.inner.check_filter.assert_called_once_with({}, ('a',), {})
+		self.assertEquals(self.storage.something_else, 'foo')
+		
+		
+	def test_cache_unavailable(self):
+		"""
+		Reads go straight to the wrapped storage when the cache fails
+		"""
+		cache = Mock()
+		cache.get = Mock(side_effect=CacheError)
+		cache.incr = Mock(side_effect=CacheError)
+		storage = CachingStorage(self.inner, cache=cache)
+		self.inner.get_by_id = Mock(return_value={'_id':'1'})
+		self.inner.get_by_ids = Mock(return_value=[{'_id':'1'}])
+		self.inner.get = Mock(return_value=[{'_id':'1'}])
+		self.inner.update = Mock()
+		self.assertEquals(storage.get_by_id(Foo, '1'), {'_id':'1'})
+		self.assertEquals(storage.get_by_ids(Foo, ['1']), [{'_id':'1'}])
+		self.assertEquals(storage.get(Foo), [{'_id':'1'}])
+		storage.update(Foo, '1', {})
+		self.inner.update.assert_called_once_with(Foo, '1', {}, replace=False, operations=None, filter=None, version=None)
@@ -0,0 +1,58 @@
+import unittest
+import zlib
+import gzip
+from cStringIO import StringIO
+from cellardoor.wsgi.compression import Compression
+
+
+class TestCompression(unittest.TestCase):
+	
+	def test_choose(self):
+		"""
+		Should choose the encoding the client prefers, then gzip over deflate
+		"""
+		compression = Compression()
+		self.assertEquals(compression.choose(None), None)
+		self.assertEquals(compression.choose('identity'), None)
+		self.assertEquals(compression.choose('gzip, deflate'), 'gzip')
+		self.assertEquals(compression.choose('deflate, gzip'), 'gzip')
+		self.assertEquals(compression.choose('gzip;q=0.5, deflate'), 'deflate')
+		self.assertEquals(compression.choose('GZIP; Q=0.5'), 'gzip')
+		self.assertEquals(compression.choose('gzip;q=0, deflate;q=0'), None)
+		self.assertEquals(compression.choose('*'), 'gzip')
+		self.assertEquals(compression.choose('gzip;q=0, *'), 'deflate')
+		self.assertEquals(compression.choose('br'), None)
+		
+		
+	def test_compress(self):
+		"""
+		Should compress with gzip or deflate at the configured level
+		"""
+		body = '[' + ', '.join(['{"name": "foo"}'] * 100) + ']'
+		compression = Compression(level=9)
+		compressed = compression.compress(body, 'gzip')
+		self.assertTrue(len(compressed) < len(body))
+		self.assertEquals(gzip.GzipFile(fileobj=StringIO(compressed)).read(), body)
+		self.assertEquals(zlib.decompress(compression.compress(body, 'deflate')), body)
+		
+		
+	def test_should_compress(self):
+		"""
+		Should only compress bodies of at least the minimum size
+		"""
+		compression = Compression(min_size=10)
+		self.assertFalse(compression.should_compress('123456789'))
+		self.assertTrue(compression.should_compress('1234567890'))
+		
+		
+	def test_compress_stream(self):
+		"""
+		Should flush each piece so it can be decompressed as it arrives
+		"""
+		compression = Compression()
+		pieces = compression.compress_stream(iter(['{"a": 1}\n', '{"b": 2}\n']), 'gzip')
+		decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+		self.assertEquals(decompressor.decompress(next(pieces)), '{"a": 1}\n')
+		self.assertEquals(decompressor.decompress(next(pieces)), '{"b": 2}\n')
+		self.assertEquals(decompressor.decompress(''.join(pieces)), '')
+		self.assertEquals(decompressor.flush(), '')
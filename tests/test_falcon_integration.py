@@ -1,14 +1,20 @@
 import unittest
 import json
+import zlib
 import msgpack
 from mock import Mock
 import urllib
 from falcon.testing import TestBase, create_environ
 import falcon
+from datetime import datetime
 from cellardoor import errors
 from cellardoor.api import API
-from cellardoor.wsgi.falcon_integration import FalconApp
-from cellardoor.model import Model, Entity, Text, Link, ListOf
+from cellardoor.wsgi.falcon_integration import FalconApp, Resource
+from cellardoor.wsgi.response_cache import ResponseCache
+from cellardoor.wsgi.single_flight import SingleFlight
+from cellardoor.wsgi.compression import Compression
+from cellardoor.views import MinimalView, NDJSONView
+from cellardoor.model import Model, Entity, Text, Link, ListOf, DateTime
 from cellardoor.storage import Storage
 from cellardoor.api.interface import ALL, LIST, GET, CREATE
 
@@ -34,6 +40,12 @@ class Bar(model.Entity):
 	
 class Baz(model.Entity):
 	pass
+	
+	
+class Doc(model.Entity):
+	versioned = True
+	title = Text()
+	published = DateTime()
 
 	
 class Foos(api.Interface):
@@ -56,6 +68,13 @@ class Bazes(api.Interface):
 	method_authorization = {
 		(LIST, GET, CREATE): None
 	}
+	
+	
+class Docs(api.Interface):
+	entity = Doc
+	method_authorization = {
+		ALL: None
+	}
 
 
 class TestResource(TestBase):
@@ -94,6 +113,20 @@ class TestResource(TestBase):
 		self.assertEquals(self.srmock.status, '415 Unsupported Media Type')
 		
 		
+	def test_create_fail_output_only(self):
+		"""
+		Create fails if the request body is in a type that can only be sent in responses
+		"""
+		serializer = Mock(mimetype='foo/bar', output_only=True)
+		Resource.accept_serializers = Resource.accept_serializers + (serializer,)
+		try:
+			self.simulate_request('/foos', method='POST', headers={'content-type': 'foo/bar'})
+		finally:
+			Resource.accept_serializers = Resource.accept_serializers[:-1]
+		self.assertEquals(self.srmock.status, '415 Unsupported Media Type')
+		self.assertFalse(serializer.unserialize.called)
+		
+		
 	def test_create_fail_validation(self):
 		"""
 		If validation fails, the response is a 400 error with the specific issues in the body.
@@ -165,6 +198,45 @@ class TestResource(TestBase):
 		api.interfaces['foos'].create.assert_called_with({'name':'foo'}, show_hidden=False, embedded=None, context={})
 		
 		
+	def test_create_many(self):
+		"""Posting an array creates its items as they're read from the body"""
+		read = []
+		def create_many(items, **kwargs):
+			for item in items:
+				read.append(item)
+			return len(read)
+		api.interfaces['foos'].create_many = Mock(side_effect=create_many)
+		result = self.simulate_request(
+			'/foos',
+			method='POST',
+			headers={
+				'accept': 'application/json',
+				'content-type': 'application/json'
+			},
+			body=json.dumps([{'name':'foo'}, {'name':'bar'}])
+		)
+		self.assertEquals(self.srmock.status, '201 Created')
+		self.assertEquals(self.srmock.headers_dict['x-count'], '2')
+		self.assertEquals(read, [{'name':'foo'}, {'name':'bar'}])
+		_, kwargs = api.interfaces['foos'].create_many.call_args
+		self.assertEquals(kwargs, {'chunk_size':100, 'context':{}})
+		
+		
+	def test_create_many_bad_parse(self):
+		"""If an array body can't be parsed part way through, the response is a 400 error"""
+		api.interfaces['foos'].create_many = Mock(side_effect=lambda items, **kwargs: list(items))
+		self.simulate_request(
+			'/foos',
+			method='POST',
+			headers={
+				'accept': 'application/json',
+				'content-type': 'application/json'
+			},
+			body='[{"name": "foo"}, }'
+		)
+		self.assertEquals(self.srmock.status, '400 Bad Request')
+		
+		
 	def test_not_found(self):
 		"""If a collection raises NotFoundError, a 404 status is returned"""
 		api.interfaces['foos'].get = Mock(side_effect=errors.NotFoundError())
@@ -232,6 +304,27 @@ class TestResource(TestBase):
 		api.interfaces['foos'].list.assert_called_with(sort=['+name'], filter={'foo':23}, offset=7, limit=10, show_hidden=True, embedded=None, context={})
 		
 		
+	def test_dates(self):
+		"""Dates are decoded for date fields in request bodies and filters"""
+		api.interfaces['docs'].create = Mock(return_value={'_id':'123'})
+		self.simulate_request(
+			'/docs',
+			method='POST',
+			headers={'accept':'application/json', 'content-type':'application/json'},
+			body=json.dumps({'title':{'_date':'2014-12-09T21:30:22.272Z'}, 'published':{'_date':'2014-12-09T21:30:22.272Z'}})
+		)
+		api.interfaces['docs'].create.assert_called_with(
+			{'title':{'_date':'2014-12-09T21:30:22.272Z'}, 'published':datetime(2014, 12, 9, 21, 30, 22, 272)},
+			show_hidden=False, embedded=None, context={})
+		
+		api.interfaces['docs'].list = Mock(return_value=[])
+		self.simulate_request('/docs', query_string=urllib.urlencode({
+			'filter':json.dumps({'published':{'$gt':{'_date':'2014-12-09T21:30:22.272Z'}}, 'title':{'_date':'x'}})
+		}))
+		self.assertEquals(api.interfaces['docs'].list.call_args[1]['filter'], 
+			{'published':{'$gt':datetime(2014, 12, 9, 21, 30, 22, 272)}, 'title':{'_date':'x'}})
+		
+		
 	def test_get(self):
 		"""A GET with a path to /collection/{id} calls colleciton.get"""
 		api.interfaces['foos'].get = Mock(return_value={'_id':'123', 'name':'foo'})
@@ -298,6 +391,240 @@ class TestResource(TestBase):
 		api.interfaces['foos'].replace.assert_called_with('123', {'name':'bar'}, show_hidden=False, embedded=None, context={})
 		
 		
+	def test_get_etag(self):
+		"""A GET is sent with an ETag, and a 304 if the client already has it"""
+		api.interfaces['foos'].get = Mock(return_value={'_id':'123', 'name':'foo'})
+		self.simulate_request('/foos/123', headers={'accept':'application/json'})
+		self.assertEquals(self.srmock.status, '200 OK')
+		etag = self.srmock.headers_dict['etag']
+		self.assertTrue(etag.startswith('W/"'))
+		
+		data = self.simulate_request('/foos/123', headers={'accept':'application/json', 'if-none-match':etag})
+		self.assertEquals(self.srmock.status, '304 Not Modified')
+		self.assertEquals(self.srmock.headers_dict['etag'], etag)
+		self.assertEquals(''.join(data), '')
+		
+		api.interfaces['foos'].get = Mock(return_value={'_id':'123', 'name':'bar'})
+		self.simulate_request('/foos/123', headers={'accept':'application/json', 'if-none-match':etag})
+		self.assertEquals(self.srmock.status, '200 OK')
+		
+		
+	def test_get_version_etag(self):
+		"""The ETag of a versioned item is made from its id and version, and checked before embedding links"""
+		api.interfaces['docs'].get = Mock(return_value={'_id':'123', 'title':'foo', '_version':3})
+		self.simulate_request('/docs/123', headers={'accept':'application/json'})
+		self.assertEquals(self.srmock.headers_dict['etag'], 'W/"123-3"')
+		# Every representation of the item has the same ETag
+		self.assertEquals(self.srmock.headers_dict['vary'], 'Accept')
+		
+		api.interfaces['docs'].get = Mock(return_value={'_id':'123', 'title':'foo', '_version':3})
+		self.simulate_request('/docs/123', headers={'accept':'application/json', 'if-none-match':'W/"123-3"'})
+		self.assertEquals(self.srmock.status, '304 Not Modified')
+		self.assertEquals(self.srmock.headers_dict['vary'], 'Accept')
+		api.interfaces['docs'].get.assert_called_once_with('123', allow_embedding=False, show_hidden=False, embedded=None, context={})
+		
+		
+	def test_get_version_etag_embedded(self):
+		"""An item with links to embed is never sent as not modified by its own version, and is only read once"""
+		docs = api.interfaces['docs']
+		docs.get = Mock(return_value={'_id':'123', 'title':'foo', '_version':3})
+		docs.embedded_links = Mock(return_value=set(['comments']))
+		docs.embed = Mock(return_value={'_id':'123', 'title':'foo', '_version':3, 'comments':[{'_id':'4', '_version':1}]})
+		try:
+			self.simulate_request('/docs/123', headers={'accept':'application/json', 'if-none-match':'W/"123-3"'})
+			self.assertEquals(self.srmock.status, '200 OK')
+			docs.get.assert_called_once_with('123', allow_embedding=False, show_hidden=False, embedded=None, context={})
+			docs.embed.assert_called_once_with(docs.get.return_value, show_hidden=False, embedded=None, context={})
+		finally:
+			del docs.embedded_links, docs.embed
+			
+			
+	def test_list_etag(self):
+		"""A list is sent with an ETag, and a 304 if the client already has it"""
+		api.interfaces['docs'].list = Mock(return_value=[{'_id':'1', '_version':1}, {'_id':'2', '_version':4}])
+		self.simulate_request('/docs', headers={'accept':'application/json'})
+		etag = self.srmock.headers_dict['etag']
+		self.simulate_request('/docs', headers={'accept':'application/json', 'if-none-match':etag})
+		self.assertEquals(self.srmock.status, '304 Not Modified')
+		
+		api.interfaces['docs'].list = Mock(return_value=[{'_id':'1', '_version':2}, {'_id':'2', '_version':4}])
+		self.simulate_request('/docs', headers={'accept':'application/json', 'if-none-match':etag})
+		self.assertEquals(self.srmock.status, '200 OK')
+		
+		
+	def test_response_cache(self):
+		"""Anonymous requests are answered from the response cache until the entity is written to"""
+		response_cache = ResponseCache()
+		app = falcon.API()
+		FalconApp(api, falcon_app=app, response_cache=response_cache)
+		self.api = app
+		api.interfaces['foos'].list = Mock(return_value=[{'_id':'123', 'name':'foo'}])
+		
+		data = self.simulate_request('/foos', headers={'accept':'application/json'})
+		self.assertEquals(json.loads(''.join(data)), [{'_id':'123', 'name':'foo'}])
+		data = self.simulate_request('/foos', headers={'accept':'application/json'})
+		self.assertEquals(self.srmock.status, '200 OK')
+		self.assertEquals(json.loads(''.join(data)), [{'_id':'123', 'name':'foo'}])
+		self.assertEquals(api.interfaces['foos'].list.call_count, 1)
+		etag = self.srmock.headers_dict['etag']
+		self.simulate_request('/foos', headers={'accept':'application/json', 'if-none-match':etag})
+		self.assertEquals(self.srmock.status, '304 Not Modified')
+		self.assertEquals(api.interfaces['foos'].list.call_count, 1)
+		
+		self.simulate_request('/foos', headers={'accept':'application/json'}, 
+			query_string=urllib.urlencode({'sort':json.dumps(['+name'])}))
+		self.assertEquals(api.interfaces['foos'].list.call_count, 2)
+		
+		response_cache.invalidate(Foo)
+		self.simulate_request('/foos', headers={'accept':'application/json'})
+		self.assertEquals(api.interfaces['foos'].list.call_count, 3)
+		
+		
+	def test_response_cache_identity(self):
+		"""Requests with an identity aren't cached"""
+		app = falcon.API()
+		FalconApp(api, falcon_app=app, response_cache=ResponseCache())
+		self.api = app
+		api.interfaces['foos'].get = Mock(return_value={'_id':'123', 'name':'foo'})
+		for i in range(2):
+			environ = create_environ('/foos/123', headers={'accept':'application/json'})
+			environ['cellardoor.identity'] = {'id':'bob'}
+			self.api(environ, lambda *args, **kwargs: [])
+		self.assertEquals(api.interfaces['foos'].get.call_count, 2)
+		
+		
+	def test_compression(self):
+		"""Responses are compressed for clients that accept it, and cached compressed"""
+		app = falcon.API()
+		response_cache = ResponseCache()
+		FalconApp(api, falcon_app=app, response_cache=response_cache, compression=Compression(min_size=100))
+		self.api = app
+		foos = [{'_id':str(i), 'name':'foo'} for i in range(20)]
+		api.interfaces['foos'].list = Mock(return_value=foos)
+		
+		for i in range(2):
+			data = self.simulate_request('/foos', headers={'accept':'application/json', 'accept-encoding':'gzip, deflate'})
+			self.assertEquals(self.srmock.status, '200 OK')
+			self.assertEquals(self.srmock.headers_dict['content-encoding'], 'gzip')
+			self.assertEquals(self.srmock.headers_dict['vary'], 'Accept, Accept-Encoding')
+			self.assertEquals(json.loads(zlib.decompress(''.join(data), 16 + zlib.MAX_WBITS)), foos)
+		self.assertEquals(api.interfaces['foos'].list.call_count, 1)
+		
+		data = self.simulate_request('/foos', headers={'accept':'application/json'})
+		self.assertFalse('content-encoding' in self.srmock.headers_dict)
+		self.assertEquals(json.loads(''.join(data)), foos)
+		
+		api.interfaces['foos'].get = Mock(return_value={'_id':'1', 'name':'foo'})
+		data = self.simulate_request('/foos/1', headers={'accept':'application/json', 'accept-encoding':'gzip'})
+		self.assertFalse('content-encoding' in self.srmock.headers_dict)
+		self.assertEquals(json.loads(''.join(data)), {'_id':'1', 'name':'foo'})
+		
+		
+	def test_compression_stream(self):
+		"""Streamed lists are compressed as they're sent"""
+		app = falcon.API()
+		FalconApp(api, falcon_app=app, views=(MinimalView, NDJSONView), compression=Compression())
+		self.api = app
+		api.interfaces['foos'].stream = Mock(return_value=iter([{'_id':'1', 'name':'foo'}]))
+		data = self.simulate_request('/foos', headers={'accept':'application/x-ndjson', 'accept-encoding':'deflate'})
+		self.assertEquals(self.srmock.headers_dict['content-encoding'], 'deflate')
+		self.assertEquals(json.loads(zlib.decompress(''.join(data))), {'_id':'1', 'name':'foo'})
+		
+		
+	def test_ndjson(self):
+		"""Lists are streamed a line per item to clients that accept NDJSON"""
+		app = falcon.API()
+		FalconApp(api, falcon_app=app, views=(MinimalView, NDJSONView), response_cache=ResponseCache())
+		self.api = app
+		api.interfaces['foos'].stream = Mock(return_value=iter([{'_id':'1', 'name':'foo'}, {'_id':'2', 'name':'bar'}]))
+		data = self.simulate_request('/foos', headers={'accept':'application/x-ndjson'}, query_string='limit=0')
+		self.assertEquals(self.srmock.status, '200 OK')
+		self.assertEquals(self.srmock.headers_dict['content-type'], 'application/x-ndjson')
+		self.assertFalse('etag' in self.srmock.headers_dict)
+		self.assertEquals([json.loads(line) for line in ''.join(data).splitlines()], [{'_id':'1', 'name':'foo'}, {'_id':'2', 'name':'bar'}])
+		api.interfaces['foos'].stream.assert_called_once_with(sort=None, filter=None, offset=0, limit=0, show_hidden=False, embedded=None, context={})
+		
+		
+	def test_single_flight(self):
+		"""Reads made through a single flight are sent as usual"""
+		app = falcon.API()
+		FalconApp(api, falcon_app=app, single_flight=SingleFlight())
+		self.api = app
+		api.interfaces['foos'].get = Mock(return_value={'_id':'123', 'name':'foo'})
+		data = self.simulate_request('/foos/123', headers={'accept':'application/json'})
+		self.assertEquals(self.srmock.status, '200 OK')
+		self.assertEquals(json.loads(''.join(data)), {'_id':'123', 'name':'foo'})
+		api.interfaces['foos'].get.assert_called_once_with('123', show_hidden=False, embedded=None, context={})
+		
+		self.simulate_request('/foos/123', headers={'accept':'application/json', 'if-none-match':self.srmock.headers_dict['etag']})
+		self.assertEquals(self.srmock.status, '304 Not Modified')
+		
+		api.interfaces['foos'].get = Mock(side_effect=errors.NotFoundError)
+		self.simulate_request('/foos/123', headers={'accept':'application/json'})
+		self.assertEquals(self.srmock.status, '404 Not Found')
+		
+		
+	def test_update_if_match(self):
+		"""The version in an If-Match header is passed on to the update"""
+		api.interfaces['foos'].update = Mock(return_value={'_id':'123', 'name':'bar'})
+		self.simulate_request(
+			'/foos/123', 
+			method='PATCH', 
+			headers={
+				'accept':'application/json',
+				'content-type': 'application/json',
+				'if-match': 'W/"123-4"'
+			},
+			body=json.dumps({'name':'bar'})
+			)
+		self.assertEquals(self.srmock.status, '200 OK')
+		api.interfaces['foos'].update.assert_called_with('123', {'name':'bar'}, show_hidden=False, embedded=None, context={}, version=4)
+		
+		
+	def test_update_version_conflict(self):
+		"""An update made against an old version is a 412 error"""
+		api.interfaces['foos'].replace = Mock(side_effect=errors.VersionConflictError({'_id':'123'}))
+		self.simulate_request(
+			'/foos/123', 
+			method='PUT', 
+			headers={
+				'accept':'application/json',
+				'content-type': 'application/json',
+				'if-match': '"3"'
+			},
+			body=json.dumps({'name':'bar'})
+			)
+		self.assertEquals(self.srmock.status, '412 Precondition Failed')
+		
+		
+	def test_update_if_match_body_etag(self):
+		"""An unversioned item's ETag in If-Match can't be checked, so the update fails"""
+		api.interfaces['foos'].get = Mock(return_value={'_id':'123', 'name':'foo'})
+		api.interfaces['foos'].update = Mock(return_value={'_id':'123', 'name':'bar'})
+		self.simulate_request('/foos/123', headers={'accept':'application/json'})
+		etag = self.srmock.headers_dict['etag']
+		
+		def patch(etag):
+			self.simulate_request(
+				'/foos/123', 
+				method='PATCH', 
+				headers={
+					'accept':'application/json',
+					'content-type': 'application/json',
+					'if-match': etag
+				},
+				body=json.dumps({'name':'bar'})
+				)
+				
+		patch(etag)
+		self.assertEquals(self.srmock.status, '412 Precondition Failed')
+		self.assertFalse(api.interfaces['foos'].update.called)
+		
+		patch('*')
+		self.assertEquals(self.srmock.status, '200 OK')
+		api.interfaces['foos'].update.assert_called_once_with('123', {'name':'bar'}, show_hidden=False, embedded=None, context={})
+		
+		
 	def test_delete(self):
 		"""A DELETE with a path to /collection/{id} calls collection.delete"""
 		api.interfaces['foos'].delete = Mock()
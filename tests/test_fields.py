@@ -887,6 +887,53 @@ class TestCompoundField(unittest.TestCase):
         self.assertEquals(result, {'foo':None})
         
         
+    def test_operations_pass(self):
+        """
+        Should pass atomic update operations on fields of the right kind
+        """
+        field = Compound(views=Integer(max=10), score=Float(), tags=ListOf(Text()), ids=ListOf(Integer()), note=Text())
+        result = field.validate_operations({
+            '$inc': {'views': 100, 'score': '0.5'},
+            '$push': {'tags': 'new'},
+            '$addToSet': {'ids': '5'},
+            '$unset': {'note': ''}
+        })
+        self.assertEquals(result, {
+            '$inc': {'views': 100, 'score': 0.5},
+            '$push': {'tags': 'new'},
+            '$addToSet': {'ids': 5},
+            '$unset': {'note': True}
+        })
+        self.assertEquals(field.validate_operations({'$pull': {'ids': 'anything'}}), {'$pull': {'ids': 'anything'}})
+        
+        
+    def test_operations_fail(self):
+        """
+        Should fail operations that don't fit the field they change
+        """
+        field = Compound(views=Integer(), tags=ListOf(Text()), name=Text(required=True))
+        bads = [
+            'not a dict',
+            {'$set': {'views': 1}},
+            {'$inc': 5},
+            {'$inc': {'views': 1.5}},
+            {'$inc': {'name': 1}},
+            {'$inc': {'views': None}},
+            {'$push': {'views': 1}},
+            {'$push': {'tags': 5}},
+            {'$pull': {'name': 'a'}},
+            {'$unset': {'name': ''}},
+            {'$unset': {'nothing': ''}},
+            {'$push': {'tags': 'a'}, '$pull': {'tags': 'b'}},
+        ]
+        for bad in bads:
+            self.assertRaises(ValidationError, field.validate_operations, bad)
+        
+        with self.assertRaises(CompoundValidationError) as cm:
+            field.validate_operations({'$inc': {'views': 1}}, {'views': 3})
+        self.assertEquals(cm.exception.errors, {'views': Compound.CONFLICTING_OPERATORS})
+        
+        
 class TestAnything(unittest.TestCase):
     
     def test_pass(self):
@@ -1,12 +1,17 @@
 import unittest
 import json
+import zlib
 import msgpack
 from mock import Mock
 import urllib
 from flask import Flask
 from cellardoor import errors
 from cellardoor.api import API
-from cellardoor.wsgi.flask_integration import create_blueprint
+from cellardoor.wsgi.flask_integration import create_blueprint, EntityResource
+from cellardoor.wsgi.response_cache import ResponseCache
+from cellardoor.wsgi.single_flight import SingleFlight
+from cellardoor.wsgi.compression import Compression
+from cellardoor.views import MinimalView, NDJSONView
 from cellardoor.model import Model, Entity, Text, Link, ListOf
 from cellardoor.storage import Storage
 from cellardoor.api.interface import ALL, LIST, GET, CREATE
@@ -27,6 +32,11 @@ class Bar(model.Entity):
 	
 class Baz(model.Entity):
 	pass
+	
+	
+class Doc(model.Entity):
+	versioned = True
+	title = Text()
 
 	
 class Foos(api.Interface):
@@ -49,6 +59,13 @@ class Bazes(api.Interface):
 	method_authorization = {
 		(LIST, GET, CREATE): None
 	}
+	
+	
+class Docs(api.Interface):
+	entity = Doc
+	method_authorization = {
+		ALL: None
+	}
 
 
 class TestResource(unittest.TestCase):
@@ -74,6 +91,20 @@ class TestResource(unittest.TestCase):
 		self.assertEquals(res.status.upper(), '415 Unsupported Media Type'.upper())
 		
 		
+	def test_create_fail_output_only(self):
+		"""
+		Create fails if the request body is in a type that can only be sent in responses
+		"""
+		serializer = Mock(mimetype='foo/bar', output_only=True)
+		EntityResource.accept_serializers = EntityResource.accept_serializers + (serializer,)
+		try:
+			res = self.app.post('/foos/', headers={'content-type': 'foo/bar'})
+		finally:
+			EntityResource.accept_serializers = EntityResource.accept_serializers[:-1]
+		self.assertEquals(res.status.upper(), '415 Unsupported Media Type'.upper())
+		self.assertFalse(serializer.unserialize.called)
+		
+		
 	def test_create_fail_validation(self):
 		"""
 		If validation fails, the response is a 400 error with the specific issues in the body.
@@ -141,6 +172,29 @@ class TestResource(unittest.TestCase):
 		api.interfaces['foos'].create.assert_called_with({'name':'foo'}, show_hidden=False, embedded=None, context={})
 		
 		
+	def test_create_many(self):
+		"""Posting an array creates its items as they're read from the body"""
+		read = []
+		def create_many(items, **kwargs):
+			for item in items:
+				read.append(item)
+			return len(read)
+		api.interfaces['foos'].create_many = Mock(side_effect=create_many)
+		res = self.app.post(
+			'/foos/',
+			headers={
+				'accept': 'application/x-msgpack',
+				'content-type': 'application/x-msgpack'
+			},
+			data=msgpack.packb([{'name':'foo'}, {'name':'bar'}])
+		)
+		self.assertEquals(res.status.upper(), '201 Created'.upper())
+		self.assertEquals(res.headers['X-Count'], '2')
+		self.assertEquals(read, [{'name':'foo'}, {'name':'bar'}])
+		_, kwargs = api.interfaces['foos'].create_many.call_args
+		self.assertEquals(kwargs, {'chunk_size':100, 'context':{}})
+		
+		
 	def test_not_found(self):
 		"""If a collection raises NotFoundError, a 404 status is returned"""
 		api.interfaces['foos'].get = Mock(side_effect=errors.NotFoundError())
@@ -269,6 +323,207 @@ class TestResource(unittest.TestCase):
 		api.interfaces['foos'].replace.assert_called_with('123', {'name':'bar'}, show_hidden=False, embedded=None, context={})
 		
 		
+	def test_get_etag(self):
+		"""A GET is sent with an ETag, and a 304 if the client already has it"""
+		api.interfaces['foos'].get = Mock(return_value={'_id':'123', 'name':'foo'})
+		res = self.app.get('/foos/123', headers={'accept':'application/json'})
+		self.assertEquals(res.status.upper(), '200 OK'.upper())
+		etag = res.headers['etag']
+		self.assertTrue(etag.startswith('W/"'))
+		
+		res = self.app.get('/foos/123', headers={'accept':'application/json', 'if-none-match':etag})
+		self.assertEquals(res.status.upper(), '304 Not Modified'.upper())
+		self.assertEquals(res.headers['etag'], etag)
+		self.assertEquals(res.data, '')
+		
+		api.interfaces['foos'].get = Mock(return_value={'_id':'123', 'name':'bar'})
+		res = self.app.get('/foos/123', headers={'accept':'application/json', 'if-none-match':etag})
+		self.assertEquals(res.status.upper(), '200 OK'.upper())
+		
+		
+	def test_get_version_etag(self):
+		"""The ETag of a versioned item is made from its id and version, and checked before embedding links"""
+		api.interfaces['docs'].get = Mock(return_value={'_id':'123', 'title':'foo', '_version':3})
+		res = self.app.get('/docs/123', headers={'accept':'application/json'})
+		self.assertEquals(res.headers['etag'], 'W/"123-3"')
+		# Every representation of the item has the same ETag
+		self.assertEquals(res.headers['vary'], 'Accept')
+		
+		api.interfaces['docs'].get = Mock(return_value={'_id':'123', 'title':'foo', '_version':3})
+		res = self.app.get('/docs/123', headers={'accept':'application/json', 'if-none-match':'W/"123-3"'})
+		self.assertEquals(res.status.upper(), '304 Not Modified'.upper())
+		self.assertEquals(res.headers['vary'], 'Accept')
+		api.interfaces['docs'].get.assert_called_once_with('123', allow_embedding=False, show_hidden=False, embedded=None, context={})
+		
+		
+	def test_get_version_etag_embedded(self):
+		"""An item with links to embed is never sent as not modified by its own version, and is only read once"""
+		docs = api.interfaces['docs']
+		docs.get = Mock(return_value={'_id':'123', 'title':'foo', '_version':3})
+		docs.embedded_links = Mock(return_value=set(['comments']))
+		docs.embed = Mock(return_value={'_id':'123', 'title':'foo', '_version':3, 'comments':[{'_id':'4', '_version':1}]})
+		try:
+			res = self.app.get('/docs/123', headers={'accept':'application/json', 'if-none-match':'W/"123-3"'})
+			self.assertEquals(res.status_code, 200)
+			docs.get.assert_called_once_with('123', allow_embedding=False, show_hidden=False, embedded=None, context={})
+			docs.embed.assert_called_once_with(docs.get.return_value, show_hidden=False, embedded=None, context={})
+		finally:
+			del docs.embedded_links, docs.embed
+			
+			
+	def test_list_etag(self):
+		"""A list is sent with an ETag, and a 304 if the client already has it"""
+		api.interfaces['docs'].list = Mock(return_value=[{'_id':'1', '_version':1}, {'_id':'2', '_version':4}])
+		res = self.app.get('/docs/', headers={'accept':'application/json'})
+		etag = res.headers['etag']
+		res = self.app.get('/docs/', headers={'accept':'application/json', 'if-none-match':etag})
+		self.assertEquals(res.status.upper(), '304 Not Modified'.upper())
+		
+		api.interfaces['docs'].list = Mock(return_value=[{'_id':'1', '_version':2}, {'_id':'2', '_version':4}])
+		res = self.app.get('/docs/', headers={'accept':'application/json', 'if-none-match':etag})
+		self.assertEquals(res.status.upper(), '200 OK'.upper())
+		
+		
+	def test_response_cache(self):
+		"""Anonymous requests are answered from the response cache until the entity is written to"""
+		response_cache = ResponseCache()
+		app = Flask(__name__)
+		app.register_blueprint(create_blueprint(api, response_cache=response_cache))
+		client = app.test_client()
+		api.interfaces['foos'].list = Mock(return_value=[{'_id':'123', 'name':'foo'}])
+		
+		res = client.get('/foos/', headers={'accept':'application/json'})
+		self.assertEquals(json.loads(res.data), [{'_id':'123', 'name':'foo'}])
+		res = client.get('/foos/', headers={'accept':'application/json'})
+		self.assertEquals(res.status.upper(), '200 OK'.upper())
+		self.assertEquals(json.loads(res.data), [{'_id':'123', 'name':'foo'}])
+		self.assertEquals(api.interfaces['foos'].list.call_count, 1)
+		res = client.get('/foos/', headers={'accept':'application/json', 'if-none-match':res.headers['etag']})
+		self.assertEquals(res.status.upper(), '304 Not Modified'.upper())
+		self.assertEquals(api.interfaces['foos'].list.call_count, 1)
+		
+		client.get('/foos/?%s' % urllib.urlencode({'sort':json.dumps(['+name'])}), headers={'accept':'application/json'})
+		self.assertEquals(api.interfaces['foos'].list.call_count, 2)
+		
+		response_cache.invalidate(Foo)
+		client.get('/foos/', headers={'accept':'application/json'})
+		self.assertEquals(api.interfaces['foos'].list.call_count, 3)
+		
+		
+	def test_compression(self):
+		"""Responses are compressed for clients that accept it, and cached compressed"""
+		response_cache = ResponseCache()
+		app = Flask(__name__)
+		app.register_blueprint(create_blueprint(api, views=(MinimalView, NDJSONView), response_cache=response_cache, 
+			compression=Compression(min_size=100)))
+		client = app.test_client()
+		foos = [{'_id':str(i), 'name':'foo'} for i in range(20)]
+		api.interfaces['foos'].list = Mock(return_value=foos)
+		
+		for i in range(2):
+			res = client.get('/foos/', headers={'accept':'application/json', 'accept-encoding':'gzip'})
+			self.assertEquals(res.headers['content-encoding'], 'gzip')
+			self.assertEquals(res.headers['vary'], 'Accept, Accept-Encoding')
+			self.assertEquals(json.loads(zlib.decompress(res.data, 16 + zlib.MAX_WBITS)), foos)
+		self.assertEquals(api.interfaces['foos'].list.call_count, 1)
+		
+		res = client.get('/foos/', headers={'accept':'application/json'})
+		self.assertFalse('content-encoding' in res.headers)
+		self.assertEquals(json.loads(res.data), foos)
+		
+		api.interfaces['foos'].stream = Mock(return_value=iter([{'_id':'1', 'name':'foo'}]))
+		res = client.get('/foos/', headers={'accept':'application/x-ndjson', 'accept-encoding':'deflate'})
+		self.assertEquals(res.headers['content-encoding'], 'deflate')
+		self.assertEquals(json.loads(zlib.decompress(res.data)), {'_id':'1', 'name':'foo'})
+		
+		
+	def test_ndjson(self):
+		"""Lists are streamed a line per item to clients that accept NDJSON"""
+		app = Flask(__name__)
+		app.register_blueprint(create_blueprint(api, views=(MinimalView, NDJSONView)))
+		client = app.test_client()
+		api.interfaces['foos'].stream = Mock(return_value=iter([{'_id':'1', 'name':'foo'}, {'_id':'2', 'name':'bar'}]))
+		res = client.get('/foos/', headers={'accept':'application/x-ndjson'})
+		self.assertEquals(res.status.upper(), '200 OK'.upper())
+		self.assertEquals(res.headers['content-type'], 'application/x-ndjson')
+		self.assertEquals([json.loads(line) for line in res.data.splitlines()], [{'_id':'1', 'name':'foo'}, {'_id':'2', 'name':'bar'}])
+		
+		
+	def test_single_flight(self):
+		"""Reads made through a single flight are sent as usual"""
+		app = Flask(__name__)
+		app.register_blueprint(create_blueprint(api, single_flight=SingleFlight()))
+		client = app.test_client()
+		api.interfaces['foos'].list = Mock(return_value=[{'_id':'123', 'name':'foo'}])
+		res = client.get('/foos/', headers={'accept':'application/json'})
+		self.assertEquals(res.status.upper(), '200 OK'.upper())
+		self.assertEquals(json.loads(res.data), [{'_id':'123', 'name':'foo'}])
+		
+		res = client.get('/foos/', headers={'accept':'application/json', 'if-none-match':res.headers['etag']})
+		self.assertEquals(res.status.upper(), '304 Not Modified'.upper())
+		
+		api.interfaces['foos'].list = Mock(side_effect=errors.NotFoundError)
+		res = client.get('/foos/', headers={'accept':'application/json'})
+		self.assertEquals(res.status.upper(), '404 Not Found'.upper())
+		
+		
+	def test_update_if_match(self):
+		"""The version in an If-Match header is passed on to the update"""
+		api.interfaces['foos'].update = Mock(return_value={'_id':'123', 'name':'bar'})
+		res = self.app.patch(
+			'/foos/123', 
+			headers={
+				'accept':'application/json',
+				'content-type': 'application/json',
+				'if-match': 'W/"123-4"'
+			},
+			data=json.dumps({'name':'bar'})
+		)
+		self.assertEquals(res.status.upper(), '200 OK'.upper())
+		api.interfaces['foos'].update.assert_called_with('123', {'name':'bar'}, show_hidden=False, embedded=None, context={}, version=4)
+		
+		
+	def test_update_version_conflict(self):
+		"""An update made against an old version is a 412 error"""
+		api.interfaces['foos'].replace = Mock(side_effect=errors.VersionConflictError({'_id':'123'}))
+		res = self.app.put(
+			'/foos/123', 
+			headers={
+				'accept':'application/json',
+				'content-type': 'application/json',
+				'if-match': '"3"'
+			},
+			data=json.dumps({'name':'bar'})
+		)
+		self.assertEquals(res.status.upper(), '412 Precondition Failed'.upper())
+		
+		
+	def test_update_if_match_body_etag(self):
+		"""An unversioned item's ETag in If-Match can't be checked, so the update fails"""
+		api.interfaces['foos'].get = Mock(return_value={'_id':'123', 'name':'foo'})
+		api.interfaces['foos'].update = Mock(return_value={'_id':'123', 'name':'bar'})
+		etag = self.app.get('/foos/123', headers={'accept':'application/json'}).headers['etag']
+		
+		def patch(etag):
+			return self.app.patch(
+				'/foos/123', 
+				headers={
+					'accept':'application/json',
+					'content-type': 'application/json',
+					'if-match': etag
+				},
+				data=json.dumps({'name':'bar'})
+			)
+			
+		res = patch(etag)
+		self.assertEquals(res.status.upper(), '412 Precondition Failed'.upper())
+		self.assertFalse(api.interfaces['foos'].update.called)
+		
+		res = patch('*')
+		self.assertEquals(res.status.upper(), '200 OK'.upper())
+		api.interfaces['foos'].update.assert_called_once_with('123', {'name':'bar'}, show_hidden=False, embedded=None, context={})
+		
+		
 	def test_delete(self):
 		"""A DELETE with a path to /collection/{id} calls collection.delete"""
 		api.interfaces['foos'].delete = Mock()
@@ -0,0 +1,103 @@
+import unittest
+import json
+import msgpack
+from mock import Mock
+from cellardoor.api.interface import PreparedItem
+from cellardoor.serializers import JSONSerializer, MsgPackSerializer
+from cellardoor.views import MinimalView
+from cellardoor.views.fragments import FragmentCache, fragment_key
+
+
+def prepared(entity_name, **fields):
+	item = PreparedItem(fields)
+	item.entity_name = entity_name
+	return item
+	
+	
+class TestFragmentKey(unittest.TestCase):
+	
+	def test_versioned(self):
+		"""Only prepared items with a version have keys"""
+		self.assertEquals(fragment_key({'_id':'1', '_version':1}), None)
+		self.assertEquals(fragment_key(prepared('Person', _id='1', name='Bob')), None)
+		self.assertNotEquals(fragment_key(prepared('Person', _id='1', _version=1)), None)
+		
+		
+	def test_personal(self):
+		"""Items read for an identity, or that embed one that was, don't have keys"""
+		person = prepared('Person', _id='1', _version=1)
+		person.personal = True
+		self.assertEquals(fragment_key(person), None)
+		self.assertEquals(fragment_key(prepared('Post', _id='2', _version=1, author=person)), None)
+		
+		
+	def test_changes(self):
+		"""The key changes with the version, the fields and any embedded items"""
+		author = prepared('Person', _id='1', _version=1, name='Bob')
+		post = prepared('Post', _id='2', _version=3, title='Hi', author=author)
+		key = fragment_key(post)
+		self.assertEquals(key, fragment_key(prepared('Post', _id='2', _version=3, title='Hi', author=author)))
+		self.assertNotEquals(key, fragment_key(prepared('Post', _id='2', _version=4, title='Hi', author=author)))
+		self.assertNotEquals(key, fragment_key(prepared('Post', _id='2', _version=3, author=author)))
+		self.assertNotEquals(key, fragment_key(prepared('Post', _id='2', _version=3, title='Hi', 
+			author=prepared('Person', _id='1', _version=2, name='Bob'))))
+		self.assertEquals(fragment_key(prepared('Post', _id='2', _version=3, title='Hi', 
+			author=prepared('Person', _id='1', name='Bob'))), None)
+		
+		comments = [prepared('Comment', _id='3', _version=1)]
+		key = fragment_key(prepared('Post', _id='2', _version=3, comments=comments))
+		comments.append(prepared('Comment', _id='4', _version=1))
+		self.assertNotEquals(key, fragment_key(prepared('Post', _id='2', _version=3, comments=comments)))
+		
+		
+		
+class TestFragmentCache(unittest.TestCase):
+	
+	def get_items(self):
+		return [prepared('Post', _id=str(i), _version=1, title='Post %d' % i, tags=['a', 'b']) for i in range(3)] + \
+			[{'_id':'x', 'title':'not prepared'}]
+			
+			
+	def test_serialize_list(self):
+		"""Lists put together from fragments are the same as lists serialized whole"""
+		fragment_cache = FragmentCache()
+		for content_type, serializer in (('application/json', JSONSerializer()), 
+										 ('application/json', JSONSerializer(compact=True)),
+										 ('application/x-msgpack', MsgPackSerializer())):
+			fragment_cache.cache.clear()
+			items = self.get_items()
+			expected = serializer.serialize(items)
+			self.assertEquals(fragment_cache.serialize_list(content_type, serializer, items), expected)
+			self.assertEquals(fragment_cache.serialize_list(content_type, serializer, items), expected)
+		self.assertEquals(fragment_cache.serialize_list('application/json', JSONSerializer(), []), '[]')
+		
+		
+	def test_cached(self):
+		"""Only items that aren't cached are serialized"""
+		fragment_cache = FragmentCache()
+		serializer = JSONSerializer()
+		serializer.serialize = Mock(side_effect=lambda obj: json.dumps(obj))
+		items = self.get_items()
+		fragment_cache.serialize_list('application/json', serializer, items)
+		self.assertEquals(serializer.serialize.call_count, 4)
+		serializer.serialize.reset_mock()
+		fragment_cache.serialize_list('application/json', serializer, items)
+		self.assertEquals(serializer.serialize.call_count, 1)
+		serializer.serialize.assert_called_once_with(items[3])
+		
+		serializer.serialize.reset_mock()
+		fragment_cache.serialize_list('application/x-ndjson', serializer, items[:1])
+		self.assertEquals(serializer.serialize.call_count, 1)
+		
+		
+	def test_view(self):
+		"""Views can take their items from a fragment cache"""
+		view = MinimalView(fragment_cache=FragmentCache())
+		items = self.get_items()
+		for i in range(2):
+			content_type, body = view.get_list_response('application/x-msgpack', items)
+			self.assertEquals(content_type, 'application/x-msgpack')
+			self.assertEquals(msgpack.unpackb(body), items)
+			content_type, body = view.get_individual_response('application/json', items[0])
+			self.assertEquals(json.loads(body), items[0])
+		self.assertEquals(view.fragment_cache.cache.stats()['hits'], 4)
@@ -0,0 +1,96 @@
+import unittest
+from cellardoor.storage.geo import GridIndex, distance, parse_box, parse_radius
+from cellardoor.model import CompoundValidationError
+
+
+class TestGeo(unittest.TestCase):
+	
+	def test_distance(self):
+		"""
+		Should get the great-circle distance in kilometres
+		"""
+		self.assertEquals(distance((0, 0), (0, 0)), 0)
+		self.assertAlmostEquals(distance((0, 0), (0, 1)), 111.19, places=1)
+		# London to Paris
+		self.assertAlmostEquals(distance((51.5074, -0.1278), (48.8566, 2.3522)), 343.5, delta=1)
+		
+		
+	def test_parse_box(self):
+		"""
+		Should parse a SWNE bounding box
+		"""
+		self.assertEquals(parse_box('37.73,-122.48,37.78,-122.37'), (37.73, -122.48, 37.78, -122.37))
+		with self.assertRaises(CompoundValidationError):
+			parse_box([1, 2, 3])
+		with self.assertRaises(CompoundValidationError):
+			parse_box(None)
+			
+			
+	def test_parse_radius(self):
+		"""
+		Should parse a center point and a radius
+		"""
+		self.assertEquals(parse_radius({'center':'37.76,-122.43', 'radius':'2.5'}), ((37.76, -122.43), 2.5))
+		for value in ({'center':[1, 2]}, {'center':[1, 2], 'radius':-1}, {'center':[1, 2], 'radius':'far'}, 
+			{'center':[500, 2], 'radius':1}, [1, 2, 3]):
+			with self.assertRaises(CompoundValidationError):
+				parse_radius(value)
+				
+				
+				
+class TestGridIndex(unittest.TestCase):
+	
+	def setUp(self):
+		self.index = GridIndex(cell_size=0.5)
+		self.index.add('mission', (37.7599, -122.4148))
+		self.index.add('castro', (37.7609, -122.4350))
+		self.index.add('oakland', (37.8044, -122.2712))
+		self.index.add('tokyo', (35.6762, 139.6503))
+		
+		
+	def test_within_box(self):
+		"""
+		Should find the points inside a box
+		"""
+		self.assertEquals(sorted(self.index.within_box((37.73, -122.48, 37.78, -122.37))), ['castro', 'mission'])
+		self.assertEquals(sorted(self.index.within_box((37.0, -123.0, 38.0, -122.0))), ['castro', 'mission', 'oakland'])
+		self.assertEquals(self.index.within_box((0, 0, 1, 1)), [])
+		
+		
+	def test_within_radius(self):
+		"""
+		Should find the points within a radius, nearest first
+		"""
+		self.assertEquals(self.index.within_radius((37.7600, -122.4140), 3), ['mission', 'castro'])
+		self.assertEquals(self.index.within_radius((37.7610, -122.4345), 20), ['castro', 'mission', 'oakland'])
+		self.assertEquals(self.index.within_radius((89.9, 0), 100), [])
+		
+		
+	def test_update(self):
+		"""
+		Adding a point again should move it, and removed points shouldn't be found
+		"""
+		self.index.add('castro', (35.6895, 139.6917))
+		self.assertEquals(self.index.within_radius((35.6762, 139.6503), 10), ['tokyo', 'castro'])
+		self.index.remove('tokyo')
+		self.index.remove('tokyo')
+		self.assertEquals(self.index.within_radius((35.6762, 139.6503), 10), ['castro'])
+		self.assertEquals(len(self.index), 3)
+		
+		
+	def test_many_points(self):
+		"""
+		Should find the same points as a scan
+		"""
+		index = GridIndex(cell_size=1)
+		points = {}
+		for i in range(-60, 60, 3):
+			for j in range(-170, 170, 7):
+				points[(i, j)] = (i + 0.25, j + 0.5)
+				index.add((i, j), points[(i, j)])
+		box = (-10.5, 20, 30, 80.2)
+		self.assertEquals(sorted(index.within_box(box)), 
+			sorted(k for k, p in points.items() if box[0] <= p[0] <= box[2] and box[1] <= p[1] <= box[3]))
+		center = (45, -100)
+		self.assertEquals(sorted(index.within_radius(center, 1500)), 
+			sorted(k for k, p in points.items() if distance(center, p) <= 1500))
@@ -0,0 +1,194 @@
+import json
+import unittest
+from mock import Mock
+from bson.objectid import ObjectId
+from cellardoor.model import Model, Text
+from cellardoor.storage import Storage
+from cellardoor.storage.instrumented import InstrumentedStorage, HistogramSink, LoggingSink, query_shape
+
+
+model = Model(storage=Storage())
+
+
+class Foo(model.Entity):
+	name = Text()
+	
+	
+	
+class FakeClock(object):
+	
+	def __init__(self, step):
+		self.now = 0
+		self.step = step
+		
+		
+	def __call__(self):
+		self.now += self.step
+		return self.now
+		
+		
+
+class TestInstrumentedStorage(unittest.TestCase):
+	
+	def setUp(self):
+		self.inner = Storage()
+		self.sink = Mock()
+		self.storage = InstrumentedStorage(self.inner, sink=self.sink, clock=FakeClock(0.5))
+		
+		
+	def test_get(self):
+		"""
+		Should record the time, number of documents and query shape of each call
+		"""
+		self.inner.get = Mock(return_value=[{'_id':'1'}, {'_id':'2'}])
+		result = self.storage.get(Foo, filter={'name':'foo'}, sort=('+name',), limit=10)
+		self.assertEquals(result, [{'_id':'1'}, {'_id':'2'}])
+		self.inner.get.assert_called_once_with(Foo, filter={'name':'foo'}, fields=None, sort=('+name',), 
+			offset=0, limit=10, count=False, read_preference=None)
+		self.sink.record.assert_called_once_with('Foo', 'get', 0.5, 2, 
+			'{"filter": {"name": "?"}, "limit": "?", "sort": ["+name"]}', error=False)
+		
+		
+	def test_count(self):
+		self.inner.get = Mock(return_value=5)
+		self.assertEquals(self.storage.get(Foo, count=True), 5)
+		self.sink.record.assert_called_once_with('Foo', 'count', 0.5, 0, '{}', error=False)
+		
+		
+	def test_get_by_id(self):
+		self.inner.get_by_id = Mock(return_value={'_id':'1'})
+		self.storage.get_by_id(Foo, '1')
+		self.sink.record.assert_called_once_with('Foo', 'get_by_id', 0.5, 1, '{"filter": {"_id": "?"}, "limit": "?"}', error=False)
+		
+		
+	def test_get_by_ids(self):
+		self.inner.get_by_ids = Mock(return_value=[])
+		self.storage.get_by_ids(Foo, ['1', '2'], fields={})
+		self.sink.record.assert_called_once_with('Foo', 'get_by_ids', 0.5, 0, '{"fields": [], "filter": {"_id": {"$in": "?"}}}', error=False)
+		
+		
+	def test_stored_ids(self):
+		"""
+		Recorded queries look ids up the way the wrapped storage stores them
+		"""
+		storage = InstrumentedStorage(self.inner, sink=self.sink, slow_query_threshold=0, clock=FakeClock(0.5))
+		storage.logger = Mock()
+		self.inner.is_valid_id = lambda entity, id: ObjectId.is_valid(id)
+		self.inner.stored_id = lambda entity, id: ObjectId(id)
+		self.inner.explain = Mock()
+		self.inner.get_by_id = Mock(return_value=None)
+		self.inner.get_by_ids = Mock(return_value=[])
+		id = '54d1c1d1a4e4a5c3f1b80001'
+		storage.get_by_id(Foo, id)
+		self.inner.explain.assert_called_with(Foo, filter={'_id':ObjectId(id)}, fields=None, limit=1)
+		storage.get_by_ids(Foo, [id, 'nope'], filter={'name':'foo'})
+		self.inner.explain.assert_called_with(Foo, filter={'name':'foo', '_id':{'$in':[ObjectId(id)]}}, 
+			fields=None, sort=None, offset=0, limit=0)
+		
+		
+	def test_error(self):
+		"""
+		Calls that raise are recorded with the error flag set
+		"""
+		self.inner.get = Mock(side_effect=ValueError)
+		with self.assertRaises(ValueError):
+			self.storage.get(Foo)
+		self.sink.record.assert_called_once_with('Foo', 'get', 0.5, 0, '{}', error=True)
+		
+		
+	def test_writes(self):
+		self.inner.create = Mock(return_value='1')
+		self.inner.update = Mock(return_value={'_id':'1'})
+		self.inner.delete = Mock()
+		self.assertEquals(self.storage.create(Foo, {}), '1')
+		self.sink.record.assert_called_with('Foo', 'create', 0.5, 0, None, error=False)
+		self.storage.update(Foo, '1', {}, replace=True)
+		self.sink.record.assert_called_with('Foo', 'replace', 0.5, 1, None, error=False)
+		self.storage.delete(Foo, '1')
+		self.sink.record.assert_called_with('Foo', 'delete', 0.5, 0, None, error=False)
+		
+		
+	def test_slow_query(self):
+		"""
+		Should log slow queries along with their explanation
+		"""
+		storage = InstrumentedStorage(self.inner, sink=self.sink, slow_query_threshold=1, clock=FakeClock(2))
+		storage.logger = Mock()
+		
+		def get(entity, filter=None, **kwargs):
+			filter['_type'] = 'modified'
+			return []
+		self.inner.get = Mock(side_effect=get)
+		self.inner.explain = Mock(return_value={'cursor':'BasicCursor'})
+		
+		storage.get(Foo, filter={'name':'foo'})
+		self.inner.explain.assert_called_once_with(Foo, filter={'name':'foo'}, fields=None, sort=None, offset=0, limit=0)
+		self.assertEquals(storage.logger.warning.call_count, 1)
+		self.assertIn('BasicCursor', storage.logger.warning.call_args[0][-1])
+		
+		
+	def test_fast_query(self):
+		storage = InstrumentedStorage(self.inner, sink=self.sink, slow_query_threshold=1, clock=FakeClock(0.1))
+		storage.logger = Mock()
+		self.inner.get = Mock(return_value=[])
+		self.inner.explain = Mock()
+		storage.get(Foo)
+		self.assertFalse(self.inner.explain.called)
+		self.assertFalse(storage.logger.warning.called)
+		
+		
+	def test_sink_failure(self):
+		"""
+		A failing sink doesn't break the storage call
+		"""
+		self.sink.record = Mock(side_effect=Exception)
+		self.storage.logger = Mock()
+		self.inner.get = Mock(return_value=[])
+		self.assertEquals(self.storage.get(Foo), [])
+		
+		
+		
+class TestHistogramSink(unittest.TestCase):
+	
+	def test_record(self):
+		sink = HistogramSink(buckets=(0.1, 1))
+		sink.record('Foo', 'get', 0.05, 2, 'a')
+		sink.record('Foo', 'get', 0.5, 3, 'a')
+		sink.record('Foo', 'get', 5, 0, 'b')
+		sink.record('Foo', 'create', 0.01, 0, None)
+		sink.record('Foo', 'create', 0.01, 0, None, error=True)
+		stats = sink.stats()
+		self.assertEquals(stats[('Foo', 'get')], {
+			'count': 3,
+			'total_time': 5.55,
+			'max_time': 5,
+			'documents': 5,
+			'errors': 0,
+			'histogram': [1, 1, 1],
+			'shapes': {'a': 2, 'b': 1}
+		})
+		self.assertEquals(stats[('Foo', 'create')]['shapes'], {})
+		self.assertEquals(stats[('Foo', 'create')]['errors'], 1)
+		
+		
+	def test_logging_sink(self):
+		logger = Mock()
+		LoggingSink(logger).record('Foo', 'get', 0.05, 2, 'a')
+		self.assertEquals(logger.debug.call_count, 1)
+		
+		
+		
+class TestQueryShape(unittest.TestCase):
+	
+	def test_query_shape(self):
+		"""
+		Queries that differ only by value have the same shape
+		"""
+		a = query_shape({'filter': {'a': 1, '$or': [{'b': 2}, {'c': {'$in': [1,2,3]}}]}, 'limit': 10})
+		b = query_shape({'filter': {'a': 5, '$or': [{'b': 6}, {'c': {'$in': [4]}}]}, 'limit': 20})
+		self.assertEquals(a, b)
+		self.assertEquals(json.loads(a), {
+			'filter': {'a': '?', '$or': [{'b': '?'}, {'c': {'$in': '?'}}]},
+			'limit': '?'
+		})
+		self.assertNotEquals(a, query_shape({'filter': {'a': 5}}))
@@ -4,8 +4,9 @@ from mock import Mock
 import random
 from cellardoor.model import Model, Entity, Link, InverseLink, Text, ListOf, Integer, Float, Enum
 from cellardoor.api import API
-from cellardoor.api.methods import ALL, LIST, GET, CREATE
-from cellardoor.storage import Storage
+from cellardoor.api.methods import ALL, LIST, GET, CREATE, UPDATE, REPLACE, COUNT
+from cellardoor.api.interface import PreparedItem
+from cellardoor.storage import Storage, PRIMARY, SECONDARY
 from cellardoor import errors
 from cellardoor.authorization import ObjectProxy
 
@@ -97,6 +98,23 @@ class AnyFunctionAuthModel(model.Entity):
 	pass
 	
 	
+class Replicated(model.Entity):
+	name = Text()
+	foo = Link(Foo, embeddable=True)
+	
+	
+class Counter(model.Entity):
+	owner = Text()
+	views = Integer()
+	tags = ListOf(Text())
+	
+	
+class Document(model.Entity):
+	versioned = True
+	title = Text()
+	views = Integer()
+	
+	
 class Foos(api.Interface):
 	entity = Foo
 	method_authorization = {
@@ -135,6 +153,7 @@ class Bazes(api.Interface):
 	enabled_sort = ('name',)
 	default_limit = 10
 	max_limit = 20
+	export_authorization = identity.role == 'exporter'
 
 	
 class Hiddens(api.Interface):
@@ -211,6 +230,41 @@ class CascadeReferrers(api.Interface):
 		ALL: None
 	}
 	
+	
+	
+class Replicateds(api.Interface):
+	entity = Replicated
+	method_authorization = {
+		ALL: None
+	}
+	read_preference = {
+		(LIST, GET): SECONDARY,
+		COUNT: PRIMARY
+	}
+	
+	
+class Counters(api.Interface):
+	entity = Counter
+	method_authorization = {
+		(LIST, GET, CREATE, REPLACE): None,
+		UPDATE: item.owner == identity.id
+	}
+	
+	
+class OddCounters(api.Interface):
+	entity = Counter
+	singular_name = 'oddcounter'
+	method_authorization = {
+		UPDATE: lambda context: context['item']['views'] % 2 == 1
+	}
+	
+
+class Documents(api.Interface):
+	entity = Document
+	method_authorization = {
+		ALL: None
+	}
+	
 
 auth_fn_get = Mock(return_value=False)
 auth_fn_list = Mock(return_value=True)
@@ -258,6 +312,64 @@ class InterfaceTest(unittest.TestCase):
 		self.assertEquals(foo, {'_id':'123', 'stuff':'foo'})
 		
 		
+	def test_prepared_item(self):
+		"""
+		Items are returned as prepared items that know their entity's collection.
+		"""
+		foos = self.get_interface('foos')
+		foos.storage.create = CopyingMock(return_value='123')
+		foo = foos.create({'stuff':'foo'})
+		self.assertTrue(isinstance(foo, PreparedItem))
+		self.assertEquals(foo.entity_name, 'Foo')
+		self.assertTrue(foo.entity is foos.entity)
+		self.assertFalse(foo.personal)
+		
+		foos.storage.get_by_id = Mock(return_value={'_id':'123', 'stuff':'foo'})
+		self.assertTrue(foos.get('123', context={'identity':{'id':'bob'}}).personal)
+		
+		
+	def test_prepared_list_items(self):
+		"""
+		The items of lists are only prepared if a view needs them to be.
+		"""
+		foos = self.get_interface('foos')
+		foos.storage.get = Mock(return_value=[{'_id':'123', 'stuff':'foo'}])
+		self.assertFalse(isinstance(foos.list()[0], PreparedItem))
+		api.prepare_list_items = True
+		try:
+			foos.storage.get = Mock(return_value=[{'_id':'123', 'stuff':'foo'}])
+			result = foos.list()
+		finally:
+			api.prepare_list_items = False
+		self.assertTrue(isinstance(result[0], PreparedItem))
+		self.assertEquals(result[0].entity_name, 'Foo')
+		
+		
+	def test_create_many(self):
+		"""
+		Creates items from an iterable a chunk at a time, validating each chunk before writing it.
+		"""
+		foos = self.get_interface('foos')
+		foos.storage.create = Mock(side_effect=lambda entity, fields: fields['stuff'])
+		foos.after_create = Mock()
+		try:
+			count = foos.create_many(({'stuff':'foo#%d' % i} for i in range(5)), chunk_size=2)
+			self.assertEquals(count, 5)
+			self.assertEquals(foos.storage.create.call_count, 5)
+			item = foos.after_create.call_args[0][1]
+			self.assertTrue(isinstance(item, PreparedItem))
+			self.assertEquals(item, {'_id':'foo#4', 'stuff':'foo#4'})
+		finally:
+			del foos.after_create
+		
+		foos.storage.create.reset_mock()
+		items = [{'stuff':'foo#0'}, {'stuff':'foo#1'}, {'stuff':'foo#2'}, {}]
+		with self.assertRaises(errors.CompoundValidationError) as cm:
+			foos.create_many(iter(items), chunk_size=2)
+		self.assertEquals(cm.exception.errors, {3: {'stuff':'This field is required.'}})
+		self.assertEquals(foos.storage.create.call_count, 2)
+		
+		
 	def test_list(self):
 		"""
 		Returns a list of created items
@@ -312,6 +424,132 @@ class InterfaceTest(unittest.TestCase):
 		self.assertEquals(updated_foo, foo)
 		
 		
+	def test_update_operations(self):
+		"""
+		Atomic operations are checked by the storage as part of the update, without reading the item first
+		"""
+		counters = self.get_interface('counters')
+		counters.storage.get_by_id = Mock()
+		counters.storage.update = Mock(return_value={'_id':'123', 'owner':'bob', 'views':2, 'tags':['a']})
+		
+		result = counters.update('123', {'$inc':{'views':1}, '$addToSet':{'tags':'a'}}, context={'identity':{'id':'bob'}})
+		self.assertEquals(result, {'_id':'123', 'owner':'bob', 'views':2, 'tags':['a']})
+		self.assertFalse(counters.storage.get_by_id.called)
+		counters.storage.update.assert_called_once_with(Counter, '123', {}, replace=False, 
+			operations={'$inc':{'views':1}, '$addToSet':{'tags':'a'}}, filter={'owner':'bob'})
+		
+		
+	def test_update_operations_with_fields(self):
+		"""Atomic operations can be mixed with fields"""
+		counters = self.get_interface('counters')
+		counters.storage.update = Mock(return_value={'_id':'123'})
+		counters.update('123', {'owner':'jim', '$unset':{'tags':True}}, bypass_authorization=True)
+		counters.storage.update.assert_called_once_with(Counter, '123', {'owner':'jim'}, replace=False, 
+			operations={'$unset':{'tags':True}})
+		
+		
+	def test_update_operations_invalid(self):
+		"""Invalid operations are rejected before anything is written"""
+		counters = self.get_interface('counters')
+		counters.storage.update = Mock()
+		with self.assertRaises(errors.CompoundValidationError):
+			counters.update('123', {'$inc':{'tags':1}}, context={'identity':{'id':'bob'}})
+		with self.assertRaises(errors.CompoundValidationError):
+			counters.replace('123', {'$inc':{'views':1}}, context={'identity':{'id':'bob'}})
+		self.assertFalse(counters.storage.update.called)
+		
+		
+	def test_update_not_a_dict(self):
+		"""Updates that aren't dicts are rejected as invalid"""
+		counters = self.get_interface('counters')
+		counters.storage.update = Mock()
+		for fields in (['a'], 'str', None):
+			with self.assertRaises(errors.CompoundValidationError):
+				counters.update('123', fields, bypass_authorization=True)
+		self.assertFalse(counters.storage.update.called)
+		
+		
+	def test_update_operations_conflicting_fields(self):
+		"""A field can't be both set and changed by an operator"""
+		counters = self.get_interface('counters')
+		counters.storage.update = Mock()
+		with self.assertRaises(errors.CompoundValidationError) as cm:
+			counters.update('123', {'views':3, '$inc':{'views':1}}, bypass_authorization=True)
+		self.assertTrue('views' in cm.exception.errors)
+		self.assertFalse(counters.storage.update.called)
+		
+		
+	def test_update_operations_not_authorized(self):
+		"""An item that exists but doesn't match the authorization filter isn't authorized"""
+		counters = self.get_interface('counters')
+		counters.storage.update = Mock(return_value=None)
+		counters.storage.get_by_id = Mock(return_value={'_id':'123', 'owner':'jim'})
+		with self.assertRaises(errors.NotAuthorizedError):
+			counters.update('123', {'$inc':{'views':1}}, context={'identity':{'id':'bob'}})
+		counters.storage.get_by_id = Mock(return_value=None)
+		with self.assertRaises(errors.NotFoundError):
+			counters.update('123', {'$inc':{'views':1}}, context={'identity':{'id':'bob'}})
+		with self.assertRaises(errors.NotAuthenticatedError):
+			counters.update('123', {'$inc':{'views':1}})
+		
+		
+	def test_update_operations_untranslatable_rule(self):
+		"""Rules that can't be turned into a filter are enforced by reading the item first"""
+		oddcounters = self.get_interface('oddcounters')
+		oddcounters.storage.get_by_id = Mock(return_value={'_id':'123', 'views':2})
+		oddcounters.storage.update = Mock()
+		with self.assertRaises(errors.NotAuthorizedError):
+			oddcounters.update('123', {'$inc':{'views':1}})
+		self.assertFalse(oddcounters.storage.update.called)
+		
+		oddcounters.storage.get_by_id = Mock(return_value={'_id':'123', 'views':3})
+		oddcounters.storage.update = Mock(return_value={'_id':'123', 'views':4})
+		oddcounters.update('123', {'$inc':{'views':1}})
+		oddcounters.storage.update.assert_called_once_with(Counter, '123', {}, replace=False, 
+			operations={'$inc':{'views':1}})
+		
+		
+	def test_update_version(self):
+		"""An update of a versioned entity can be made conditional on the version of the item"""
+		documents = self.get_interface('documents')
+		documents.storage.get_by_id = Mock(return_value={'_id':'123', 'title':'foo', '_version':2})
+		documents.storage.update = Mock(return_value={'_id':'123', 'title':'bar', '_version':3})
+		result = documents.update('123', {'title':'bar'}, version=2)
+		self.assertEquals(result, {'_id':'123', 'title':'bar', '_version':3})
+		documents.storage.update.assert_called_once_with(Document, '123', {'title':'bar'}, replace=False, version=2)
+		
+		
+	def test_update_version_conflict(self):
+		"""An update expecting an old version of an item fails without writing anything"""
+		documents = self.get_interface('documents')
+		documents.storage.get_by_id = Mock(return_value={'_id':'123', 'title':'foo', '_version':3})
+		documents.storage.update = Mock()
+		with self.assertRaises(errors.VersionConflictError) as cm:
+			documents.replace('123', {'title':'bar'}, version=2)
+		self.assertEquals(cm.exception.other, {'_id':'123', 'title':'foo', '_version':3})
+		self.assertFalse(documents.storage.update.called)
+		
+		
+	def test_update_operations_version(self):
+		"""Atomic updates leave checking the version to the storage"""
+		documents = self.get_interface('documents')
+		documents.storage.get_by_id = Mock()
+		documents.storage.update = Mock(return_value={'_id':'123', 'views':1, '_version':3})
+		documents.update('123', {'$inc':{'views':1}}, version=2)
+		self.assertFalse(documents.storage.get_by_id.called)
+		documents.storage.update.assert_called_once_with(Document, '123', {}, replace=False, 
+			operations={'$inc':{'views':1}}, version=2)
+		
+		
+	def test_update_version_not_versioned(self):
+		"""Only versioned entities can be updated by version"""
+		foos = self.get_interface('foos')
+		foos.storage.update = Mock()
+		with self.assertRaises(errors.NotVersionedError):
+			foos.update('123', {'stuff':'bar'}, version=1)
+		self.assertFalse(foos.storage.update.called)
+		
+		
 	def test_update_nonexistent(self):
 		"""
 		Trying to update a nonexistent item raises an error.
@@ -468,6 +706,28 @@ class InterfaceTest(unittest.TestCase):
 		self.assertEquals(linked_bazes, random_bazes)
 		
 		
+	def test_single_link_list_embedded(self):
+		"""
+		Embedded links are fetched together when listing items.
+		"""
+		foos = self.get_interface('foos')
+		bars = self.get_interface('bars', foos.storage)
+		bars.storage.get = Mock(return_value=[
+			{'_id':'1', 'embedded_foo':'123'},
+			{'_id':'2', 'embedded_foo':'456'},
+			{'_id':'3', 'embedded_foo':'123'},
+			{'_id':'4'}
+		])
+		foos.storage.get_by_id = Mock()
+		foos.storage.get_by_ids = Mock(return_value=[{'_id':'456', 'stuff':'b'}, {'_id':'123', 'stuff':'a'}])
+		
+		result = bars.list()
+		foos.storage.get_by_ids.assert_called_once_with(Foo, ['123', '456'])
+		self.assertFalse(foos.storage.get_by_id.called)
+		self.assertEquals([bar.get('embedded_foo') for bar in result], 
+			[{'_id':'123', 'stuff':'a'}, {'_id':'456', 'stuff':'b'}, {'_id':'123', 'stuff':'a'}, None])
+		
+		
 	def test_multiple_link_get_embedded(self):
 		"""
 		Embedded link list is included when fetching the referencing item.
@@ -594,6 +854,22 @@ class InterfaceTest(unittest.TestCase):
 		bars.storage.get.assert_called_once_with(Bar, sort=('+name',), filter=None, limit=0, offset=0, count=False)
 		
 		
+	def test_sort_default_search_after(self):
+		"""
+		The default sort isn't used for results after a text search cursor, which are in score order.
+		"""
+		bars = self.get_interface('bars')
+		bars.storage.get = Mock(return_value=[])
+		bars.storage.check_filter = Mock()
+		filter = {'$text':{'$search':'foo', '$after':[1.5, '123']}}
+		bars.list(filter=filter)
+		bars.storage.get.assert_called_once_with(Bar, sort=(), filter=filter, limit=0, offset=0, count=False)
+		
+		bars.storage.get.reset_mock()
+		bars.list(filter={'$text':{'$search':'foo'}})
+		bars.storage.get.assert_called_once_with(Bar, sort=('+name',), filter={'$text':{'$search':'foo'}}, limit=0, offset=0, count=False)
+		
+		
 	def test_auth_required_not_present(self):
 		"""Raise NotAuthenticatedError if authorization requires authentication and it is not present."""
 		with self.assertRaises(errors.NotAuthenticatedError):
@@ -783,6 +1059,45 @@ class InterfaceTest(unittest.TestCase):
 		bazes.storage.get.assert_called_once_with(Baz, sort=(), filter=None, offset=0, limit=20, count=False)
 		
 		
+	def test_max_limit_export(self):
+		"""Limit can exceed max_limit if the export authorization is met"""
+		bazes = self.get_interface('bazes')
+		bazes.storage.get = Mock(return_value=[])
+		bazes.list(limit=50, context={'identity':{'role':'exporter'}})
+		bazes.storage.get.assert_called_once_with(Baz, sort=(), filter=None, offset=0, limit=50, count=False)
+		
+		bazes.storage.get.reset_mock()
+		bazes.list(limit=50, context={'identity':{'role':'user'}})
+		bazes.storage.get.assert_called_once_with(Baz, sort=(), filter=None, offset=0, limit=20, count=False)
+		
+		
+	def test_stream(self):
+		"""Streams items from storage, preparing them a batch at a time"""
+		foos = self.get_interface('foos')
+		read = []
+		def iterate(*args, **kwargs):
+			for i in range(5):
+				read.append(i)
+				yield {'_id':str(i), 'stuff':'foo#%d' % i, 'secret':'shh'}
+		foos.storage.iterate = Mock(side_effect=iterate)
+		
+		items = foos.stream(batch_size=2)
+		foos.storage.iterate.assert_called_once_with(Foo, sort=(), filter=None, offset=0, limit=0)
+		self.assertEquals(read, [])
+		self.assertEquals(next(items), {'_id':'0', 'stuff':'foo#0'})
+		self.assertEquals(read, [0, 1])
+		self.assertEquals([item['_id'] for item in items], ['1', '2', '3', '4'])
+		
+		
+	def test_stream_authorization(self):
+		"""List rules are enforced before anything is streamed"""
+		hiddens = self.get_interface('hiddens')
+		hiddens.storage.iterate = Mock(return_value=iter([]))
+		with self.assertRaises(errors.NotAuthenticatedError):
+			hiddens.stream()
+		self.assertFalse(hiddens.storage.iterate.called)
+		
+		
 	def test_default_embedded_not_default(self):
 		"""A link can be embeddable but not embedded"""
 		foos = self.get_interface('foos')
@@ -810,6 +1125,20 @@ class InterfaceTest(unittest.TestCase):
 		foos.storage.get_by_ids.assert_called_once_with(Foo, ['1','2','3'], sort=(), filter=None, limit=0, offset=0, count=False)
 		
 		
+	def test_embed_later(self):
+		"""Links can be embedded in an item that was got without them, without reading it again"""
+		foos = self.get_interface('foos')
+		foos.storage.get_by_id = Mock(return_value={'_id':'123', 'embedded_foos':['2']})
+		foos.storage.get_by_ids = Mock(return_value=[{'_id':'2', 'stuff':123}])
+		item = foos.get('123', allow_embedding=False)
+		self.assertEquals(foos.embedded_links(item, embed=('embedded_foos',)), set(['embedded_foos']))
+		self.assertEquals(foos.embedded_links(item, embed=('embedded_foos',), allow_embedding=False), set())
+		
+		item = foos.embed(item, embed=('embedded_foos',))
+		self.assertEquals(item, {'_id':'123', 'embedded_foos':[{'_id':'2', 'stuff':123}]})
+		self.assertEquals(foos.storage.get_by_id.call_count, 1)
+		
+		
 	def test_embeddable_fields(self):
 		"""Only fields in an entity's embedded_fields list are included"""
 		foos = self.get_interface('foos')
@@ -827,6 +1156,25 @@ class InterfaceTest(unittest.TestCase):
 		self.assertEquals(result, {'_id':'123', 'optional_stuff':456})
 		
 		
+	def test_list_field_subset(self):
+		"""Only the fields asked for, and the links, are fetched when listing"""
+		foos = self.get_interface('foos')
+		foos.storage.get = Mock(return_value=[{'_id':'123', 'stuff':'foo'}])
+		result = foos.list(fields=('stuff',))
+		foos.storage.get.assert_called_once_with(Foo, sort=(), filter=None, limit=0, offset=0, count=False,
+			fields=['_type', '_version', 'bars', 'bazes', 'embedded_bazes', 'embedded_foos', 'stuff'])
+		self.assertEquals(result, [{'_id':'123', 'stuff':'foo'}])
+		
+		
+	def test_list_field_subset_item_rules(self):
+		"""Every field is fetched when listing if item rules have to check the items"""
+		planets = self.get_interface('planets')
+		planets.storage.get = Mock(return_value=[{'_id':'123', 'foo':23}])
+		result = planets.list(fields=())
+		planets.storage.get.assert_called_once_with(Planet, sort=(), filter=None, limit=0, offset=0, count=False)
+		self.assertEquals(result, [{'_id':'123'}])
+		
+		
 	def test_no_fields(self):
 		"""Only an item's ID is included if fields is an empty list"""
 		foos = self.get_interface('foos')
@@ -916,7 +1264,8 @@ class InterfaceTest(unittest.TestCase):
 		
 		targets.storage.get_by_id.assert_called_once_with(NullSingleTarget, '123')
 		targets.storage.delete.assert_called_once_with(NullSingleTarget, '123')
-		referrers.storage.get.assert_called_once_with(NullSingleReferrer, filter={'target':'123'}, count=False, sort=(), offset=0, limit=0)
+		referrers.storage.get.assert_called_once_with(NullSingleReferrer, filter={'target':'123'}, count=False, sort=(), offset=0, limit=0, read_preference=PRIMARY,
+			fields=['_type', '_version', 'target'])
 		referrers.storage.update.assert_called_once_with(NullSingleReferrer, '666', {'target':None}, replace=False)
 		
 		
@@ -933,12 +1282,11 @@ class InterfaceTest(unittest.TestCase):
 		
 		targets.delete('123')
 		
-		targets.storage.get_by_id.assert_any_call(NullMultiTarget, '123')
-		targets.storage.get_by_id.assert_any_call(NullMultiTarget, '555', fields={})
-		targets.storage.get_by_id.assert_any_call(NullMultiTarget, '888', fields={})
+		targets.storage.get_by_id.assert_called_once_with(NullMultiTarget, '123')
 		targets.storage.delete.assert_called_once_with(NullMultiTarget, '123')
-		referrers.storage.get.assert_called_once_with(NullMultiReferrer, filter={'targets':'123'}, count=False, sort=(), offset=0, limit=0)
-		referrers.storage.update.assert_called_once_with(NullMultiReferrer, '666', {'targets':['555', '888']}, replace=False)
+		referrers.storage.get.assert_called_once_with(NullMultiReferrer, filter={'targets':'123'}, count=False, sort=(), offset=0, limit=0, read_preference=PRIMARY,
+			fields=['_type', '_version', 'targets'])
+		referrers.storage.update.assert_called_once_with(NullMultiReferrer, '666', {}, replace=False, operations={'$pull':{'targets':'123'}})
 		
 		
 	def test_reverse_delete_cascade(self):
@@ -957,6 +1305,44 @@ class InterfaceTest(unittest.TestCase):
 		
 		targets.storage.get_by_id.assert_called_once_with(CascadeTarget, '123')
 		targets.storage.delete.assert_called_once_with(CascadeTarget, '123')
-		referrers.storage.get.assert_called_once_with(CascadeReferrer, filter={'target':'123'}, count=False, sort=(), offset=0, limit=0)
+		referrers.storage.get.assert_called_once_with(CascadeReferrer, filter={'target':'123'}, count=False, sort=(), offset=0, limit=0, read_preference=PRIMARY,
+			fields=['_type', '_version', 'target'])
 		referrers.storage.delete.assert_called_once_with(CascadeReferrer, '666')
-		
\ No newline at end of file
+		
+		
+	def test_read_preference(self):
+		"""Reads are routed using the interface's read preferences"""
+		replicateds = self.get_interface('replicateds')
+		replicateds.storage.get = Mock(return_value=[])
+		replicateds.list()
+		replicateds.storage.get.assert_called_once_with(Replicated, sort=(), filter=None, limit=0, offset=0, count=False, read_preference=SECONDARY)
+		
+		replicateds.storage.get = Mock(return_value=0)
+		replicateds.list(count=True)
+		replicateds.storage.get.assert_called_once_with(Replicated, sort=(), filter=None, limit=0, offset=0, count=True, read_preference=PRIMARY)
+		
+		replicateds.storage.get_by_id = Mock(return_value={'_id':'123'})
+		replicateds.get('123')
+		replicateds.storage.get_by_id.assert_called_once_with(Replicated, '123', read_preference=SECONDARY)
+		
+		
+	def test_read_preference_override(self):
+		"""The read preference can be set for a single call"""
+		replicateds = self.get_interface('replicateds')
+		replicateds.storage.get_by_id = Mock(return_value={'_id':'123'})
+		replicateds.get('123', read_preference=PRIMARY)
+		replicateds.storage.get_by_id.assert_called_once_with(Replicated, '123', read_preference=PRIMARY)
+		
+		
+	def test_read_your_writes(self):
+		"""Reads that follow a write in the same call use the primary"""
+		storage = Storage()
+		replicateds = self.get_interface('replicateds', storage)
+		foos = self.get_interface('foos', storage)
+		model.storage = storage
+		storage.create = Mock(return_value='123')
+		storage.get_by_id = Mock(return_value={'_id':'666', 'stuff':'foo'})
+		
+		item = replicateds.create({'name':'bar', 'foo':'666'})
+		self.assertEquals(item['foo'], {'_id':'666', 'stuff':'foo'})
+		storage.get_by_id.assert_called_with(Foo, '666', read_preference=PRIMARY)
@@ -0,0 +1,112 @@
+import unittest
+from copy import deepcopy
+from mock import Mock
+from cellardoor.model import Model, Text
+from cellardoor.storage import Storage, SECONDARY
+from cellardoor.storage.loader import Loader
+
+
+model = Model(storage=Storage())
+
+
+class Foo(model.Entity):
+	name = Text()
+	
+	
+	
+class TestLoader(unittest.TestCase):
+	
+	def setUp(self):
+		self.storage = Storage()
+		self.loader = Loader(self.storage)
+		
+		
+	def test_load_one(self):
+		"""
+		A single id is fetched with get_by_id
+		"""
+		self.storage.get_by_id = Mock(return_value={'_id':'1'})
+		self.assertEquals(self.loader.load(Foo, '1', read_preference=SECONDARY), {'_id':'1'})
+		self.storage.get_by_id.assert_called_once_with(Foo, '1', read_preference=SECONDARY)
+		
+		
+	def test_load_many(self):
+		"""
+		Should fetch ids once and return them in order, with None for missing items
+		"""
+		self.storage.get_by_ids = Mock(return_value=[{'_id':'3'}, {'_id':'1'}])
+		result = self.loader.load_many(Foo, ['1', '2', '3', '1'])
+		self.assertEquals(result, [{'_id':'1'}, None, {'_id':'3'}, {'_id':'1'}])
+		self.storage.get_by_ids.assert_called_once_with(Foo, ['1', '2', '3'])
+		
+		
+	def test_memoized(self):
+		"""
+		Items that were already loaded aren't fetched again
+		"""
+		self.storage.get_by_id = Mock(return_value=None)
+		self.storage.get_by_ids = Mock(return_value=[{'_id':'1'}, {'_id':'2'}])
+		self.loader.load_many(Foo, ['1', '2'])
+		self.assertEquals(self.loader.load(Foo, '2'), {'_id':'2'})
+		self.assertEquals(self.loader.load(Foo, '3'), None)
+		self.assertEquals(self.loader.load(Foo, '3'), None)
+		self.assertEquals(self.storage.get_by_ids.call_count, 1)
+		self.storage.get_by_id.assert_called_once_with(Foo, '3')
+		
+		
+	def test_prime(self):
+		"""
+		Primed ids are fetched together the first time one of them is loaded
+		"""
+		self.storage.get_by_id = Mock()
+		self.storage.get_by_ids = Mock(return_value=[{'_id':'1'}, {'_id':'2'}, {'_id':'3'}])
+		self.loader.prime(Foo, ['1', '2', None, '2'])
+		self.loader.prime(Foo, ['3'])
+		self.assertEquals(self.loader.load(Foo, '2'), {'_id':'2'})
+		self.assertEquals(self.loader.load(Foo, '1'), {'_id':'1'})
+		self.assertEquals(self.loader.load(Foo, '3'), {'_id':'3'})
+		self.storage.get_by_ids.assert_called_once_with(Foo, ['1', '2', '3'])
+		self.assertFalse(self.storage.get_by_id.called)
+		
+		
+	def test_fields(self):
+		"""
+		Loads with different fields are kept apart
+		"""
+		self.storage.get_by_id = Mock(side_effect=lambda entity, id, fields=None: {'_id':id} if fields == {} else {'_id':id, 'name':'foo'})
+		self.assertEquals(self.loader.load(Foo, '1', fields={}), {'_id':'1'})
+		self.assertEquals(self.loader.load(Foo, '1'), {'_id':'1', 'name':'foo'})
+		self.assertEquals(self.storage.get_by_id.call_count, 2)
+		
+		
+	def test_copies(self):
+		"""
+		Changing a loaded item doesn't change what later loads return
+		"""
+		self.storage.get_by_id = Mock(return_value={'_id':'1', 'name':'foo'})
+		item = self.loader.load(Foo, '1')
+		item['name'] = 'bar'
+		self.assertEquals(self.loader.load(Foo, '1'), {'_id':'1', 'name':'foo'})
+		
+		
+	def test_add(self):
+		self.storage.get_by_id = Mock()
+		self.loader.add(Foo, [{'_id':'1', 'name':'foo'}])
+		self.assertEquals(self.loader.load(Foo, '1'), {'_id':'1', 'name':'foo'})
+		self.assertFalse(self.storage.get_by_id.called)
+		
+		
+	def test_clear(self):
+		self.storage.get_by_id = Mock(return_value={'_id':'1'})
+		self.loader.load(Foo, '1')
+		self.loader.clear()
+		self.loader.load(Foo, '1')
+		self.assertEquals(self.storage.get_by_id.call_count, 2)
+		
+		
+	def test_deepcopy(self):
+		"""
+		A loader is shared, not copied, when the options holding it are copied
+		"""
+		options = deepcopy({'loader': self.loader})
+		self.assertIs(options['loader'], self.loader)
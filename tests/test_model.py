@@ -218,6 +218,17 @@ class TestModel(unittest.TestCase):
             Bar.get_link('foo')
             
             
+    def test_searchable_unknown_field(self):
+        """
+        Should raise an error if a searchable field doesn't exist
+        """
+        model = Model()
+        
+        with self.assertRaises(InvalidModelException):
+            class Foo(model.Entity):
+                searchable = {'title':10}
+                
+                
     def test_pass(self):
         """
         Should do nothing special when initialized with a well-defined model
@@ -286,6 +297,32 @@ class TestModel(unittest.TestCase):
         self.assertEquals(result, id)
         
         
+    def test_link_list_validation(self):
+        """
+        A list of links is checked with a single lookup
+        """
+        link = Link('foo')
+        link.model = Mock()
+        link.model.storage = Mock()
+        link.model.storage.get_by_ids = Mock(return_value=[{'_id':'1'}, {'_id':'2'}])
+        field = ListOf(link)
+        result = field.validate(['1', '2', '1'])
+        self.assertEquals(result, ['1', '2', '1'])
+        link.model.storage.get_by_ids.assert_called_once_with('foo', ['1', '2'], fields={})
+        
+        
+    def test_link_list_validation_unknown(self):
+        """
+        A validation error is raised if any item in a list of links doesn't exist
+        """
+        link = Link('foo')
+        link.model = Mock()
+        link.model.storage = Mock()
+        link.model.storage.get_by_ids = Mock(return_value=[{'_id':'1'}])
+        with self.assertRaises(ValidationError):
+            ListOf(link).validate(['1', '2'])
+        
+        
     def test_multiple_link(self):
         """
         A link is defined as a multiple link if it is a list of links or a multiple inverse link
@@ -1,9 +1,13 @@
 import unittest
+import math
+import pymongo
 from mock import Mock
 from datetime import datetime
 from cellardoor.model import *
 from cellardoor.storage.mongodb import MongoDBStorage
+from cellardoor.storage import SECONDARY
 from cellardoor import errors
+from bson.objectid import ObjectId
 
 
 storage = MongoDBStorage('test')
@@ -24,6 +28,27 @@ class Baz(model.Entity):
 	foo = TypeOf(int, unique=True)
 	
 	
+class Versioned(model.Entity):
+	versioned = True
+	a = Text()
+	
+	
+class Place(model.Entity):
+	name = Text()
+	location = LatLng()
+	
+	
+class Post(model.Entity):
+	searchable = {'title':10, 'body':1}
+	title = Text()
+	body = Text()
+	
+	
+class Review(Post):
+	searchable = dict(Post.searchable, verdict=5)
+	verdict = Text()
+	
+	
 class Primate(model.Entity):
 	pass
 	
@@ -192,11 +217,461 @@ class TestMongoDBStorage(unittest.TestCase):
 		st.db.Foo.find.assert_called_once_with(
 			spec={'$text': {'$search': 'foo'}},
 			fields={'score': {'$meta': 'textScore'}},
-			sort=[('score', {'$meta': 'textScore'})], 
+			sort=[('score', {'$meta': 'textScore'}), ('_id', 1)], 
+			skip=0, 
+			limit=0
+		)
+		
+		
+	def test_setup_geo_index(self):
+		"""
+		Should create a 2dsphere index for each LatLng field
+		"""
+		st = self.get_new_storage()
+		st.db.Place = Mock()
+		st.db.Place.index_information = Mock(return_value={})
+		st.setup(model)
+		st.db.Place.create_index.assert_called_once_with([('location', pymongo.GEOSPHERE)], background=False)
+		
+		
+	def test_setup_migrate_points(self):
+		"""
+		Should only go on with points that may be stored [lat, lng] if it's asked to swap them
+		"""
+		st = self.get_new_storage()
+		id = ObjectId()
+		st.db.cellardoor_meta = Mock()
+		st.db.cellardoor_meta.find_one = Mock(return_value=None)
+		st.db.Place = Mock()
+		st.db.Place.name = 'Place'
+		st.db.Place.index_information = Mock(return_value={})
+		st.db.Place.find_one = Mock(return_value={'_id':id})
+		st.db.Place.find = Mock(return_value=[{'_id':id, 'location':[37.76, -122.41]}])
+		with self.assertRaises(Exception):
+			st.setup(model)
+		self.assertFalse(st.db.Place.update.called)
+		
+		st.migrate_points = True
+		st.setup(model)
+		st.db.Place.update.assert_called_once_with({'_id':id}, {'$set':{'location':[-122.41, 37.76]}})
+		st.db.cellardoor_meta.insert.assert_called_once_with({'_id':'points.Place', 'order':'lat,lng'})
+		st.db.cellardoor_meta.update.assert_called_once_with({'_id':'points.Place'}, {'$set':{'order':'lng,lat'}})
+		self.assertEquals(st.setup_report['migrated'], ['Place'])
+		
+		st.db.Place.find_one = Mock(return_value=None)
+		st.setup(model)
+		st.db.cellardoor_meta.save.assert_called_once_with({'_id':'points.Place', 'order':'lng,lat'})
+		self.assertEquals(st.db.Place.update.call_count, 1)
+		
+		
+	def test_setup_existing_indexes(self):
+		"""
+		Should only create the indexes that don't exist yet, reading the existing ones once per collection
+		"""
+		st = self.get_new_storage()
+		st.db.Baz = Mock()
+		st.db.Baz.index_information = Mock(return_value={
+			'_id_': {'key':[('_id', 1)], 'v':1},
+			'foo_1': {'key':[('foo', 1)], 'unique':True, 'sparse':True, 'v':1}
+		})
+		st.db.Post = Mock()
+		st.db.Post.index_information = Mock(return_value={
+			'text': {'key':[('_fts', 'text'), ('_ftsx', 1)], 'weights':{'title':10, 'body':1, 'verdict':5}, 'v':1}
+		})
+		st.setup(model)
+		st.db.Baz.index_information.assert_called_once_with()
+		self.assertFalse(st.db.Baz.create_index.called)
+		self.assertFalse(st.db.Post.create_index.called)
+		self.assertEquals(st.unique_fields_by_index['foo_1'], 'foo')
+		self.assertTrue(st.setup_report['existing'] >= 2)
+		self.assertTrue(st.setup_report['seconds'] >= 0)
+		
+		
+	def test_setup_missing_indexes(self):
+		"""
+		Should create missing indexes, in the background if asked to
+		"""
+		st = self.get_new_storage()
+		st.background_indexes = True
+		st.db.Baz = Mock()
+		st.db.Baz.name = 'Baz'
+		st.db.Baz.index_information = Mock(return_value={'_id_': {'key':[('_id', 1)], 'v':1}})
+		st.db.Baz.create_index = Mock(return_value='foo_1')
+		st.setup(model)
+		st.db.Baz.create_index.assert_called_once_with([('foo', pymongo.ASCENDING)], unique=True, sparse=True, background=True)
+		self.assertEquals(st.unique_fields_by_index['foo_1'], 'foo')
+		self.assertTrue('Baz.foo_1' in st.setup_report['created'])
+		
+		
+	def test_setup_conflicting_indexes(self):
+		"""
+		Should leave an index with the same keys but different options alone
+		"""
+		st = self.get_new_storage()
+		st.db.Baz = Mock()
+		st.db.Baz.name = 'Baz'
+		st.db.Baz.index_information = Mock(return_value={'foo_1': {'key':[('foo', 1)], 'v':1}})
+		st.db.Post = Mock()
+		st.db.Post.name = 'Post'
+		st.db.Post.index_information = Mock(return_value={
+			'text': {'key':[('_fts', 'text'), ('_ftsx', 1)], 'weights':{'title':1}, 'v':1}
+		})
+		st.setup(model)
+		self.assertFalse(st.db.Baz.create_index.called)
+		self.assertFalse(st.db.Post.create_index.called)
+		self.assertEquals(sorted(st.setup_report['conflicts']), ['Baz.foo', 'Post.body'])
+		
+		
+	def test_get_filter_within_box(self):
+		"""
+		A $withinBox filter should find the points inside a SWNE bounding box
+		"""
+		st = self.get_new_storage()
+		st.db.Place = Mock()
+		st.db.Place.find = Mock(return_value=[])
+		st.get(Place, filter={'location':{'$withinBox':'37.73,-122.48,37.78,-122.37'}})
+		st.db.Place.find.assert_called_once_with(
+			spec={'location':{'$geoWithin':{'$box':[[-122.48, 37.73], [-122.37, 37.78]]}}},
+			fields=None,
+			sort=[],
+			skip=0,
+			limit=0
+		)
+		
+		
+	def test_get_filter_within_radius(self):
+		"""
+		A $withinRadius filter should find the points within a number of kilometres of a point
+		"""
+		st = self.get_new_storage()
+		st.db.Place = Mock()
+		st.db.Place.find = Mock(return_value=[])
+		st.get(Place, filter={'$or':[{'location':{'$withinRadius':{'center':[37.76, -122.43], 'radius':111.19}}}, {'name':'home'}]})
+		spec = st.db.Place.find.call_args[1]['spec']
+		center, radius = spec['$or'][0]['location']['$geoWithin']['$centerSphere']
+		self.assertEquals(center, [-122.43, 37.76])
+		self.assertAlmostEquals(radius, math.radians(1.0), places=4)
+		
+		with self.assertRaises(errors.CompoundValidationError):
+			st.get(Place, filter={'location':{'$withinRadius':{'center':[37.76, -122.43]}}})
+		with self.assertRaises(errors.CompoundValidationError):
+			st.get(Place, filter={'location':{'$withinBox':[37.73, -122.48, 37.78, -122.37], 
+				'$withinRadius':{'center':[37.76, -122.43], 'radius':1}}})
+			
+			
+	def test_points_stored_lng_lat(self):
+		"""
+		Points should be stored [lng, lat], the order geo queries take them in, and read back [lat, lng]
+		"""
+		st = self.get_new_storage()
+		st.db.Place = Mock()
+		st.db.Place.insert = Mock(return_value=ObjectId())
+		st.db.Place.find_one = Mock(return_value={'_id':ObjectId(), 'location':[-122.41, 37.76]})
+		fields = {'name':'Mission', 'location':(37.76, -122.41)}
+		id = st.create(Place, fields)
+		self.assertEquals(st.db.Place.insert.call_args[0][0]['location'], [-122.41, 37.76])
+		self.assertEquals(fields['location'], (37.76, -122.41))
+		self.assertEquals(st.get_by_id(Place, id)['location'], [37.76, -122.41])
+			
+			
+	def test_get_filter_points(self):
+		"""
+		Points matched by a filter should be swapped to [lng, lat] too
+		"""
+		st = self.get_new_storage()
+		st.db.Place = Mock()
+		st.db.Place.find = Mock(return_value=[])
+		st.get(Place, filter={'location':[37.76, -122.41], '$or':[{'location':{'$in':[(1, 2)], '$ne':[3, 4]}}, {'name':'home'}]})
+		self.assertEquals(st.db.Place.find.call_args[1]['spec'], 
+			{'location':[-122.41, 37.76], '$or':[{'location':{'$in':[[2, 1]], '$ne':[4, 3]}}, {'name':'home'}]})
+		
+		
+	def test_geo_query(self):
+		"""
+		Should find places by location
+		"""
+		mission = storage.create(Place, {'name':'Mission', 'location':(37.7599, -122.4148)})
+		castro = storage.create(Place, {'name':'Castro', 'location':(37.7609, -122.4350)})
+		storage.create(Place, {'name':'Oakland', 'location':(37.8044, -122.2712)})
+		
+		results = storage.get(Place, filter={'location':{'$withinBox':[37.73, -122.48, 37.78, -122.37]}}, sort=('+name',))
+		self.assertEquals([r['_id'] for r in results], [castro, mission])
+		
+		results = storage.get(Place, filter={'location':{'$withinRadius':{'center':[37.7600, -122.4140], 'radius':1}}})
+		self.assertEquals([r['_id'] for r in results], [mission])
+		self.assertEquals(results[0]['location'], [37.7599, -122.4148])
+		
+		# A degree of longitude is about 55km at 60 degrees north, so these are inside 60km
+		east = storage.create(Place, {'name':'East', 'location':(60.0, 11.0)})
+		west = storage.create(Place, {'name':'West', 'location':(60.0, 9.0)})
+		storage.create(Place, {'name':'North', 'location':(61.0, 10.0)})
+		results = storage.get(Place, filter={'location':{'$withinRadius':{'center':[60.0, 10.0], 'radius':60}}}, sort=('+name',))
+		self.assertEquals([r['_id'] for r in results], [east, west])
+		
+		results = storage.get(Place, filter={'location':[60.0, 9.0]})
+		self.assertEquals([r['_id'] for r in results], [west])
+		
+		
+	def test_get_filter_text_fields(self):
+		"""
+		A $text query should only return the fields asked for, along with the score
+		"""
+		st = self.get_new_storage()
+		st.db.Post = Mock()
+		st.db.Post.find = Mock(return_value=[])
+		st.get(Post, filter={'$text':{'$search':'foo'}}, fields=['title'], sort=('-title',))
+		st.db.Post.find.assert_called_once_with(
+			spec={'$text': {'$search': 'foo'}},
+			fields={'title':1, 'score': {'$meta': 'textScore'}},
+			sort=[('score', {'$meta': 'textScore'}), ('title', -1)], 
 			skip=0, 
 			limit=0
 		)
 		
+		# No fields gets every field, as if none were given
+		st.get(Post, filter={'$text':{'$search':'foo'}}, fields=[], sort=('-title',))
+		self.assertEquals(st.db.Post.find.call_args[1]['fields'], {'score': {'$meta': 'textScore'}})
+		
+		
+	def test_setup_text_index(self):
+		"""
+		Should create one weighted text index for the searchable fields of all the entities in a collection
+		"""
+		st = self.get_new_storage()
+		st.db.Post = Mock()
+		st.db.Post.index_information = Mock(return_value={})
+		st.setup(model)
+		st.db.Post.create_index.assert_called_once_with(
+			[('body', pymongo.TEXT), ('title', pymongo.TEXT), ('verdict', pymongo.TEXT)],
+			weights={'title':10, 'body':1, 'verdict':5},
+			name='text',
+			background=False
+		)
+		
+		
+	def test_get_filter_text_after(self):
+		"""
+		A $text query with a cursor should get the results after it in score order
+		"""
+		st = self.get_new_storage()
+		st.db.Post = Mock()
+		st.db.Post.aggregate = Mock(return_value=iter([{'_id':ObjectId('54d1c1d1a4e4a5c3f1b8e2a7'), 'title':'foo', 'score':1.0}]))
+		results = st.get(Post, filter={'$text':{'$search':'foo', '$after':[1.5, '54d1c1d1a4e4a5c3f1b8e2a6']}}, 
+			fields=['title'], limit=10)
+		st.db.Post.aggregate.assert_called_once_with([
+				{'$match':{'$text':{'$search':'foo'}}},
+				{'$project':{'title':1, 'score':{'$meta':'textScore'}}},
+				{'$match':{'$or':[{'score':{'$lt':1.5}}, {'score':1.5, '_id':{'$gt':ObjectId('54d1c1d1a4e4a5c3f1b8e2a6')}}]}},
+				{'$sort':{'score':-1, '_id':1}},
+				{'$limit':10}
+			], cursor={})
+		self.assertEquals(results, [{'_id':'54d1c1d1a4e4a5c3f1b8e2a7', 'title':'foo', 'score':1.0}])
+		
+		st.db.Post.aggregate = Mock(return_value=iter([{'_id':None, 'count':3}]))
+		self.assertEquals(st.get(Review, filter={'$text':{'$search':'foo', '$after':[1.5, 'abc']}}, count=True), 3)
+		pipeline = st.db.Post.aggregate.call_args[0][0]
+		self.assertEquals(pipeline[0], {'$match':{'$text':{'$search':'foo'}, '_type':{'$regex':'^Post\\.Review'}}})
+		self.assertEquals(pipeline[1], {'$project':{'doc':'$$ROOT', 'score':{'$meta':'textScore'}}})
+		self.assertEquals(pipeline[-1], {'$group':{'_id':None, 'count':{'$sum':1}}})
+		
+		with self.assertRaises(errors.CompoundValidationError):
+			st.get(Post, filter={'$text':{'$search':'foo', '$after':[1.5, 'abc']}}, sort=('+title',))
+		with self.assertRaises(errors.CompoundValidationError):
+			st.get(Post, filter={'$text':{'$search':'foo', '$after':'abc'}})
+			
+			
+	def test_search(self):
+		"""
+		Should page through search results by score
+		"""
+		for i in range(5):
+			storage.create(Post, {'title':'coffee' if i % 2 else 'tea', 'body':'coffee ' + 'and more ' * i})
+		storage.create(Post, {'title':'tea', 'body':'tea'})
+		
+		first = storage.get(Post, filter={'$text':{'$search':'coffee'}}, fields=['title'], limit=3)
+		self.assertEquals([r['title'] for r in first], ['coffee', 'coffee', 'tea'])
+		self.assertEquals(set(first[0].keys()), set(['_id', 'title', 'score']))
+		
+		after = [first[-1]['score'], first[-1]['_id']]
+		rest = storage.get(Post, filter={'$text':{'$search':'coffee', '$after':after}})
+		self.assertEquals(len(rest), 2)
+		self.assertTrue(all(r['score'] <= first[-1]['score'] for r in rest))
+		self.assertEquals(storage.get(Post, filter={'$text':{'$search':'coffee', '$after':after}}, count=True), 2)
+		
+		
+	def test_read_preference(self):
+		"""
+		Reads can be routed with a read preference
+		"""
+		st = self.get_new_storage()
+		st.db.Foo = Mock()
+		collection = Mock()
+		collection.find = Mock(return_value=[])
+		collection.find_one = Mock(return_value=None)
+		st.db.Foo.with_options = Mock(return_value=collection)
+		
+		st.get(Foo, read_preference=SECONDARY)
+		st.db.Foo.with_options.assert_called_once_with(read_preference=pymongo.ReadPreference.SECONDARY)
+		self.assertEquals(collection.find.call_count, 1)
+		
+		st.get_by_id(Foo, '123', read_preference=SECONDARY)
+		self.assertEquals(collection.find_one.call_count, 1)
+		
+		
+	def test_update_operations(self):
+		"""
+		Atomic operations are applied in a single guarded find and modify
+		"""
+		st = self.get_new_storage()
+		st.db.Foo = Mock()
+		st.db.Foo.find_and_modify = Mock(return_value={'_id':ObjectId('5486b79d3bd4f9e4b2ec2cf3')})
+		
+		st.update(Foo, '5486b79d3bd4f9e4b2ec2cf3', {'a':'one'}, 
+			operations={'$inc':{'b':1}, '$pull':{'c':'x'}, '$unset':{'d':True}}, 
+			filter={'a':'zero'})
+		st.db.Foo.find_and_modify.assert_called_once_with(
+			{'_id':ObjectId('5486b79d3bd4f9e4b2ec2cf3'), 'a':'zero'},
+			{'$set':{'a':'one'}, '$inc':{'b':1}, '$pull':{'c':'x'}, '$unset':{'d':''}},
+			new=True)
+		
+		
+	def test_update_operations_only(self):
+		"""
+		Shouldn't set anything when only atomic operations are given
+		"""
+		foo_id = storage.create(Foo, {'a':'one', 'b':1, 'c':['x', 'y']})
+		result = storage.update(Foo, foo_id, {}, operations={'$inc':{'b':2}, '$push':{'c':'z'}})
+		self.assertEquals(result, {'_id':foo_id, 'a':'one', 'b':3, 'c':['x', 'y', 'z']})
+		result = storage.update(Foo, foo_id, {}, operations={'$inc':{'b':2}}, filter={'a':'two'})
+		self.assertEquals(result, None)
+		
+		
+	def test_update_version(self):
+		"""
+		Versioned items are only updated if they are at the expected version, which is then incremented
+		"""
+		st = self.get_new_storage()
+		st.db.Versioned = Mock()
+		st.db.Versioned.find_and_modify = Mock(return_value={'_id':ObjectId('5486b79d3bd4f9e4b2ec2cf3'), 'a':'two', '_version':3})
+		
+		result = st.update(Versioned, '5486b79d3bd4f9e4b2ec2cf3', {'a':'two'}, version=2)
+		self.assertEquals(result, {'_id':'5486b79d3bd4f9e4b2ec2cf3', 'a':'two', '_version':3})
+		st.db.Versioned.find_and_modify.assert_called_once_with(
+			{'_id':ObjectId('5486b79d3bd4f9e4b2ec2cf3'), '_version':2},
+			{'$set':{'a':'two'}, '$inc':{'_version':1}},
+			new=True)
+		
+		
+	def test_update_version_conflict(self):
+		"""
+		Should raise a version conflict with the current item if it has another version
+		"""
+		st = self.get_new_storage()
+		st.db.Versioned = Mock()
+		st.db.Versioned.find_and_modify = Mock(return_value=None)
+		st.db.Versioned.find_one = Mock(return_value={'_id':ObjectId('5486b79d3bd4f9e4b2ec2cf3'), 'a':'one', '_version':3})
+		
+		with self.assertRaises(errors.VersionConflictError) as cm:
+			st.update(Versioned, '5486b79d3bd4f9e4b2ec2cf3', {'a':'two'}, version=2)
+		self.assertEquals(cm.exception.other, {'_id':'5486b79d3bd4f9e4b2ec2cf3', 'a':'one', '_version':3})
+		
+		st.db.Versioned.find_one = Mock(return_value=None)
+		result = st.update(Versioned, '5486b79d3bd4f9e4b2ec2cf3', {'a':'two'}, version=2)
+		self.assertEquals(result, None)
+		
+		
+	def test_replace_versioned(self):
+		"""
+		Replacing a versioned item swaps it in only if the version it replaces is still current
+		"""
+		st = self.get_new_storage()
+		st.db.Versioned = Mock()
+		st.db.Versioned.find_one = Mock(return_value={'_id':ObjectId('5486b79d3bd4f9e4b2ec2cf3'), '_version':4})
+		st.db.Versioned.find_and_modify = Mock(side_effect=[None, {'_id':ObjectId('5486b79d3bd4f9e4b2ec2cf3'), 'a':'two', '_version':5}])
+		
+		result = st.update(Versioned, '5486b79d3bd4f9e4b2ec2cf3', {'a':'two'}, replace=True)
+		self.assertEquals(result, {'_id':'5486b79d3bd4f9e4b2ec2cf3', 'a':'two', '_version':5})
+		self.assertEquals(st.db.Versioned.find_and_modify.call_count, 2)
+		st.db.Versioned.find_and_modify.assert_called_with(
+			{'_id':ObjectId('5486b79d3bd4f9e4b2ec2cf3'), '_version':4},
+			{'a':'two', '_version':5},
+			new=True)
+		
+		# Without a version, it isn't a conflict however often it's changed first
+		st.db.Versioned.find_and_modify = Mock(side_effect=[None] * 5 + [{'_id':ObjectId('5486b79d3bd4f9e4b2ec2cf3'), 'a':'two', '_version':5}])
+		result = st.update(Versioned, '5486b79d3bd4f9e4b2ec2cf3', {'a':'two'}, replace=True)
+		self.assertEquals(result['_version'], 5)
+		self.assertEquals(st.db.Versioned.find_and_modify.call_count, 6)
+		
+		
+	def test_create_versioned(self):
+		"""
+		Items of versioned entities start at version 1
+		"""
+		st = self.get_new_storage()
+		st.db.Versioned = Mock()
+		st.db.Versioned.insert = Mock(return_value=ObjectId('5486b79d3bd4f9e4b2ec2cf3'))
+		fields = {'a':'one'}
+		st.create(Versioned, fields)
+		st.db.Versioned.insert.assert_called_once_with({'a':'one', '_version':1})
+		
+		
+	def test_is_valid_id(self):
+		"""
+		Should reject ids that can't belong to an item without querying for them
+		"""
+		st = self.get_new_storage()
+		st.db.Foo = Mock()
+		st.db.Foo.find_one = Mock()
+		self.assertEquals(st.get_by_id(Foo, ''), None)
+		self.assertEquals(st.get_by_id(Foo, None), None)
+		self.assertFalse(st.db.Foo.find_one.called)
+		self.assertTrue(st.is_valid_id(Foo, 'custom'))
+		
+		st.object_ids_only = True
+		self.assertFalse(st.is_valid_id(Foo, 'custom'))
+		self.assertTrue(st.is_valid_id(Foo, '5486b79d3bd4f9e4b2ec2cf3'))
+		self.assertTrue(st.is_valid_id(Foo, ObjectId('5486b79d3bd4f9e4b2ec2cf3')))
+		self.assertEquals(st.get_by_ids(Foo, ['custom', 'junk']), [])
+		
+		
+	def test_explain(self):
+		"""
+		Should explain how a query would be run
+		"""
+		st = self.get_new_storage()
+		st.db.Foo = Mock()
+		cursor = Mock()
+		cursor.explain = Mock(return_value={'cursor':'BasicCursor'})
+		st.db.Foo.find = Mock(return_value=cursor)
+		
+		result = st.explain(Foo, filter={'a':'one'}, sort=('-a',), limit=5)
+		self.assertEquals(result, {'cursor':'BasicCursor'})
+		st.db.Foo.find.assert_called_once_with(spec={'a':'one'}, fields=None, sort=[('a', -1)], skip=0, limit=5)
+		
+		
+	def test_iterate(self):
+		"""
+		Should read items from the cursor as they're needed
+		"""
+		st = self.get_new_storage()
+		st.db.Foo = Mock()
+		read = []
+		def documents():
+			for i in range(3):
+				read.append(i)
+				yield {'_id':ObjectId(), 'a':i}
+		st.db.Foo.find = Mock(return_value=documents())
+		
+		items = st.iterate(Foo, filter={'a':{'$gt':-1}}, sort=('+a',))
+		st.db.Foo.find.assert_called_once_with(spec={'a':{'$gt':-1}}, fields=None, sort=[('a', 1)], skip=0, limit=0)
+		self.assertEquals(read, [])
+		item = next(items)
+		self.assertEquals(item['a'], 0)
+		self.assertTrue(isinstance(item['_id'], basestring))
+		self.assertEquals(read, [0])
+		self.assertEquals([item['a'] for item in items], [1, 2])
+		
 		
 	def test_get_fields(self):
 		"""
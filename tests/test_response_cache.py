@@ -0,0 +1,149 @@
+import unittest
+from mock import Mock
+from cellardoor.model import Model, Text, Link
+from cellardoor.api import API
+from cellardoor.api.methods import ALL, LIST, GET
+from cellardoor.storage import Storage
+from cellardoor.cache import CacheError
+from cellardoor.wsgi.response_cache import ResponseCache
+
+
+model = Model(storage=Storage())
+api = API(model)
+
+
+class Foo(model.Entity):
+	name = Text()
+	bar = Link('Bar')
+	
+	
+class Bar(model.Entity):
+	pass
+	
+	
+class Baz(model.Entity):
+	pass
+	
+	
+class Primate(model.Entity):
+	pass
+	
+	
+class Human(Primate):
+	foo = Link(Foo)
+	
+	
+class Foos(api.Interface):
+	entity = Foo
+	method_authorization = {
+		ALL: None
+	}
+	
+	
+class Humans(api.Interface):
+	entity = Human
+	method_authorization = {
+		ALL: None
+	}
+	
+	
+	
+class TestResponseCache(unittest.TestCase):
+
+	def setUp(self):
+		self.response_cache = ResponseCache()
+		self.inner = Storage()
+		self.storage = self.response_cache.track(self.inner)
+		
+		
+	def cache_response(self, interface, method, params):
+		key = self.response_cache.key(interface, method, params, 'application/json')
+		self.response_cache.set(key, 'application/json', '[]', 'W/"abc"')
+		
+		
+	def get_response(self, interface, method, params):
+		key = self.response_cache.key(interface, method, params, 'application/json')
+		return self.response_cache.get(key)
+		
+		
+	def test_get(self):
+		"""
+		Should get a cached response by the parameters of its request
+		"""
+		self.cache_response(api.interfaces['foos'], LIST, {'context':{}, 'sort':['+name']})
+		self.assertEquals(self.get_response(api.interfaces['foos'], LIST, {'context':{}, 'sort':['+name']}),
+			('application/json', '[]', 'W/"abc"'))
+		self.assertEquals(self.get_response(api.interfaces['foos'], LIST, {'context':{}, 'sort':['-name']}), None)
+		self.assertEquals(self.get_response(api.interfaces['foos'], GET, {'context':{}, 'sort':['+name']}), None)
+		
+		
+	def test_encoding(self):
+		"""
+		Should cache compressed responses alongside uncompressed ones
+		"""
+		key = self.response_cache.key(api.interfaces['foos'], LIST, {'context':{}}, 'application/json')
+		self.response_cache.set(key, 'application/json', '[]', 'W/"abc"')
+		self.assertEquals(self.response_cache.get(key, 'gzip'), None)
+		self.response_cache.set(key, 'application/json', 'compressed', 'W/"abc"', 'gzip')
+		self.assertEquals(self.response_cache.get(key, 'gzip'), ('application/json', 'compressed', 'W/"abc"'))
+		self.assertEquals(self.response_cache.get(key), ('application/json', '[]', 'W/"abc"'))
+		
+		
+	def test_identity(self):
+		"""
+		Requests with an identity aren't cached
+		"""
+		key = self.response_cache.key(api.interfaces['foos'], LIST, {'context':{'identity':{'id':'123'}}}, 'application/json')
+		self.assertEquals(key, None)
+		
+		
+	def test_invalidate_write(self):
+		"""
+		Writing to an entity should invalidate its responses
+		"""
+		self.inner.update = Mock()
+		self.cache_response(api.interfaces['foos'], LIST, {'context':{}})
+		self.storage.update(Foo, '123', {'name':'foo'})
+		self.inner.update.assert_called_once_with(Foo, '123', {'name':'foo'}, replace=False, operations=None, filter=None, version=None)
+		self.assertEquals(self.get_response(api.interfaces['foos'], LIST, {'context':{}}), None)
+		
+		
+	def test_invalidate_linked(self):
+		"""
+		Writing to an entity should invalidate the responses of entities that link to it
+		"""
+		self.inner.create = Mock(return_value='123')
+		self.inner.delete = Mock()
+		
+		self.cache_response(api.interfaces['foos'], LIST, {'context':{}})
+		self.assertEquals(self.storage.create(Bar, {}), '123')
+		self.assertEquals(self.get_response(api.interfaces['foos'], LIST, {'context':{}}), None)
+		
+		self.cache_response(api.interfaces['foos'], LIST, {'context':{}})
+		self.storage.delete(Baz, '123')
+		self.assertNotEquals(self.get_response(api.interfaces['foos'], LIST, {'context':{}}), None)
+		
+		
+	def test_invalidate_hierarchy(self):
+		"""
+		Writing to any entity in a hierarchy should invalidate the responses of all of them
+		"""
+		self.inner.create = Mock(return_value='123')
+		self.cache_response(api.interfaces['humans'], GET, {'context':{}, 'id':'123'})
+		self.storage.create(Primate, {})
+		self.assertEquals(self.get_response(api.interfaces['humans'], GET, {'context':{}, 'id':'123'}), None)
+		
+		
+	def test_cache_error(self):
+		"""
+		Should skip the cache if it can't be reached
+		"""
+		cache = Mock()
+		cache.counter = Mock(side_effect=CacheError)
+		cache.incr = Mock(side_effect=CacheError)
+		response_cache = ResponseCache(cache=cache)
+		self.assertEquals(response_cache.key(api.interfaces['foos'], LIST, {'context':{}}, 'application/json'), None)
+		self.inner.delete = Mock()
+		response_cache.track(self.inner).delete(Foo, '123')
+		self.inner.delete.assert_called_once_with(Foo, '123')
+		
\ No newline at end of file
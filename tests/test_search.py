@@ -0,0 +1,77 @@
+import unittest
+from cellardoor.storage.search import InvertedIndex, parse_after
+from cellardoor.model import CompoundValidationError
+
+
+class TestInvertedIndex(unittest.TestCase):
+	
+	def setUp(self):
+		self.index = InvertedIndex({'title':10, 'body':1})
+		self.index.add('1', {'title':'Coffee', 'body':'How to make coffee'})
+		self.index.add('2', {'title':'Tea', 'body':'Tea, coffee and other drinks'})
+		self.index.add('3', {'title':'Decaf coffee', 'body':'Coffee without the caffeine'})
+		self.index.add('4', {'title':'Water', 'body':None})
+		
+		
+	def test_search(self):
+		"""
+		Should find items with any of the words, best matches first
+		"""
+		self.assertEquals([key for score, key in self.index.search('coffee')], ['1', '3', '2'])
+		self.assertEquals([key for score, key in self.index.search('TEA water')], ['2', '4'])
+		self.assertEquals(self.index.search('juice'), [])
+		
+		
+	def test_exclude(self):
+		"""
+		Should leave out items with excluded words
+		"""
+		self.assertEquals([key for score, key in self.index.search('coffee -decaf')], ['1', '2'])
+		
+		
+	def test_weights(self):
+		"""
+		Matches in fields with more weight should score higher
+		"""
+		scores = dict((key, score) for score, key in self.index.search('tea'))
+		index = InvertedIndex({'title':1, 'body':10})
+		index.add('2', {'title':'Tea', 'body':'Tea, coffee and other drinks'})
+		self.assertTrue(scores['2'] > index.search('tea')[0][0])
+		
+		
+	def test_page(self):
+		"""
+		Should page through results with a cursor, breaking ties by key
+		"""
+		index = InvertedIndex({'title':1})
+		for key in ('c', 'a', 'd', 'b'):
+			index.add(key, {'title':'coffee'})
+		index.add('e', {'title':'coffee coffee'})
+		first = index.search('coffee', limit=2)
+		self.assertEquals([key for score, key in first], ['e', 'a'])
+		rest = index.search('coffee', after=first[-1])
+		self.assertEquals([key for score, key in rest], ['b', 'c', 'd'])
+		self.assertEquals(index.search('coffee', after=first[-1], offset=1, limit=1), rest[1:2])
+		
+		
+	def test_update(self):
+		"""
+		Adding an item again should replace it, and removed items shouldn't be found
+		"""
+		self.index.add('4', {'title':'Iced coffee'})
+		self.assertEquals(self.index.search('water'), [])
+		self.assertEquals(self.index.search('iced')[0][1], '4')
+		self.index.remove('1')
+		self.index.remove('1')
+		self.assertEquals([key for score, key in self.index.search('coffee')], ['3', '4', '2'])
+		self.assertEquals(len(self.index), 3)
+		
+		
+	def test_parse_after(self):
+		"""
+		Should parse a cursor of a score and an id
+		"""
+		self.assertEquals(parse_after(['1.5', 'abc']), (1.5, 'abc'))
+		for value in ('abc', [1.5], ['high', 'abc'], None):
+			with self.assertRaises(CompoundValidationError):
+				parse_after(value)
@@ -1,8 +1,38 @@
 import unittest
 import json
 from datetime import datetime
+from collections import OrderedDict
 from cStringIO import StringIO
+from bson.objectid import ObjectId
 from cellardoor.serializers import JSONSerializer
+from cellardoor.serializers.json_serializer import CellarDoorJSONEncoder, JSONBackend, StdlibJSONBackend, \
+	json_backends, register_json_backend, get_json_backend, type_encoders
+from cellardoor.serializers.benchmark import make_items, benchmark
+from cellardoor.model import Model, Text, DateTime, ListOf, Compound, OneOf, Integer, Anything
+from cellardoor.api.interface import PreparedItem
+from cellardoor.storage import Storage
+
+
+model = Model(storage=Storage())
+
+
+class Event(model.Entity):
+	name = Text()
+	when = DateTime()
+	reminders = ListOf(DateTime())
+	schedule = ListOf(Compound(starts=DateTime(), room=Text()))
+	
+	
+class Party(Event):
+	ends = OneOf(DateTime(), Text())
+	guests = Integer()
+	extra = Anything()
+	
+	
+def prepared(entity, **fields):
+	item = PreparedItem(fields)
+	item.entity = entity
+	return item
 
 
 class TestJSONSerializer(unittest.TestCase):
@@ -73,6 +103,51 @@ class TestJSONSerializer(unittest.TestCase):
 		)
 		
 		
+	def test_entity_date_unserialization(self):
+		"""
+		Should only turn date objects into datetimes where an entity has date fields
+		"""
+		serializer = JSONSerializer()
+		date = {'_date':'2014-12-09T21:30:22.272Z'}
+		when = datetime(2014, 12, 9, 21, 30, 22, 272)
+		obj = serializer.unserialize(StringIO(json.dumps({
+			'name': date,
+			'when': date,
+			'reminders': [date, date],
+			'schedule': [{'starts':date, 'room':date}],
+			'ends': date
+		})), entity=Event)
+		self.assertEquals(obj, {
+			'name': date,
+			'when': when,
+			'reminders': [when, when],
+			'schedule': [{'starts':when, 'room':date}],
+			'ends': when
+		})
+		
+		obj = serializer.unserialize_string(json.dumps({'$push':{'reminders':date}, '$inc':{'name':date}}), entity=Event)
+		self.assertEquals(obj, {'$push':{'reminders':when}, '$inc':{'name':date}})
+		
+		
+	def test_filter_date_unserialization(self):
+		"""
+		Should only turn date objects into datetimes where they're compared to date fields in a filter
+		"""
+		serializer = JSONSerializer()
+		date = {'_date':'2014-12-09T21:30:22.272Z'}
+		when = datetime(2014, 12, 9, 21, 30, 22, 272)
+		obj = serializer.unserialize_filter(json.dumps({
+			'name': date,
+			'when': {'$gte':date, '$not':{'$in':[date]}},
+			'$or': [{'reminders':date}, {'schedule.starts':{'$lt':date}}, {'schedule.room':date}]
+		}), entity=Event)
+		self.assertEquals(obj, {
+			'name': date,
+			'when': {'$gte':when, '$not':{'$in':[when]}},
+			'$or': [{'reminders':when}, {'schedule.starts':{'$lt':when}}, {'schedule.room':date}]
+		})
+		
+		
 	def test_iterables(self):
 		"""
 		Should serialize any iterable
@@ -88,6 +163,162 @@ class TestJSONSerializer(unittest.TestCase):
 		self.assertEquals(unserialized_obj, {'foo': [0,1,2,3,4]})
 		
 		
+	def test_native_types(self):
+		"""
+		Should serialize dates, ids, sets and subclasses of them
+		"""
+		class Moment(datetime):
+			pass
+		serializer = JSONSerializer()
+		obj = {
+			'when': datetime(2014, 9, 5, 9, 23),
+			'moment': Moment(2014, 9, 5, 9, 23),
+			'id': ObjectId('54d1c1d1a4e4a5c3f1b8e2a7'),
+			'tags': set(['a']),
+			'frozen': frozenset(['b'])
+		}
+		self.assertEquals(json.loads(serializer.serialize(obj)), {
+			'when': '2014-09-05T09:23:00',
+			'moment': '2014-09-05T09:23:00',
+			'id': '54d1c1d1a4e4a5c3f1b8e2a7',
+			'tags': ['a'],
+			'frozen': ['b']
+		})
+		
+		
+	def test_backends(self):
+		"""
+		Every installed backend should give the same output as the standard library
+		"""
+		obj = make_items(20)
+		expected = json.dumps(obj, cls=CellarDoorJSONEncoder)
+		compact = json.dumps(obj, cls=CellarDoorJSONEncoder, separators=(',', ':'))
+		for backend in json_backends:
+			try:
+				serializer = JSONSerializer(backend=backend.name)
+			except ImportError:
+				continue
+			self.assertEquals(serializer.serialize(obj), expected)
+			self.assertEquals(JSONSerializer(backend=backend.name, compact=True).serialize(obj), compact)
+		self.assertTrue('json' in benchmark(items=5, repeat=1))
+			
+			
+	def test_choose_backend(self):
+		"""
+		Should pick the most preferred backend that's installed
+		"""
+		class MissingBackend(JSONBackend):
+			name = 'missing'
+			def __init__(self):
+				raise ImportError('No module named missing')
+				
+		register_json_backend(MissingBackend)
+		try:
+			self.assertEquals(json_backends[0], MissingBackend)
+			self.assertNotEquals(get_json_backend().name, 'missing')
+			with self.assertRaises(ImportError):
+				get_json_backend('missing')
+		finally:
+			json_backends.remove(MissingBackend)
+		self.assertTrue(isinstance(get_json_backend('json'), StdlibJSONBackend))
+		with self.assertRaises(ValueError):
+			get_json_backend('nope')
+			
+			
+	def test_stream(self):
+		"""
+		Should read the items of an array body one at a time, even when they're split across reads
+		"""
+		serializer = JSONSerializer()
+		serializer.read_size = 4
+		items = [{'name':u'caf\xe9 %d' % i, 'when':{'_date':'2014-09-05T09:23:00Z'}} for i in range(10)]
+		stream = StringIO(' \n' + json.dumps(items))
+		result = serializer.unserialize_stream(stream, entity=Event)
+		self.assertEquals(next(result), {'name':u'caf\xe9 0', 'when':datetime(2014, 9, 5, 9, 23)})
+		self.assertTrue(stream.tell() < len(stream.getvalue()))
+		self.assertEquals(len(list(result)), 9)
+		
+		self.assertEquals(list(serializer.unserialize_stream(StringIO('[ ]'))), [])
+		self.assertEquals(list(serializer.unserialize_stream(StringIO('[1, 23456, "a"]'))), [1, 23456, 'a'])
+		self.assertEquals(list(serializer.unserialize_stream(StringIO('[1] \r\n  \t  \n'))), [1])
+		self.assertEquals(serializer.unserialize_stream(StringIO('{"name": "foo"}')), {'name':'foo'})
+		
+		
+	def test_stream_fail(self):
+		"""
+		Should raise an error when a streamed array is malformed or an item is too large
+		"""
+		serializer = JSONSerializer()
+		serializer.read_size = 4
+		for body in ('[1, 2', '[1 2]', '[1,]', '[{"a": }]', '[{"a": 1}] garbage', '[]]', '[1] \n  \t x'):
+			with self.assertRaises(ValueError):
+				list(serializer.unserialize_stream(StringIO(body)))
+		serializer.max_item_size = 16
+		with self.assertRaises(ValueError):
+			list(serializer.unserialize_stream(StringIO(json.dumps([{'name':'x' * 32}]))))
+		
+		
+	def test_compiled_items(self):
+		"""
+		Prepared items are encoded by compiled encoders, with their keys in order
+		"""
+		items = [
+			prepared(Event, _id=ObjectId('54d1c1d1a4e4a5c3f1b80001'), name=u'Caf\xe9 \u2014 "night"', guests=12,
+				when=datetime(2014, 9, 5, 9, 23, 30, 1500), extra={'b': [1, 2.5, None], 'a': True}, ends='late'),
+			prepared(Event, _id='1', name=None, guests=2 ** 70, when='soon', extra=set(['x']), ends=datetime(2014, 9, 5)),
+			prepared(Event, _id='2', name='plain', guests=True, when=None, extra=u'\u2603', ends=None),
+			prepared(Event)
+		]
+		for compact in (False, True):
+			serializer = JSONSerializer(backend='json', compact=compact)
+			generic = JSONSerializer(backend='json', compact=compact, compile_items=False)
+			for item in items:
+				data = serializer.serialize(item)
+				self.assertEquals(data, json.dumps(json.loads(generic.serialize(item)), sort_keys=True, 
+					separators=(',', ':') if compact else (', ', ': ')))
+			self.assertEquals(len(serializer.item_encoders), 2)
+			self.assertEquals(serializer.serialize(items), generic.serialize(items))
+			
+			
+	def test_compiled_items_key_order(self):
+		"""
+		Items with the same keys share an encoder whatever order their keys are in
+		"""
+		class Item(OrderedDict):
+			entity = Event
+		serializer = JSONSerializer()
+		first = Item([('name', 'a'), ('guests', 1)])
+		second = Item([('guests', 1), ('name', 'a')])
+		self.assertEquals(serializer.serialize(first), '{"guests": 1, "name": "a"}')
+		self.assertEquals(serializer.serialize(second), '{"guests": 1, "name": "a"}')
+		self.assertEquals(len(serializer.item_encoders), 1)
+		
+		
+	def test_compiled_items_date_encoder(self):
+		"""
+		Compiled encoders write dates with the date encoder in type_encoders
+		"""
+		encode = type_encoders[datetime]
+		type_encoders[datetime] = lambda d: d.strftime('%Y-%m-%d')
+		try:
+			serializer = JSONSerializer()
+			self.assertEquals(serializer.serialize(prepared(Event, when=datetime(2014, 9, 5, 9, 23))), '{"when": "2014-09-05"}')
+		finally:
+			type_encoders[datetime] = encode
+		
+		
+	def test_compiled_items_limit(self):
+		"""
+		Items are encoded by the backend once there are too many sets of keys to compile encoders for
+		"""
+		serializer = JSONSerializer()
+		serializer.max_item_encoders = 1
+		self.assertEquals(serializer.serialize(prepared(Event, name='a', guests=1)), '{"guests": 1, "name": "a"}')
+		self.assertEquals(json.loads(serializer.serialize(prepared(Event, name='a'))), {'name':'a'})
+		self.assertEquals(serializer.serialize(prepared(Event, name='b', guests=2)), '{"guests": 2, "name": "b"}')
+		self.assertEquals(len(serializer.item_encoders), 1)
+		
+		
 	def test_fail(self):
 		"""
 		Should raise an exception when trying to serialize other things
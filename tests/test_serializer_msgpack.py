@@ -1,8 +1,11 @@
 import unittest
+import struct
 import msgpack
 from datetime import datetime
 from cStringIO import StringIO
+from bson.objectid import ObjectId
 from cellardoor.serializers import MsgPackSerializer
+from cellardoor.serializers.msgpack_serializer import DATETIME_EXT, OBJECTID_EXT
 
 
 class TestJSONSerializer(unittest.TestCase):
@@ -48,6 +51,29 @@ class TestJSONSerializer(unittest.TestCase):
 		)
 		
 		
+	def test_ext_types(self):
+		"""
+		Should pack dates and ids as extension types if asked to, and unpack them either way
+		"""
+		obj = {
+			'seconds': datetime(2014, 9, 5, 9, 23),
+			'microseconds': datetime(2014, 9, 5, 9, 23, 1, 272),
+			'distant': datetime(2600, 1, 1, 0, 0, 0, 5),
+			'ancient': datetime(1900, 1, 1, 12, 30),
+			'id': ObjectId('54d1c1d1a4e4a5c3f1b8e2a7'),
+			'tags': set(['a'])
+		}
+		serializer = MsgPackSerializer(ext_types=True)
+		packed = serializer.serialize(obj)
+		raw = msgpack.unpackb(packed)
+		self.assertEquals(raw['seconds'], msgpack.ExtType(DATETIME_EXT, struct.pack('!I', 1409908980)))
+		self.assertEquals(len(raw['microseconds'].data), 8)
+		self.assertEquals(len(raw['distant'].data), 12)
+		self.assertEquals(raw['id'].code, OBJECTID_EXT)
+		self.assertEquals(serializer.unserialize(StringIO(packed)), dict(obj, tags=['a']))
+		self.assertEquals(MsgPackSerializer().unserialize(StringIO(packed)), dict(obj, tags=['a']))
+		
+		
 	def test_iterables(self):
 		"""
 		Should serialize any iterable
@@ -63,6 +89,38 @@ class TestJSONSerializer(unittest.TestCase):
 		self.assertEquals(unserialized_obj, {'foo': [0,1,2,3,4]})
 		
 		
+	def test_stream(self):
+		"""
+		Should read the items of an array body one at a time
+		"""
+		serializer = MsgPackSerializer()
+		serializer.read_size = 4
+		stream = StringIO(msgpack.packb([{'name':'foo %d' % i} for i in range(10)]))
+		result = serializer.unserialize_stream(stream)
+		self.assertEquals(next(result), {'name':'foo 0'})
+		self.assertTrue(stream.tell() < len(stream.getvalue()))
+		self.assertEquals(len(list(result)), 9)
+		self.assertEquals(serializer.unserialize_stream(StringIO(msgpack.packb({'name':'foo'}))), {'name':'foo'})
+		
+		serializer.max_item_size = 16
+		with self.assertRaises(ValueError) as cm:
+			list(serializer.unserialize_stream(StringIO(msgpack.packb([{'name':'x' * 32}]))))
+		self.assertEquals(cm.exception.message, 'An item is larger than 16 bytes')
+		
+		
+	def test_stream_fail(self):
+		"""
+		Should raise an error when a streamed body is cut off or has anything after it
+		"""
+		serializer = MsgPackSerializer()
+		serializer.read_size = 4
+		for body in (msgpack.packb([1, 2, 3])[:-1], msgpack.packb([{'a': 1}]) + 'garbage', msgpack.packb([1]) + '\xc1'):
+			with self.assertRaises(ValueError):
+				list(serializer.unserialize_stream(StringIO(body)))
+		with self.assertRaises(ValueError):
+			serializer.unserialize_stream(StringIO(msgpack.packb({'a': 1}) + msgpack.packb(2)))
+		
+		
 	def test_fail(self):
 		"""
 		Should raise an exception when trying to serialize other things
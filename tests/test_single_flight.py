@@ -0,0 +1,143 @@
+import unittest
+import time
+import threading
+from mock import Mock
+from cellardoor.wsgi.single_flight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+
+	def start(self, single_flight, key, fn, results):
+		def run():
+			try:
+				results.append(single_flight.do(key, fn))
+			except Exception, e:
+				results.append(e)
+		thread = threading.Thread(target=run)
+		thread.start()
+		return thread
+		
+		
+	def wait_for_waiters(self, single_flight, key, count):
+		call = single_flight.calls[key]
+		while call.waiters < count:
+			time.sleep(0.001)
+			
+			
+	def test_do(self):
+		"""
+		Should return the result of the function
+		"""
+		single_flight = SingleFlight()
+		self.assertEquals(single_flight.do('a', lambda: 1), 1)
+		self.assertEquals(single_flight.do('a', lambda: 2), 2)
+		self.assertEquals(single_flight.calls, {})
+		
+		
+	def test_share(self):
+		"""
+		Concurrent calls with the same key should share the result of the first
+		"""
+		single_flight = SingleFlight()
+		started = threading.Event()
+		release = threading.Event()
+		def slow():
+			started.set()
+			release.wait()
+			return 'result'
+		fn = Mock(side_effect=slow)
+		results = []
+		
+		threads = [self.start(single_flight, 'a', fn, results)]
+		started.wait()
+		threads += [self.start(single_flight, 'a', fn, results) for i in range(3)]
+		self.wait_for_waiters(single_flight, 'a', 3)
+		release.set()
+		for thread in threads:
+			thread.join()
+			
+		self.assertEquals(results, ['result'] * 4)
+		self.assertEquals(fn.call_count, 1)
+		self.assertEquals(single_flight.shared, 3)
+		
+		
+	def test_different_keys(self):
+		"""
+		Calls with different keys should not be shared
+		"""
+		single_flight = SingleFlight()
+		started = threading.Event()
+		release = threading.Event()
+		def slow():
+			started.set()
+			release.wait()
+			return 'a'
+		results = []
+		thread = self.start(single_flight, 'a', slow, results)
+		started.wait()
+		self.assertEquals(single_flight.do('b', lambda: 'b'), 'b')
+		release.set()
+		thread.join()
+		self.assertEquals(results, ['a'])
+		
+		
+	def test_share_error(self):
+		"""
+		Concurrent calls should share the error raised by the first
+		"""
+		single_flight = SingleFlight()
+		started = threading.Event()
+		release = threading.Event()
+		def slow():
+			started.set()
+			release.wait()
+			raise ValueError('nope')
+		results = []
+		
+		threads = [self.start(single_flight, 'a', slow, results)]
+		started.wait()
+		threads.append(self.start(single_flight, 'a', slow, results))
+		self.wait_for_waiters(single_flight, 'a', 1)
+		release.set()
+		for thread in threads:
+			thread.join()
+			
+		self.assertEquals(len(results), 2)
+		for result in results:
+			self.assertTrue(isinstance(result, ValueError))
+		self.assertEquals(single_flight.calls, {})
+		
+		
+	def test_timeout(self):
+		"""
+		A call that waits too long should stop waiting and call the function itself
+		"""
+		single_flight = SingleFlight(timeout=0.01)
+		started = threading.Event()
+		release = threading.Event()
+		def slow():
+			started.set()
+			release.wait()
+			return 'slow'
+		results = []
+		thread = self.start(single_flight, 'a', slow, results)
+		started.wait()
+		self.assertEquals(single_flight.do('a', lambda: 'fast'), 'fast')
+		release.set()
+		thread.join()
+		self.assertEquals(results, ['slow'])
+		self.assertEquals(single_flight.shared, 0)
+		
+		
+	def test_key(self):
+		"""
+		Requests from different identities should have different keys
+		"""
+		single_flight = SingleFlight()
+		interface = Mock()
+		interface.plural_name = 'foos'
+		bob = single_flight.key(interface, 'list', {'sort':['+name'], 'context':{'identity':{'id':'bob'}}}, 'application/json')
+		jim = single_flight.key(interface, 'list', {'sort':['+name'], 'context':{'identity':{'id':'jim'}}}, 'application/json')
+		self.assertNotEquals(bob, jim)
+		self.assertEquals(bob, single_flight.key(interface, 'list', {'context':{'identity':{'id':'bob'}}, 'sort':['+name']}, 'application/json'))
+		
\ No newline at end of file
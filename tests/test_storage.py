@@ -26,4 +26,7 @@ class TestStorage(unittest.TestCase):
 			storage.delete(None, None)
 			
 		with self.assertRaises(NotImplementedError):
-			storage.check_filter(None, None, None)
\ No newline at end of file
+			storage.check_filter(None, None, None)
+			
+		with self.assertRaises(NotImplementedError):
+			storage.iterate(None)
\ No newline at end of file
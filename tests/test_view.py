@@ -1,6 +1,7 @@
-from cellardoor.views import View
+from cellardoor.views import View, Negotiator, get_negotiator
 from cellardoor.serializers import Serializer
 import unittest
+from mock import Mock
 
 
 class FooSerializer(Serializer):
@@ -56,4 +57,55 @@ class TestView(unittest.TestCase):
 		content_type, result = view.serialize('text/xml', {})
 		self.assertEquals(content_type, 'application/x-foo')
 		self.assertEquals(result, 'Foo')
-		
\ No newline at end of file
+		
+		
+	def test_content_type_parameters(self):
+		"""
+		Media types with different parameters are told apart, but qualities are ignored
+		"""
+		view = View()
+		view.serializers = (
+			('application/x-foo', FooSerializer()),
+			('application/x-foo; bar=1', BarSerializer())
+		)
+		self.assertEquals(view.serialize('application/x-foo;bar=1', {}), ('application/x-foo; bar=1', 'Bar'))
+		self.assertEquals(view.serialize('text/xml;q=1.0, Application/X-Foo; BAR="1"; q=0.5', {}), ('application/x-foo; bar=1', 'Bar'))
+		self.assertEquals(view.serialize('application/x-foo; q=0.5; bar=1', {}), ('application/x-foo', 'Foo'))
+		self.assertEquals(view.serialize('application/x-foo; bar=2', {}), ('application/x-foo', 'Foo'))
+		
+		
+		
+	def test_content_type_quality(self):
+		"""
+		The acceptable serializer with the highest quality is chosen, with wildcards matching any
+		"""
+		offers = (('application/x-foo', 'Foo'), ('application/x-bar', 'Bar'), ('text/x-baz', 'Baz'))
+		negotiator = Negotiator(offers)
+		self.assertEquals(negotiator.choose('application/x-foo;q=0.5, application/x-bar'), ('application/x-bar', 'Bar'))
+		self.assertEquals(negotiator.choose('application/x-bar;q=0.1, text/*;q=0.2'), ('text/x-baz', 'Baz'))
+		self.assertEquals(negotiator.choose('application/*;q=0.5, */*;q=0.9'), ('text/x-baz', 'Baz'))
+		self.assertEquals(negotiator.choose('application/x-bar, application/x-foo'), ('application/x-bar', 'Bar'))
+		self.assertEquals(negotiator.choose('*/*;q=0.5, application/x-foo;q=0'), ('application/x-bar', 'Bar'))
+		self.assertEquals(negotiator.choose('text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8'), ('application/x-foo', 'Foo'))
+		self.assertEquals(negotiator.choose('application/x-bar;q=0, text/x-baz;q=0'), ('application/x-foo', 'Foo'))
+		self.assertEquals(negotiator.choose('application/x-bar;q=nope, text/x-baz'), ('text/x-baz', 'Baz'))
+		self.assertEquals(negotiator.choose(None), ('application/x-foo', 'Foo'))
+		
+		
+	def test_negotiation_cache(self):
+		"""
+		Choices are cached by Accept header, and negotiators by the offers they choose from
+		"""
+		offers = (('application/x-foo', 'Foo'), ('application/x-bar', 'Bar'))
+		negotiator = get_negotiator(offers)
+		self.assertTrue(get_negotiator(list(offers)) is negotiator)
+		
+		negotiator.negotiate = Mock(wraps=negotiator.negotiate)
+		for i in range(3):
+			self.assertEquals(View.choose('application/x-bar', offers), ('application/x-bar', 'Bar'))
+		self.assertEquals(negotiator.negotiate.call_count, 1)
+		
+		negotiator = Negotiator(offers, max_size=1)
+		negotiator.choose('application/x-bar')
+		negotiator.choose('application/x-foo')
+		self.assertEquals(len(negotiator.cache), 1)
@@ -0,0 +1,71 @@
+import unittest
+import json
+import msgpack
+from cellardoor.views import ColumnarView
+from cellardoor.views.columnar import to_columns
+from cellardoor.serializers import arrow_serializer
+from cellardoor.serializers.arrow_serializer import ArrowSerializer
+
+
+class TestColumnarView(unittest.TestCase):
+	
+	def test_to_columns(self):
+		"""
+		Should give each field once, in the order first seen, with None for missing values
+		"""
+		table = to_columns([{'_id':'1', 'name':'foo'}, {'_id':'2', 'size':3}])
+		self.assertEquals(table, {
+			'fields': ['_id', 'name', 'size'],
+			'columns': [['1', '2'], ['foo', None], [None, 3]]
+		})
+		self.assertEquals(to_columns([]), {'fields': [], 'columns': []})
+		
+		
+	def test_list_response(self):
+		"""
+		Should return a header of field names and a column per field
+		"""
+		view = ColumnarView()
+		objs = [{'_id':'1', 'name':'foo'}, {'_id':'2', 'name':'bar'}]
+		
+		content_type, result = view.get_list_response('application/vnd.cellardoor.columns+json', objs)
+		self.assertEquals(content_type, 'application/vnd.cellardoor.columns+json')
+		result = json.loads(result)
+		self.assertEquals(sorted(zip(result['fields'], result['columns'])), [('_id', ['1', '2']), ('name', ['foo', 'bar'])])
+		
+		content_type, result = view.get_list_response('application/vnd.cellardoor.columns+msgpack', objs)
+		self.assertEquals(content_type, 'application/vnd.cellardoor.columns+msgpack')
+		self.assertEquals(msgpack.unpackb(result), to_columns(objs))
+		
+		
+	def test_individual_response(self):
+		"""
+		Should return single items as they are
+		"""
+		view = ColumnarView()
+		content_type, result = view.get_individual_response('application/vnd.cellardoor.columns+json', {'foo':123})
+		self.assertEquals(content_type, 'application/vnd.cellardoor.columns+json')
+		self.assertEquals(json.loads(result), {'foo':123})
+		
+		
+	def test_arrow(self):
+		"""
+		Should only offer Arrow when pyarrow is installed, and only for responses
+		"""
+		self.assertTrue(ArrowSerializer.output_only)
+		self.assertFalse(hasattr(ArrowSerializer, 'unserialize'))
+		mimetypes = [k for k, _ in ColumnarView.serializers]
+		if arrow_serializer.pyarrow is None:
+			self.assertFalse(ArrowSerializer.mimetype in mimetypes)
+			with self.assertRaises(ImportError):
+				ArrowSerializer()
+			return
+		
+		view = ColumnarView()
+		objs = [{'_id':'1', 'size':3, 'extra':'a'}, {'_id':'2', 'size':4, 'extra':5}]
+		content_type, result = view.get_list_response(ArrowSerializer.mimetype, objs)
+		self.assertEquals(content_type, ArrowSerializer.mimetype)
+		table = arrow_serializer.pyarrow.ipc.open_stream(result).read_all().to_pydict()
+		self.assertEquals(table['_id'], ['1', '2'])
+		self.assertEquals(table['size'], [3, 4])
+		self.assertEquals(table['extra'], ['"a"', '5'])
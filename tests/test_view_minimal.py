@@ -1,7 +1,9 @@
 import unittest
 import json
 import msgpack
+from datetime import datetime
 from cellardoor.views import MinimalView
+from cellardoor.serializers.msgpack_serializer import ext_hook
 
 
 class TestMinimalView(unittest.TestCase):
@@ -35,4 +37,19 @@ class TestMinimalView(unittest.TestCase):
 		
 		content_type, result = view.get_individual_response('application/x-msgpack', obj)
 		self.assertEquals(content_type, 'application/x-msgpack')
-		self.assertEquals(result, msgpack.packb(obj))
\ No newline at end of file
+		self.assertEquals(result, msgpack.packb(obj))
+		
+		
+	def test_msgpack_ext_types(self):
+		"""
+		Should only pack dates as extension types for clients that ask for them
+		"""
+		view = MinimalView()
+		obj = {'when':datetime(2014, 9, 5, 9, 23)}
+		
+		content_type, result = view.get_individual_response('application/x-msgpack', obj)
+		self.assertEquals(msgpack.unpackb(result), {'when':'2014-09-05T09:23:00'})
+		
+		content_type, result = view.get_individual_response('application/x-msgpack; ext=1', obj)
+		self.assertEquals(content_type, 'application/x-msgpack; ext=1')
+		self.assertEquals(msgpack.unpackb(result, ext_hook=ext_hook), obj)
\ No newline at end of file
@@ -0,0 +1,57 @@
+import unittest
+import json
+from cellardoor.views import View, MinimalView, NDJSONView
+
+
+class TestNDJSONView(unittest.TestCase):
+	
+	def test_list_response(self):
+		"""
+		Should return one item per line
+		"""
+		view = NDJSONView()
+		objs = [{'foo':123}, {'foo':'a\nb'}]
+		content_type, result = view.get_list_response('application/x-ndjson', objs)
+		self.assertEquals(content_type, 'application/x-ndjson')
+		self.assertEquals(result, '{"foo":123}\n{"foo":"a\\nb"}\n')
+		self.assertEquals([json.loads(line) for line in result.splitlines()], objs)
+		
+		
+	def test_list_stream(self):
+		"""
+		Should only read as many items as it needs for each piece of the response
+		"""
+		view = NDJSONView()
+		view.chunk_size = 30
+		read = []
+		def objs():
+			for i in range(5):
+				read.append(i)
+				yield {'foo':'x' * 10}
+		content_type, pieces = view.get_list_stream('application/x-ndjson', objs())
+		self.assertEquals(content_type, 'application/x-ndjson')
+		self.assertEquals(read, [])
+		self.assertEquals(next(pieces), '{"foo":"xxxxxxxxxx"}\n' * 2)
+		self.assertEquals(read, [0, 1])
+		self.assertEquals(''.join(pieces), '{"foo":"xxxxxxxxxx"}\n' * 3)
+		
+		
+	def test_individual_response(self):
+		"""
+		Should return a single line for individual get methods
+		"""
+		view = NDJSONView()
+		content_type, result = view.get_individual_response('application/x-ndjson', {'foo':123})
+		self.assertEquals(content_type, 'application/x-ndjson')
+		self.assertEquals(result, '{"foo":123}\n')
+		
+		
+	def test_choose(self):
+		"""
+		Should be chosen alongside other views by its media type
+		"""
+		views = [(k, v) for view in (MinimalView(), NDJSONView()) for k, _ in view.serializers for v in (view,)]
+		_, view = View.choose('application/x-ndjson', views)
+		self.assertTrue(view.streaming)
+		_, view = View.choose('application/json', views)
+		self.assertFalse(view.streaming)